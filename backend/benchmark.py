@@ -0,0 +1,837 @@
+"""Load-test and benchmark harness for the Travel Planner API.
+
+Starts local stub servers in place of Gemini and OpenRouteService, seeds a
+database at the chosen scale, boots the API (gunicorn if installed, otherwise
+the threaded development server) and drives it with a closed-loop load
+generator. Per-endpoint p50/p95/p99 latency and throughput are written to a
+JSON file that can be compared across commits:
+
+    python benchmark.py --suite mixed --scale small --duration 30
+    python benchmark.py --compare before.json after.json
+
+Suites:
+    mixed             every endpoint group under a weighted mix
+    itinerary-fanout  single-shot vs per-day fan-out generation (cache misses)
+    bulk-import       one bulk request of --bulk-rows expenses vs single-row inserts
+    login-kdf         login throughput at each password KDF cost setting
+    serialization     in-process row/model to JSON cost for large itineraries, legacy vs fast path
+"""
+import argparse
+import dataclasses
+import json
+import math
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCALES = {
+    # users, plans per user, expenses per plan
+    'small': (20, 5, 20),
+    'medium': (200, 10, 50),
+    'large': (1000, 20, 100),
+}
+
+BENCH_PASSWORD = 'bench-password'
+DESTINATIONS = ['Paris', 'Tokyo', 'Lisbon', 'New York', 'Cape Town', 'Hanoi', 'Reykjavik', 'Lima',
+                'Istanbul', 'Sydney', 'Marrakesh', 'Vancouver', 'Seoul', 'Prague', 'Buenos Aires']
+INTERESTS = ['culture', 'food', 'nature', 'nightlife', 'history', 'shopping', 'art']
+CATEGORIES = ['food', 'accommodation', 'transportation', 'activities', 'shopping']
+
+# Upstream stubs
+class StubConfig:
+    """Latency and failure behaviour shared by a stub server's handler threads"""
+    def __init__(self, latency_ms: float, jitter: float, failure_rate: float, seed: int,
+                 token_latency_ms: float = 0):
+        self.latency_ms = latency_ms
+        self.token_latency_ms = token_latency_ms
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+
+    def next_delay(self) -> Tuple[float, bool]:
+        with self._lock:
+            self.requests += 1
+            spread = self.latency_ms * self.jitter
+            delay = max(self.latency_ms + self._random.uniform(-spread, spread), 0) / 1000
+            failed = self._random.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+        return delay, failed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'requests': self.requests, 'failures': self.failures}
+
+def stub_activity(day: int, index: int) -> Dict:
+    return {
+        'name': f'Stop {day}.{index}',
+        'description': 'Synthetic activity from the benchmark stub',
+        'time': f'{9 + 3 * index:02d}:00',
+        'duration': 2,
+        'cost': 25 + 5 * index,
+        'category': 'sightseeing',
+        'location': {'lat': 48.85 + day * 0.01, 'lng': 2.35 + index * 0.01}
+    }
+
+def stub_day(day: int) -> Dict:
+    return {'day': day, 'activities': [stub_activity(day, i) for i in range(3)]}
+
+def stub_itinerary_text(prompt: str) -> str:
+    """Answer whichever prompt shape AIItineraryService sent"""
+    outline = re.search(r'Outline a (\d+)-day trip', prompt)
+    if outline:
+        days = int(outline.group(1))
+        return json.dumps({
+            'days': [{'day': d, 'area': f'Area {d}', 'theme': 'Highlights', 'activities_budget': 90}
+                     for d in range(1, days + 1)],
+            'budget_breakdown': {'accommodation': 600, 'food': 400, 'activities': 300, 'transportation': 200}
+        })
+    single = re.search(r'Plan day (\d+) of', prompt)
+    if single:
+        return json.dumps(stub_day(int(single.group(1))))
+    only = re.search(r'Only produce days ([\d, ]+)\.', prompt)
+    if only:
+        return json.dumps({'days': [stub_day(int(d)) for d in only.group(1).split(',')]})
+    duration = re.search(r'Duration: (\d+) days', prompt)
+    days = int(duration.group(1)) if duration else 3
+    return json.dumps({
+        'days': [stub_day(d) for d in range(1, days + 1)],
+        'total_estimated_cost': 90 * days,
+        'budget_breakdown': {'accommodation': 600, 'food': 400, 'activities': 90 * days, 'transportation': 200}
+    })
+
+def gemini_response(text: str) -> Dict:
+    return {
+        'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}, 'finishReason': 'STOP', 'index': 0}],
+        'usageMetadata': {'promptTokenCount': 400, 'candidatesTokenCount': len(text) // 4,
+                          'totalTokenCount': 400 + len(text) // 4}
+    }
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves both the Gemini REST API and the OpenRouteService endpoints the app calls"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body, headers: Dict = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}') if length else {}
+        path = urlparse(self.path).path
+        config: StubConfig = self.server.stub_config
+        delay, failed = config.next_delay()
+        time.sleep(delay)
+
+        if path.startswith('/v1beta/models/'):
+            if failed:
+                return self._send(500, {'error': {'code': 500, 'message': 'stub failure', 'status': 'INTERNAL'}})
+            prompt = ' '.join(part.get('text', '') for content in payload.get('contents', [])
+                              for part in content.get('parts', []))
+            text = stub_itinerary_text(prompt)
+            # Generation time grows with output length (~4 characters per token)
+            time.sleep(config.token_latency_ms * len(text) / 4 / 1000)
+            if ':streamGenerateContent' in path:
+                size = max(len(text) // 8, 1)
+                return self._send(200, [gemini_response(text[i:i + size]) for i in range(0, len(text), size)])
+            return self._send(200, gemini_response(text))
+
+        if failed:
+            return self._send(503, {'error': 'stub failure'}, {'Retry-After': '0'})
+        if path == '/geocoding':
+            query = parse_qs(urlparse(self.path).query).get('text', ['place'])[0]
+            return self._send(200, {'features': [{
+                'properties': {'name': f'{query} {i}', 'formatted': f'{i} Stub Street', 'category': 'poi'},
+                'geometry': {'coordinates': [2.35 + i * 0.01, 48.85 + i * 0.01]}
+            } for i in range(5)]})
+        if path.startswith('/v2/directions/'):
+            return self._send(200, {'routes': [{'summary': {'distance': 1234.5, 'duration': 321.0},
+                                                'geometry': 'stub'}]})
+        if path.startswith('/v2/matrix/'):
+            n = len(payload.get('locations', []))
+            grid = [[0.0 if a == b else 100.0 * abs(a - b) for b in range(n)] for a in range(n)]
+            return self._send(200, {'distances': grid, 'durations': grid})
+        self._send(404, {'error': 'unknown stub path'})
+
+    do_GET = _handle
+    do_POST = _handle
+
+def start_stub(config: StubConfig) -> Tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.stub_config = config
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+# Seeding
+def seed_database(path: str, scale: str, seed: int) -> Dict[str, List[str]]:
+    """Create a migrated database with synthetic users, plans and expenses; returns user email -> plan ids"""
+    import tp
+    tp.app.config['DATABASE'] = path
+    tp.init_db()
+
+    users, plans_per_user, expenses_per_plan = SCALES[scale]
+    rng = random.Random(seed)
+    now = datetime(2026, 1, 1)
+    password_hash = tp._compute_password_hash(BENCH_PASSWORD, *tp.password_hasher.current_params())
+    owned: Dict[str, List[str]] = {}
+
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    for u in range(users):
+        user_id, email = str(uuid.uuid4()), f'user{u}@bench.local'
+        conn.execute('INSERT INTO users (id, email, name, password_hash, created_at) VALUES (?, ?, ?, ?, ?)',
+                     (user_id, email, f'Bench User {u}', password_hash, now.isoformat()))
+        owned[email] = []
+        for p in range(plans_per_user):
+            plan_id = str(uuid.uuid4())
+            duration = rng.randint(2, 7)
+            start = now + timedelta(days=rng.randint(0, 300))
+            created = (now + timedelta(minutes=u * plans_per_user + p)).isoformat()
+            conn.execute('''INSERT INTO travel_plans (id, user_id, destination, budget, duration, interests,
+                           start_date, end_date, total_cost, created_at, updated_at)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?)''',
+                         (plan_id, user_id, rng.choice(DESTINATIONS), rng.choice([800, 1500, 3000]), duration,
+                          json.dumps(rng.sample(INTERESTS, 2)), start.date().isoformat(),
+                          (start + timedelta(days=duration)).date().isoformat(), created, created))
+            itinerary = json.loads(stub_itinerary_text(f'Duration: {duration} days'))
+            tp.store_itinerary(conn, plan_id, itinerary)
+            conn.executemany('''INSERT INTO expenses (id, plan_id, category, amount, description, date, created_at)
+                               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                             [(str(uuid.uuid4()), plan_id, rng.choice(CATEGORIES), round(rng.uniform(5, 200), 2),
+                               'Seeded expense', (start + timedelta(days=rng.randint(0, duration))).date().isoformat(),
+                               created) for _ in range(expenses_per_plan)])
+            owned[email].append(plan_id)
+        if u % 50 == 49:
+            conn.commit()
+    conn.commit()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    return owned
+
+def set_password_hashes(path: str, env: Dict[str, str]):
+    """Re-hash the seeded password with the KDF settings a run's server will use"""
+    import tp
+    saved = dict(tp.app.config)
+    try:
+        for name, value in env.items():
+            if name.startswith('FLASK_PASSWORD_'):
+                key = name[len('FLASK_'):]
+                tp.app.config[key] = value if key == 'PASSWORD_KDF' else int(value)
+        password_hash = tp._compute_password_hash(BENCH_PASSWORD, *tp.password_hasher.current_params())
+    finally:
+        tp.app.config.clear()
+        tp.app.config.update(saved)
+    conn = sqlite3.connect(path)
+    conn.execute('UPDATE users SET password_hash = ?', (password_hash,))
+    conn.commit()
+    conn.close()
+
+# API server
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(args, database: str, gemini_url: str, ors_url: str, env_overrides: Dict[str, str]):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'FLASK_DATABASE': database,
+        'FLASK_ORS_BASE_URL': ors_url,
+        'FLASK_GEMINI_API_ENDPOINT': gemini_url,
+        'PORT': str(port),
+        'BIND': f'127.0.0.1:{port}',
+        'WEB_CONCURRENCY': str(args.workers),
+        'GUNICORN_THREADS': str(args.threads),
+        'PYTHONWARNINGS': 'ignore',
+        # Measure capacity rather than the per-user rate limits; suites may set their own
+        'FLASK_RATE_LIMITS': '{}',
+    })
+    env.update(env_overrides)
+    if args.server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+    else:
+        command = [sys.executable, '-c',
+                   'import tp; tp.init_db(); tp.start_services(); '
+                   f'tp.app.run(host="127.0.0.1", port={port}, threaded=True)']
+    log = open(os.path.join(os.path.dirname(database), 'server.log'), 'ab')
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'API server exited with {process.returncode}; see {log.name}')
+        try:
+            if requests.get(f'{base_url}/api/health', timeout=1).ok:
+                return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('API server did not become healthy')
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+# Load generation
+class Recorder:
+    """Collects per-operation latencies, errors and item counts from all load workers"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.items: Dict[str, int] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+
+    def record(self, operation: str, seconds: float, status: int, items: int = 1):
+        with self._lock:
+            self.samples.setdefault(operation, []).append(seconds)
+            self.items[operation] = self.items.get(operation, 0) + items
+            statuses = self.statuses.setdefault(operation, {})
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status == 0 or status >= 400:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+def summarize(recorder: Recorder, elapsed: float) -> Dict:
+    endpoints = {}
+    all_samples = []
+    for operation, samples in sorted(recorder.samples.items()):
+        ordered = sorted(samples)
+        all_samples.extend(samples)
+        errors = recorder.errors.get(operation, 0)
+        endpoints[operation] = {
+            'requests': len(samples),
+            'errors': errors,
+            'error_rate': round(errors / len(samples), 4),
+            'statuses': recorder.statuses[operation],
+            'throughput_rps': round(len(samples) / elapsed, 2),
+            'items_per_s': round(recorder.items[operation] / elapsed, 2),
+            'latency_ms': {
+                'p50': round(percentile(ordered, 50) * 1000, 2),
+                'p95': round(percentile(ordered, 95) * 1000, 2),
+                'p99': round(percentile(ordered, 99) * 1000, 2),
+                'max': round(ordered[-1] * 1000, 2),
+                'mean': round(sum(ordered) / len(ordered) * 1000, 2),
+            }
+        }
+    ordered = sorted(all_samples)
+    total = {
+        'requests': len(ordered),
+        'errors': sum(recorder.errors.values()),
+        'throughput_rps': round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {name: round(percentile(ordered, pct) * 1000, 2)
+                       for name, pct in (('p50', 50), ('p95', 95), ('p99', 99))}
+    }
+    return {'elapsed_s': round(elapsed, 2), 'endpoints': endpoints, 'total': total}
+
+class Client:
+    """One virtual user: a keep-alive session logged in as a seeded user"""
+    def __init__(self, base_url: str, email: str, plan_ids: List[str], rng: random.Random, args):
+        self.base_url = base_url
+        self.email = email
+        self.plan_ids = plan_ids
+        self.rng = rng
+        self.args = args
+        self.session = requests.Session()
+        self.token = None
+
+    def call(self, method: str, path: str, **kwargs) -> requests.Response:
+        headers = kwargs.pop('headers', {})
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        return self.session.request(method, self.base_url + path, headers=headers, timeout=120, **kwargs)
+
+    def login(self) -> requests.Response:
+        response = self.call('POST', '/api/auth/login', json={'email': self.email, 'password': BENCH_PASSWORD})
+        if response.ok:
+            self.token = response.json()['token']
+        return response
+
+    def plan_id(self) -> str:
+        return self.rng.choice(self.plan_ids)
+
+    def new_plan_body(self, destination: str = None, duration: int = 3) -> Dict:
+        return {'destination': destination or self.rng.choice(DESTINATIONS), 'budget': 1500,
+                'duration': duration, 'interests': self.rng.sample(INTERESTS, 2),
+                'start_date': '2026-06-01', 'end_date': '2026-06-0%d' % (1 + duration)}
+
+    def expense_body(self, plan_id: str) -> Dict:
+        return {'plan_id': plan_id, 'category': self.rng.choice(CATEGORIES),
+                'amount': round(self.rng.uniform(5, 200), 2), 'description': 'Benchmark expense',
+                'date': '2026-06-0%d' % self.rng.randint(1, 7)}
+
+# Each operation returns (response, items processed)
+def op_auth_login(client: Client):
+    return client.login(), 1
+
+def op_auth_me(client: Client):
+    return client.call('GET', '/api/auth/me'), 1
+
+def op_plans_list(client: Client):
+    return client.call('GET', '/api/travel-plans?limit=20&summary=true'), 1
+
+def op_plan_get(client: Client):
+    return client.call('GET', f'/api/travel-plans/{client.plan_id()}'), 1
+
+def op_plan_create(client: Client):
+    response = client.call('POST', '/api/travel-plans', json=client.new_plan_body())
+    if response.ok:
+        client.plan_ids.append(response.json()['id'])
+    return response, 1
+
+def op_activity_create(client: Client):
+    return client.call('POST', '/api/activities', json={
+        'plan_id': client.plan_id(), 'name': 'Benchmark activity', 'description': 'Added under load',
+        'location': {'lat': 48.86, 'lng': 2.34}, 'cost': 20, 'duration': 1, 'category': 'culture',
+        'day': client.rng.randint(1, 3), 'time_slot': '14:00'}), 1
+
+def op_expenses_list(client: Client):
+    return client.call('GET', f'/api/expenses?plan_id={client.plan_id()}'), 1
+
+def op_expense_create(client: Client):
+    return client.call('POST', '/api/expenses', json=client.expense_body(client.plan_id())), 1
+
+def op_expenses_bulk(client: Client):
+    plan_id = client.plan_id()
+    rows = [client.expense_body(plan_id) for _ in range(client.args.bulk_rows)]
+    for row in rows:
+        del row['plan_id']
+    return client.call('POST', '/api/expenses/bulk', json={'plan_id': plan_id, 'expenses': rows}), len(rows)
+
+def op_expense_summary(client: Client):
+    return client.call('GET', f'/api/expenses/summary?plan_id={client.plan_id()}'), 1
+
+def op_generate_itinerary(client: Client):
+    # Destinations are drawn from a fixed pool so the itinerary cache sees a realistic hit ratio
+    destination = f'{client.rng.choice(DESTINATIONS)} {client.rng.randrange(client.args.itinerary_variety)}'
+    return client.call('POST', '/api/generate-itinerary', json={
+        'destination': destination, 'budget': 1500, 'duration': 3, 'interests': ['food', 'culture']}), 1
+
+def op_generate_itinerary_uncached(client: Client):
+    return client.call('POST', '/api/generate-itinerary', json={
+        'destination': f'Nowhere {uuid.uuid4().hex}', 'budget': 2500,
+        'duration': client.args.itinerary_days, 'interests': ['food', 'culture']}), 1
+
+def op_places_search(client: Client):
+    query = f'{client.rng.choice(DESTINATIONS)} museum {client.rng.randrange(client.args.places_variety)}'
+    return client.call('GET', '/api/places/search', params={'query': query}), 1
+
+def op_directions(client: Client):
+    jitter = client.rng.randrange(client.args.places_variety) * 0.001
+    return client.call('POST', '/api/directions', json={'start': [2.35 + jitter, 48.85],
+                                                        'end': [2.30, 48.86 + jitter]}), 1
+
+def op_directions_batch(client: Client):
+    return client.call('POST', '/api/directions/batch', json={'plan_id': client.plan_id()}), 1
+
+MIXED_WEIGHTS = {
+    op_auth_login: 1,
+    op_auth_me: 6,
+    op_plans_list: 12,
+    op_plan_get: 14,
+    op_plan_create: 2,
+    op_activity_create: 4,
+    op_expenses_list: 10,
+    op_expense_create: 6,
+    op_expense_summary: 6,
+    op_generate_itinerary: 2,
+    op_places_search: 4,
+    op_directions: 3,
+    op_directions_batch: 3,
+}
+
+def operation_name(operation: Callable) -> str:
+    return operation.__name__[len('op_'):]
+
+def run_load(args, base_url: str, owned: Dict[str, List[str]], weights: Dict[Callable, int],
+             duration: float, concurrency: int) -> Dict:
+    recorder = Recorder()
+    emails = sorted(owned)
+    operations = list(weights)
+    cumulative = [sum(list(weights.values())[:i + 1]) for i in range(len(operations))]
+    clients = []
+    for index in range(concurrency):
+        email = emails[index % len(emails)]
+        clients.append(Client(base_url, email, list(owned[email]), random.Random(args.seed * 1000 + index), args))
+    # Log every client in before the clock starts so slow KDF settings don't eat the warm-up
+    timing = {}
+
+    def start_clock():
+        timing['warmup_until'] = time.monotonic() + args.warmup
+        timing['stop_at'] = timing['warmup_until'] + duration
+
+    ready = threading.Barrier(concurrency + 1, action=start_clock)
+
+    def worker(client: Client):
+        logged_in = client.login().ok
+        if not logged_in:
+            print(f"Benchmark login failed for {client.email}")
+        ready.wait()
+        if not logged_in:
+            return
+        warmup_until, stop_at, rng = timing['warmup_until'], timing['stop_at'], client.rng
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                break
+            operation = operations[_pick(cumulative, rng)]
+            started = time.perf_counter()
+            try:
+                response, items = operation(client)
+                status = response.status_code
+            except requests.RequestException as e:
+                print(f"Benchmark request error: {e}")
+                status, items = 0, 0
+            elapsed = time.perf_counter() - started
+            if now >= warmup_until:
+                recorder.record(operation_name(operation), elapsed, status, items)
+
+    threads = [threading.Thread(target=worker, args=(client,), daemon=True) for client in clients]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    for thread in threads:
+        thread.join()
+    return summarize(recorder, duration)
+
+def _pick(cumulative: List[int], rng: random.Random) -> int:
+    target = rng.uniform(0, cumulative[-1])
+    for i, bound in enumerate(cumulative):
+        if target <= bound:
+            return i
+    return len(cumulative) - 1
+
+# Suites: each run is (label, server env overrides, operation weights)
+def suite_runs(args) -> List[Tuple[str, Dict[str, str], Dict[Callable, int]]]:
+    if args.suite == 'mixed':
+        return [('mixed', {}, MIXED_WEIGHTS)]
+    if args.suite == 'itinerary-fanout':
+        return [
+            ('single-shot', {'FLASK_ITINERARY_FANOUT_MIN_DAYS': '1000'}, {op_generate_itinerary_uncached: 1}),
+            ('fan-out', {'FLASK_ITINERARY_FANOUT_MIN_DAYS': '1'}, {op_generate_itinerary_uncached: 1}),
+        ]
+    if args.suite == 'bulk-import':
+        return [
+            ('single-row', {}, {op_expense_create: 1}),
+            (f'bulk-{args.bulk_rows}', {}, {op_expenses_bulk: 1}),
+        ]
+    if args.suite == 'login-kdf':
+        runs = []
+        for n in (2 ** 12, 2 ** 14, 2 ** 15):
+            runs.append((f'scrypt-n{n}', {'FLASK_PASSWORD_KDF': 'scrypt', 'FLASK_PASSWORD_SCRYPT_N': str(n)},
+                         {op_auth_login: 1}))
+        for iterations in (100000, 600000):
+            runs.append((f'pbkdf2-{iterations}', {'FLASK_PASSWORD_KDF': 'pbkdf2-sha256',
+                                                  'FLASK_PASSWORD_PBKDF2_ITERATIONS': str(iterations)},
+                         {op_auth_login: 1}))
+        return runs
+    raise SystemExit(f'Unknown suite: {args.suite}')
+
+# Serialization: times only the row -> response bytes step, in-process, against prefetched rows
+def seed_serialization(path: str, days: int, per_day: int, plans: int, seed: int) -> str:
+    """Create one user owning plans with days x per_day activity itineraries; returns the user id"""
+    import tp
+    tp.app.config['DATABASE'] = path
+    tp.init_db()
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    user_id, now = str(uuid.uuid4()), datetime(2026, 1, 1).isoformat()
+    conn.execute('INSERT INTO users (id, email, name, password_hash, created_at) VALUES (?, ?, ?, ?, ?)',
+                 (user_id, 'serial@bench.local', 'Bench User', '', now))
+    for p in range(plans):
+        plan_id = str(uuid.uuid4())
+        conn.execute('''INSERT INTO travel_plans (id, user_id, destination, budget, duration, interests,
+                       start_date, end_date, total_cost, created_at, updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?)''',
+                     (plan_id, user_id, rng.choice(DESTINATIONS), 3000, days, json.dumps(rng.sample(INTERESTS, 3)),
+                      '2026-01-01', '2026-02-01', now, now))
+        itinerary = {'days': [{'day': d, 'activities': [stub_activity(d, i) for i in range(per_day)]}
+                              for d in range(1, days + 1)],
+                     'total_estimated_cost': days * per_day * 40, 'tips': ['Book museums ahead'] * 5}
+        tp.store_itinerary(conn, plan_id, itinerary)
+        conn.executemany('''INSERT INTO expenses (id, plan_id, category, amount, description, date, created_at)
+                           VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                         [(str(uuid.uuid4()), plan_id, rng.choice(CATEGORIES), round(rng.uniform(5, 200), 2),
+                           'Seeded expense', '2026-01-02', now) for _ in range(days * per_day)])
+    conn.commit()
+    conn.close()
+    return user_id
+
+def legacy_json(obj) -> bytes:
+    """What jsonify produced before the fast path: stdlib json with sorted keys"""
+    return (json.dumps(obj, ensure_ascii=True, sort_keys=True, separators=(',', ':')) + '\n').encode()
+
+def legacy_plan_dict(row) -> Dict:
+    plan = dict(row)
+    for column in ('itinerary_meta', 'expenses_version', 'expenses_updated_at'):
+        plan.pop(column, None)
+    plan['interests'] = json.loads(plan['interests'])
+    if plan.get('itinerary'):
+        plan['itinerary'] = json.loads(plan['itinerary'])
+    return plan
+
+def serialization_operations(tp, conn, user_id: str) -> Dict[str, Tuple[Callable, Callable, int]]:
+    """name -> (legacy, fast, items) closures over prefetched rows"""
+    plans = conn.execute('SELECT * FROM travel_plans WHERE user_id = ? ORDER BY created_at DESC, id DESC',
+                         (user_id,)).fetchall()
+    plan = plans[0]
+    activities = conn.execute('SELECT COUNT(*) FROM activities WHERE plan_id = ?', (plan['id'],)).fetchone()[0]
+    expenses = conn.execute('SELECT * FROM expenses WHERE plan_id = ?', (plan['id'],)).fetchall()
+    itinerary_text = plan['itinerary']
+    activity = {'id': str(uuid.uuid4()), 'plan_id': plan['id'], 'name': 'Museum', 'description': 'x' * 200,
+                'location': {'lat': 48.86, 'lng': 2.34, 'address': 'Rue de Rivoli'}, 'cost': 17.0,
+                'duration': 3, 'category': 'culture', 'day': 1, 'time_slot': '10:00', 'position': 0}
+    LegacyActivity = dataclasses.make_dataclass('LegacyActivity', tp.Activity.__slots__)
+    raw = ('itinerary',)
+    return {
+        'plan_get': (lambda: legacy_json(legacy_plan_dict(plan)),
+                     lambda: tp.TravelPlan.from_row(plan, raw=raw).to_json(), activities),
+        'plans_list': (lambda: legacy_json([legacy_plan_dict(row) for row in plans]),
+                       lambda: tp.TravelPlan.rows_to_json(plans, raw=raw), len(plans)),
+        'expenses_list': (lambda: legacy_json([dict(row) for row in expenses]),
+                          lambda: tp.Expense.rows_to_json(expenses), len(expenses)),
+        'activity_create': (lambda: legacy_json(dataclasses.asdict(LegacyActivity(**activity))),
+                            lambda: tp.Activity(**activity).to_json(), 1),
+        'itinerary_column': (lambda: json.dumps(json.loads(itinerary_text)).encode(),
+                             lambda: tp.json_dumps(tp.json_loads(itinerary_text)).encode(), activities),
+    }
+
+def run_serialization(args) -> Dict:
+    import tp
+    workdir = tempfile.mkdtemp(prefix='tp-bench-')
+    print(f"Seeding {args.bench_plans} plans of {args.itinerary_days} days x {args.activities_per_day} activities...")
+    user_id = seed_serialization(os.path.join(workdir, 'serialization.db'), args.itinerary_days,
+                                 args.activities_per_day, args.bench_plans, args.seed)
+    conn = sqlite3.connect(os.path.join(workdir, 'serialization.db'))
+    conn.row_factory = sqlite3.Row
+    operations = serialization_operations(tp, conn, user_id)
+
+    runs = [('legacy', 'json', 0), ('fast-json', 'json', 1)]
+    if 'orjson' in tp.JSON_CODECS:
+        runs.append(('fast-orjson', 'orjson', 1))
+    report = {
+        'meta': {
+            **git_revision(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+        },
+        'runs': {}
+    }
+    try:
+        for label, backend, path in runs:
+            tp.configure_json(backend)
+            for name, pair in operations.items():
+                # Both paths must produce the same document before their timings mean anything
+                if name != 'itinerary_column' and json.loads(pair[0]()) != json.loads(pair[path]()):
+                    raise SystemExit(f'{label}: {name} output differs from the legacy path')
+            print(f"Run {label}: {args.duration}s round-robin over {len(operations)} operations")
+            recorder = Recorder()
+            deadline = time.perf_counter() + args.warmup
+            while time.perf_counter() < deadline:
+                for pair in operations.values():
+                    pair[path]()
+            started = time.perf_counter()
+            deadline = started + args.duration
+            while time.perf_counter() < deadline:
+                for name, pair in operations.items():
+                    begin = time.perf_counter()
+                    pair[path]()
+                    recorder.record(name, time.perf_counter() - begin, 200, pair[2])
+            result = summarize(recorder, time.perf_counter() - started)
+            result['env'] = {'JSON_BACKEND': backend}
+            report['runs'][label] = result
+            print_run(label, result)
+    finally:
+        conn.close()
+        tp.configure_json(tp.app.config['JSON_BACKEND'])
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+def git_revision() -> Dict:
+    def git(*command):
+        return subprocess.run(['git', *command], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+    return {'commit': git('rev-parse', 'HEAD'), 'dirty': bool(git('status', '--porcelain', '--', '.'))}
+
+def run_benchmark(args) -> Dict:
+    workdir = tempfile.mkdtemp(prefix='tp-bench-')
+    template = os.path.join(workdir, 'template.db')
+    print(f"Seeding {args.scale} database ({'/'.join(map(str, SCALES[args.scale]))} users/plans/expenses)...")
+    started = time.monotonic()
+    owned = seed_database(template, args.scale, args.seed)
+    seed_seconds = time.monotonic() - started
+
+    gemini = StubConfig(args.gemini_latency, args.jitter, args.gemini_failure_rate, args.seed,
+                        token_latency_ms=args.gemini_token_latency)
+    ors = StubConfig(args.ors_latency, args.jitter, args.ors_failure_rate, args.seed + 1)
+    gemini_server, gemini_url = start_stub(gemini)
+    ors_server, ors_url = start_stub(ors)
+
+    report = {
+        'meta': {
+            **git_revision(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed_seconds': round(seed_seconds, 2),
+            'args': vars(args),
+        },
+        'runs': {}
+    }
+    try:
+        for label, env, weights in suite_runs(args):
+            database = os.path.join(workdir, f'{label}.db')
+            shutil.copyfile(template, database)
+            set_password_hashes(database, env)
+            process, base_url = start_server(args, database, gemini_url, ors_url, env)
+            try:
+                print(f"Run {label}: {args.concurrency} clients for {args.duration}s after {args.warmup}s warm-up")
+                result = run_load(args, base_url, owned, weights, args.duration, args.concurrency)
+                result['env'] = env
+                result['server_health'] = requests.get(f'{base_url}/api/health', timeout=10).json()
+            finally:
+                stop_server(process)
+            result['upstream'] = {'gemini': gemini.stats(), 'openroute': ors.stats()}
+            report['runs'][label] = result
+            print_run(label, result)
+    finally:
+        gemini_server.shutdown()
+        ors_server.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+def print_run(label: str, result: Dict):
+    print(f"\n{label}: {result['total']['requests']} requests, {result['total']['throughput_rps']} req/s, "
+          f"{result['total']['errors']} errors")
+    print(f"  {'endpoint':<28}{'req/s':>9}{'items/s':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'err%':>7}")
+    for name, endpoint in result['endpoints'].items():
+        latency = endpoint['latency_ms']
+        print(f"  {name:<28}{endpoint['throughput_rps']:>9}{endpoint['items_per_s']:>10}{latency['p50']:>9}"
+              f"{latency['p95']:>9}{latency['p99']:>9}{endpoint['error_rate'] * 100:>7.1f}")
+
+def compare_reports(before_path: str, after_path: str):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{before['meta']['commit'][:10]} -> {after['meta']['commit'][:10]}")
+
+    def delta(old: float, new: float) -> str:
+        return f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+
+    for label, run in after['runs'].items():
+        baseline = before['runs'].get(label)
+        if not baseline:
+            print(f"\n{label}: not in baseline")
+            continue
+        print(f"\n{label}")
+        print(f"  {'endpoint':<28}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for name, endpoint in run['endpoints'].items():
+            old = baseline['endpoints'].get(name)
+            if not old:
+                continue
+            print(f"  {name:<28}{delta(old['throughput_rps'], endpoint['throughput_rps']):>10}"
+                  + ''.join(f"{delta(old['latency_ms'][p], endpoint['latency_ms'][p]):>10}"
+                            for p in ('p50', 'p95', 'p99')))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suite', default='mixed', choices=['mixed', 'itinerary-fanout', 'bulk-import', 'login-kdf',
+                                                          'serialization'])
+    parser.add_argument('--scale', default='small', choices=sorted(SCALES))
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds per run')
+    parser.add_argument('--warmup', type=float, default=5, help='unmeasured seconds before each run')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent virtual users')
+    parser.add_argument('--server', default=None, choices=['gunicorn', 'werkzeug'],
+                        help='defaults to gunicorn when installed')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=32, help='gunicorn threads per worker')
+    parser.add_argument('--gemini-latency', type=float, default=500, help='stub Gemini time to first token in ms')
+    parser.add_argument('--gemini-token-latency', type=float, default=2, help='stub Gemini ms per output token')
+    parser.add_argument('--ors-latency', type=float, default=80, help='stub OpenRouteService latency in ms')
+    parser.add_argument('--jitter', type=float, default=0.25, help='latency spread as a fraction of the mean')
+    parser.add_argument('--gemini-failure-rate', type=float, default=0.0)
+    parser.add_argument('--ors-failure-rate', type=float, default=0.0)
+    parser.add_argument('--itinerary-variety', type=int, default=20, help='distinct itinerary requests per destination')
+    parser.add_argument('--itinerary-days', type=int, default=7, help='trip length for the itinerary-fanout suite')
+    parser.add_argument('--activities-per-day', type=int, default=12, help='itinerary density for the serialization suite')
+    parser.add_argument('--bench-plans', type=int, default=20, help='plans in the serialization suite list')
+    parser.add_argument('--places-variety', type=int, default=50, help='distinct place queries per destination')
+    parser.add_argument('--bulk-rows', type=int, default=100, help='rows per bulk import request')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='JSON results path (default bench-<suite>-<scale>-<commit>.json)')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary databases and server log')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare)
+        return
+    if args.suite == 'serialization':
+        report = run_serialization(args)
+        output = args.output or f"bench-serialization-{report['meta']['commit'][:10] or 'nogit'}.json"
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {output}")
+        return
+    if args.server is None:
+        try:
+            import gunicorn  # noqa: F401
+            args.server = 'gunicorn'
+        except ImportError:
+            args.server = 'werkzeug'
+
+    report = run_benchmark(args)
+    output = args.output or f"bench-{args.suite}-{args.scale}-{report['meta']['commit'][:10] or 'nogit'}.json"
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+if __name__ == '__main__':
+    main()
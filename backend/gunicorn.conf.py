@@ -0,0 +1,45 @@
+"""Gunicorn settings for serving the travel planner API in production.
+
+    cd backend && gunicorn -c gunicorn.conf.py wsgi:app
+
+Gemini and OpenRouteService calls block on network I/O, so each worker runs a
+large thread pool: workers x threads is the number of requests (including slow
+upstream calls and SSE streams) one instance can hold open at once. Every
+setting can be overridden from the environment.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 64))
+
+# A synchronous itinerary generation can take well over a minute
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 180))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+# Recycle workers periodically; a fresh worker also resumes itinerary jobs left queued
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    """Create and migrate the schema once, in the master, before any worker forks"""
+    import tp
+    tp.init_db()
+
+
+def post_worker_init(worker):
+    import tp
+    tp.start_services()
+
+
+def worker_exit(server, worker):
+    """Runs after in-flight requests finish; drain background jobs within the graceful window"""
+    import tp
+    tp.shutdown_services(timeout=graceful_timeout)
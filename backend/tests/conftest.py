@@ -0,0 +1,168 @@
+import json
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tp  # noqa: E402
+
+
+def reset_db_pools():
+    for pool in tp.db_pools.values():
+        pool.close_all()
+    tp.db_pools.clear()
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+def fake_itinerary(days, start: int = 1) -> dict:
+    return {
+        'days': [{'day': n, 'activities': [
+            {'name': f'Museum day {n}', 'description': 'Paintings', 'time': '09:00', 'duration': 2,
+             'cost': 10, 'category': 'culture', 'location': {'lat': 48.86, 'lng': 2.34}},
+            {'name': f'Dinner day {n}', 'description': 'Bistro', 'time': '19:00', 'duration': 2,
+             'cost': 30, 'category': 'dining', 'location': {'lat': 48.85, 'lng': 2.35}},
+        ]} for n in range(start, start + days)],
+        'total_estimated_cost': 40 * days,
+        'budget_breakdown': {'accommodation': 400, 'food': 300, 'activities': 200, 'transportation': 100},
+    }
+
+
+class FakeModel:
+    """Stands in for the Gemini model; answers with a fixed itinerary, streamed in small chunks"""
+    def __init__(self, days: int = 2, truncate: int = None, chunk: int = 16, followup: str = None):
+        self.days = days
+        self.truncate = truncate
+        self.chunk = chunk
+        self.followup = followup
+        self.prompts = []
+
+    def generate_content(self, prompt: str, stream: bool = False, **kwargs):
+        self.prompts.append(prompt)
+        missing = re.search(r'Only produce days ([\d, ]+)\.', prompt)
+        if missing:
+            numbers = [int(n) for n in missing.group(1).split(',')]
+            text = self.followup or json.dumps({'days': [fake_itinerary(1, n)['days'][0] for n in numbers]})
+        else:
+            text = '```json\n' + json.dumps(fake_itinerary(self.days)) + '\n```'
+            if self.truncate:
+                text = text[:self.truncate]
+        if not stream:
+            return FakeResponse(text)
+        return [FakeResponse(text[i:i + self.chunk]) for i in range(0, len(text), self.chunk)]
+
+
+class StubUpstream:
+    """Local HTTP server standing in for OpenRouteService; replies from a script, then with the default"""
+    DEFAULT = {'features': [{'properties': {'name': 'Eiffel Tower', 'formatted': 'Paris'},
+                             'geometry': {'coordinates': [2.2945, 48.8584]}}]}
+
+    def __init__(self):
+        self.script = []  # (status, headers, body) per request
+        self.requests = []  # (method, path, json body)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                stub.requests.append((self.command, self.path, json.loads(body) if body else None))
+                status, headers, payload = stub.script.pop(0) if stub.script else (200, {}, stub.DEFAULT)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = _reply
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The Flask app on a fresh database, with per-test caches and no rate limits"""
+    monkeypatch.setitem(tp.app.config, 'DATABASE', str(tmp_path / 'travel_planner.db'))
+    monkeypatch.setitem(tp.app.config, 'PASSWORD_HASH_WORKERS', 0)
+    monkeypatch.setitem(tp.app.config, 'PASSWORD_SCRYPT_N', 2 ** 8)
+    monkeypatch.setitem(tp.app.config, 'RATE_LIMITS', {})
+    monkeypatch.setattr(tp, 'user_cache', tp.UserCache(ttl=60, max_entries=100))
+    monkeypatch.setattr(tp, 'token_cache', tp.TokenCache(max_entries=100, revocation_refresh=0))
+    monkeypatch.setattr(tp, 'rate_limiter', tp.RateLimiter(max_keys=100))
+    reset_db_pools()
+    tp.init_db()
+    yield tp.app
+    reset_db_pools()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(tp.ai_service, 'model', model)
+    return model
+
+
+@pytest.fixture
+def upstream():
+    stub = StubUpstream()
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def ors(app, upstream, monkeypatch):
+    """A fresh OpenRouteService pointed at the stub, with fast backoff and a small breaker"""
+    monkeypatch.setitem(tp.app.config, 'ORS_BACKOFF_BASE', 0.001)
+    monkeypatch.setitem(tp.app.config, 'ORS_MAX_RETRIES', 2)
+    monkeypatch.setitem(tp.app.config, 'ORS_BREAKER_FAILURES', 2)
+    monkeypatch.setitem(tp.app.config, 'ORS_BREAKER_RESET', 0.2)
+    service = tp.OpenRouteService(base_url=upstream.url)
+    monkeypatch.setattr(tp, 'openroute_service', service)
+    yield service
+    service.close()
+
+
+@pytest.fixture
+def register(client):
+    """Create a user and return Authorization headers for them"""
+    def register(email: str = 'ada@example.com', password: str = 'secret') -> dict:
+        client.post('/api/users', json={'email': email, 'name': 'Ada', 'password': password})
+        response = client.post('/api/auth/login', json={'email': email, 'password': password})
+        return {'Authorization': f"Bearer {response.get_json()['token']}"}
+    return register
+
+
+@pytest.fixture
+def make_plan(client):
+    def make_plan(headers: dict, **fields) -> dict:
+        body = dict({'destination': 'Paris', 'budget': 1000, 'duration': 2, 'interests': ['art'],
+                     'start_date': '2026-05-01', 'end_date': '2026-05-02'}, **fields)
+        response = client.post('/api/travel-plans', json=body, headers=headers)
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()
+    return make_plan
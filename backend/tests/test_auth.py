@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+import tp
+
+
+class Worker:
+    """The per-process auth caches of one gunicorn worker; all workers share the database"""
+    def __init__(self, revocation_refresh=0.05):
+        self.revocation_refresh = revocation_refresh
+        self.token_cache = tp.TokenCache(max_entries=100, revocation_refresh=revocation_refresh)
+        self.user_cache = tp.UserCache(ttl=3600, max_entries=100)
+
+    def wait_for_poll(self):
+        """Logouts made elsewhere show up once this worker's next revocation poll is due"""
+        time.sleep(self.revocation_refresh)
+
+    def request(self, client, monkeypatch, method, path, headers):
+        with monkeypatch.context() as m:
+            m.setattr(tp, 'token_cache', self.token_cache)
+            m.setattr(tp, 'user_cache', self.user_cache)
+            return client.open(path, method=method, headers=headers)
+
+
+@pytest.fixture
+def workers():
+    return Worker(), Worker()
+
+
+def test_me_requires_a_valid_token(client, register):
+    headers = register()
+    assert client.get('/api/auth/me', headers=headers).get_json()['email'] == 'ada@example.com'
+    assert client.get('/api/auth/me').status_code == 401
+    assert client.get('/api/auth/me', headers={'Authorization': 'Bearer nope'}).status_code == 401
+
+
+def test_logout_all_on_one_worker_revokes_tokens_on_another(client, register, monkeypatch, workers):
+    a, b = workers
+    headers = register()
+    other_session = register()
+    # Worker A has the user's profile cached from earlier requests
+    assert a.request(client, monkeypatch, 'GET', '/api/auth/me', headers).status_code == 200
+    assert b.request(client, monkeypatch, 'POST', '/api/auth/logout-all', other_session).status_code == 200
+    a.wait_for_poll()
+    for token in (headers, other_session):
+        response = a.request(client, monkeypatch, 'GET', '/api/auth/me', token)
+        assert response.status_code == 401
+        assert response.get_json() == {'error': 'Token has been revoked'}
+
+
+def test_logout_on_one_worker_revokes_the_token_on_another(client, register, monkeypatch, workers):
+    a, b = workers
+    headers = register()
+    kept = register()
+    assert a.request(client, monkeypatch, 'GET', '/api/auth/me', headers).status_code == 200
+    assert b.request(client, monkeypatch, 'POST', '/api/auth/logout', headers).status_code == 200
+    a.wait_for_poll()
+    assert a.request(client, monkeypatch, 'GET', '/api/auth/me', headers).status_code == 401
+    # Only that token: the user's other session still works, and a new login does too
+    assert a.request(client, monkeypatch, 'GET', '/api/auth/me', kept).status_code == 200
+    assert a.request(client, monkeypatch, 'GET', '/api/auth/me', register()).status_code == 200
+
+
+def test_caches_are_kept_while_nobody_logs_out(client, register, monkeypatch, workers):
+    a, _ = workers
+    headers = register()
+    for _ in range(3):
+        assert a.request(client, monkeypatch, 'GET', '/api/auth/me', headers).status_code == 200
+    assert a.user_cache.stats()['misses'] == 1
+    assert a.token_cache.stats()['misses'] == 1
+
+
+def test_logout_only_drops_that_users_cached_profile(client, register, monkeypatch, workers):
+    a, b = workers
+    ada, bob = register(), register('bob@example.com')
+    for headers in (ada, bob):
+        assert a.request(client, monkeypatch, 'GET', '/api/auth/me', headers).status_code == 200
+    assert b.request(client, monkeypatch, 'POST', '/api/auth/logout-all', bob).status_code == 200
+    a.wait_for_poll()
+    assert a.request(client, monkeypatch, 'GET', '/api/auth/me', ada).status_code == 200
+    assert a.request(client, monkeypatch, 'GET', '/api/auth/me', bob).status_code == 401
+    assert a.user_cache.stats()['misses'] == 3  # ada, bob, then bob again after the invalidation
+
+
+def test_cached_request_touches_no_database(client, register, monkeypatch):
+    worker = Worker(revocation_refresh=3600)
+    headers = register()
+    assert worker.request(client, monkeypatch, 'GET', '/api/auth/me', headers).status_code == 200
+    acquired = []
+    acquire = tp.ConnectionPool.acquire
+
+    def counting_acquire(self, *args, **kwargs):
+        acquired.append(self)
+        return acquire(self, *args, **kwargs)
+    monkeypatch.setattr(tp.ConnectionPool, 'acquire', counting_acquire)
+    for _ in range(3):
+        assert worker.request(client, monkeypatch, 'GET', '/api/auth/me', headers).status_code == 200
+    assert acquired == []
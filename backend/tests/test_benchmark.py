@@ -0,0 +1,76 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import benchmark
+import tp
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAST = ['--duration', '0.5', '--warmup', '0', '--seed', '3']
+
+
+def test_percentiles_use_nearest_rank():
+    values = [float(n) for n in range(1, 101)]
+    assert [benchmark.percentile(values, p) for p in (50, 95, 99, 100)] == [50.0, 95.0, 99.0, 100.0]
+    assert benchmark.percentile([], 50) == 0.0
+
+
+def test_summary_reports_latency_errors_and_items():
+    recorder = benchmark.Recorder()
+    for ms in (10, 20, 30, 40):
+        recorder.record('plans_list', ms / 1000, 200)
+    recorder.record('plans_list', 0.5, 500)
+    recorder.record('expenses_bulk', 0.1, 201, items=100)
+    summary = benchmark.summarize(recorder, elapsed=2.0)
+    plans = summary['endpoints']['plans_list']
+    assert (plans['requests'], plans['errors'], plans['statuses']) == (5, 1, {'200': 4, '500': 1})
+    assert plans['latency_ms']['p50'] == 30 and plans['latency_ms']['max'] == 500
+    assert summary['endpoints']['expenses_bulk']['items_per_s'] == 50
+    assert (summary['total']['requests'], summary['total']['errors']) == (6, 1)
+
+
+@pytest.mark.parametrize('prompt, days', [
+    (tp.ai_service._build_prompt('Paris', 1000, 4, ['art']), [1, 2, 3, 4]),
+    (tp.ai_service._build_skeleton_prompt('Paris', 1000, 4, ['art']), [1, 2, 3, 4]),
+    (tp.ai_service._build_day_prompt('Paris', 4, ['art'], 3, 'Marais', 'Museums', 60), [3]),
+    (tp.ai_service._build_missing_days_prompt('Paris', 1000, 4, ['art'], [2, 4]), [2, 4]),
+], ids=['single', 'skeleton', 'day', 'missing'])
+def test_gemini_stub_answers_every_prompt_shape(prompt, days):
+    """The stub must keep up with the service's prompts, or benchmarks measure the fallback"""
+    answer = json.loads(benchmark.stub_itinerary_text(prompt))
+    assert [day['day'] for day in answer.get('days', [answer])] == days
+
+
+def run(*args, timeout=240):
+    return subprocess.run([sys.executable, 'benchmark.py', *args], cwd=BACKEND, capture_output=True, text=True,
+                          timeout=timeout)
+
+
+def test_mixed_suite_end_to_end_and_compare(tmp_path):
+    output = tmp_path / 'mixed.json'
+    result = run('--suite', 'mixed', '--server', 'werkzeug', '--concurrency', '2', '--gemini-latency', '1',
+                 '--gemini-token-latency', '0', '--ors-latency', '1', '--output', str(output), *FAST)
+    assert result.returncode == 0, result.stdout + result.stderr
+    report = json.loads(output.read_text())
+    mixed = report['runs']['mixed']
+    assert mixed['total']['requests'] > 0 and mixed['total']['errors'] == 0
+    assert {'plans_list', 'expense_summary'} <= set(mixed['endpoints'])
+    assert mixed['server_health']['status']
+    assert 'commit' in report['meta']
+
+    compared = run('--compare', str(output), str(output))
+    assert compared.returncode == 0
+    assert '+0.0%' in compared.stdout
+
+
+def test_serialization_suite_checks_paths_agree(tmp_path):
+    output = tmp_path / 'serialization.json'
+    result = run('--suite', 'serialization', '--bench-plans', '2', '--itinerary-days', '2',
+                 '--activities-per-day', '3', '--output', str(output), *FAST)
+    assert result.returncode == 0, result.stdout + result.stderr
+    runs = json.loads(output.read_text())['runs']
+    assert {'legacy', 'fast-json'} <= set(runs)
+    assert all(run['total']['requests'] > 0 for run in runs.values())
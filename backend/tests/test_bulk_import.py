@@ -0,0 +1,102 @@
+import pytest
+
+
+def plan_etag(client, headers, plan_id):
+    response = client.get(f'/api/travel-plans/{plan_id}', headers=headers)
+    assert response.status_code == 200
+    return response.headers['ETag'], response.get_json()['version']
+
+
+def expenses_etag(client, headers, plan_id):
+    response = client.get('/api/expenses', query_string={'plan_id': plan_id}, headers=headers)
+    assert response.status_code == 200
+    return response.headers['ETag']
+
+
+def test_activities_import_creates_rows_and_bumps_version(client, register, make_plan):
+    headers = register()
+    plan = make_plan(headers)
+    etag, version = plan_etag(client, headers, plan['id'])
+    response = client.post('/api/activities/bulk', json={'plan_id': plan['id'], 'activities': [
+        {'name': 'Louvre', 'day': 1}, {'name': 'Orsay', 'day': 1}, {'name': 'Versailles', 'day': 2}]},
+        headers=headers)
+    assert response.status_code == 201
+    assert response.get_json()['created'] == 3
+    new_etag, new_version = plan_etag(client, headers, plan['id'])
+    assert new_version == version + 1 and new_etag != etag
+
+
+def test_activities_import_is_all_or_nothing_by_default(client, register, make_plan):
+    headers = register()
+    plan = make_plan(headers)
+    response = client.post('/api/activities/bulk', json={'plan_id': plan['id'], 'activities': [
+        {'name': 'Louvre'}, {'day': 'x'}]}, headers=headers)
+    assert response.status_code == 400
+    body = response.get_json()
+    assert (body['created'], body['invalid']) == (0, 1)
+    assert [r['status'] for r in body['results']] == ['valid', 'invalid']
+
+
+@pytest.mark.parametrize('rows', [[{'day': 'x'}, {'name': ''}], []])
+def test_activities_import_writing_nothing_keeps_version_and_etag(client, register, make_plan, rows):
+    headers = register()
+    plan = make_plan(headers)
+    etag, version = plan_etag(client, headers, plan['id'])
+    response = client.post('/api/activities/bulk', json={'plan_id': plan['id'], 'activities': rows,
+                                                         'partial': True}, headers=headers)
+    assert response.status_code == 201
+    assert response.get_json()['created'] == 0
+    assert plan_etag(client, headers, plan['id']) == (etag, version)
+    cached = client.get(f"/api/travel-plans/{plan['id']}", headers=dict(headers, **{'If-None-Match': etag}))
+    assert cached.status_code == 304
+
+
+def test_expenses_partial_import_keeps_valid_rows(client, register, make_plan):
+    headers = register()
+    plan = make_plan(headers)
+    etag = expenses_etag(client, headers, plan['id'])
+    csv = 'category,amount,description,date\nfood,12.5,Crepes,2026-05-01\nfood,lots,Coffee,2026-05-01\n'
+    response = client.post(f"/api/expenses/bulk?plan_id={plan['id']}&partial=true", data=csv,
+                           content_type='text/csv', headers=headers)
+    assert response.status_code == 201
+    assert (response.get_json()['created'], response.get_json()['invalid']) == (1, 1)
+    assert expenses_etag(client, headers, plan['id']) != etag
+
+
+def test_expenses_import_writing_nothing_keeps_etag(client, register, make_plan):
+    headers = register()
+    plan = make_plan(headers)
+    etag = expenses_etag(client, headers, plan['id'])
+    response = client.post('/api/expenses/bulk', json={'plan_id': plan['id'], 'partial': True,
+                                                       'expenses': [{'category': 'food'}]}, headers=headers)
+    assert response.status_code == 201
+    assert response.get_json()['created'] == 0
+    assert expenses_etag(client, headers, plan['id']) == etag
+
+
+def test_nested_values_are_rejected_per_row(client, register, make_plan):
+    headers = register()
+    plan = make_plan(headers)
+    response = client.post('/api/activities/bulk', json={'plan_id': plan['id'], 'partial': True, 'activities': [
+        {'name': 'Louvre', 'location': {'lat': 48.86, 'lng': 2.34}},
+        {'name': {'en': 'Orsay'}},
+        {'name': 'Versailles', 'description': ['palace'], 'category': {'x': 1}, 'time_slot': 9},
+        {'name': 'Arc', 'location': [48.87, 2.29]}]}, headers=headers)
+    assert response.status_code == 201
+    body = response.get_json()
+    assert (body['created'], body['invalid']) == (1, 3)
+    assert [r['status'] for r in body['results']] == ['created', 'invalid', 'invalid', 'invalid']
+    assert body['results'][1]['errors'] == ['name must be a string']
+    assert body['results'][2]['errors'] == ['description must be a string', 'category must be a string',
+                                            'time_slot must be a string']
+    assert body['results'][3]['errors'] == ['location must be an object']
+
+    response = client.post('/api/expenses/bulk', json={'plan_id': plan['id'], 'partial': True, 'expenses': [
+        {'category': 'food', 'amount': 12.5, 'description': 'Crepes', 'date': '2026-05-01'},
+        {'category': ['food'], 'amount': 3, 'description': {'text': 'Coffee'}, 'date': {'day': 1}}]},
+        headers=headers)
+    assert response.status_code == 201
+    body = response.get_json()
+    assert (body['created'], body['invalid']) == (1, 1)
+    assert body['results'][1]['errors'] == ['category must be a string', 'description must be a string',
+                                            'date must be a string']
@@ -0,0 +1,100 @@
+import gzip
+
+import pytest
+
+
+@pytest.fixture
+def trip(client, register, make_plan):
+    headers = register()
+    plan = make_plan(headers)
+    return headers, plan
+
+
+def add_expense(client, headers, plan_id, amount=10.0):
+    response = client.post('/api/expenses', headers=headers, json={
+        'plan_id': plan_id, 'category': 'food', 'amount': amount, 'description': 'Lunch', 'date': '2026-05-01'})
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def revalidate(client, headers, url, etag):
+    return client.get(url, headers=dict(headers, **{'If-None-Match': etag}))
+
+
+def urls(plan_id):
+    return [f'/api/travel-plans/{plan_id}', f'/api/expenses?plan_id={plan_id}',
+            f'/api/expenses/summary?plan_id={plan_id}', '/api/travel-plans']
+
+
+def test_unchanged_resources_answer_304(client, trip):
+    headers, plan = trip
+    for url in urls(plan['id']):
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'private, no-cache'
+        cached = revalidate(client, headers, url, response.headers['ETag'])
+        assert cached.status_code == 304, url
+        assert cached.data == b'' and cached.headers['ETag'] == response.headers['ETag']
+
+
+def test_plan_edit_changes_plan_summary_and_list_etags(client, trip):
+    headers, plan = trip
+    etags = {url: client.get(url, headers=headers).headers['ETag'] for url in urls(plan['id'])}
+    client.put(f"/api/travel-plans/{plan['id']}", json={'budget': 2000}, headers=headers)
+    stale = {url for url, etag in etags.items() if revalidate(client, headers, url, etag).status_code == 200}
+    assert stale == {f"/api/travel-plans/{plan['id']}", f"/api/expenses/summary?plan_id={plan['id']}",
+                     '/api/travel-plans'}
+
+
+def test_expense_changes_invalidate_expense_views_only(client, trip):
+    headers, plan = trip
+    etags = {url: client.get(url, headers=headers).headers['ETag'] for url in urls(plan['id'])}
+    add_expense(client, headers, plan['id'])
+    stale = {url for url, etag in etags.items() if revalidate(client, headers, url, etag).status_code == 200}
+    assert stale == {f"/api/expenses?plan_id={plan['id']}", f"/api/expenses/summary?plan_id={plan['id']}"}
+
+    url = f"/api/expenses?plan_id={plan['id']}"
+    etag = client.get(url, headers=headers).headers['ETag']
+    add_expense(client, headers, plan['id'], amount=5.0)
+    fresh = revalidate(client, headers, url, etag)
+    assert fresh.status_code == 200 and len(fresh.get_json()) == 2
+
+
+def test_if_modified_since(client, trip):
+    headers, plan = trip
+    url = f"/api/travel-plans/{plan['id']}"
+    last_modified = client.get(url, headers=headers).headers['Last-Modified']
+    cached = client.get(url, headers=dict(headers, **{'If-Modified-Since': last_modified}))
+    assert cached.status_code == 304
+    old = client.get(url, headers=dict(headers, **{'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'}))
+    assert old.status_code == 200
+
+
+def test_if_none_match_wins_over_if_modified_since(client, trip):
+    headers, plan = trip
+    url = f"/api/travel-plans/{plan['id']}"
+    last_modified = client.get(url, headers=headers).headers['Last-Modified']
+    response = client.get(url, headers=dict(headers, **{'If-None-Match': '"other"',
+                                                           'If-Modified-Since': last_modified}))
+    assert response.status_code == 200
+
+
+def test_compressed_variant_has_its_own_etag_and_still_validates(client, trip, make_plan):
+    headers, plan = trip
+    for n in range(10):
+        make_plan(headers, destination=f'City {n}')
+    plain = client.get('/api/travel-plans', headers=headers)
+    compressed = client.get('/api/travel-plans', headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert gzip.decompress(compressed.data) == plain.data
+    assert compressed.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+    cached = revalidate(client, dict(headers, **{'Accept-Encoding': 'gzip'}), '/api/travel-plans',
+                        compressed.headers['ETag'])
+    assert cached.status_code == 304
+
+
+def test_small_responses_are_sent_uncompressed(client, trip):
+    headers, plan = trip
+    response = client.get(f"/api/expenses?plan_id={plan['id']}", headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+    assert 'Content-Encoding' not in response.headers
@@ -0,0 +1,110 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import tp
+
+
+@pytest.fixture
+def pool(app):
+    pool = tp.ConnectionPool(app.config['DATABASE'], size=2, timeout=0.1)
+    yield pool
+    pool.close_all()
+
+
+def test_connections_are_reused(pool):
+    conn = pool.acquire()
+    raw = conn._conn
+    conn.close()
+    again = pool.acquire()
+    assert again._conn is raw
+    again.close()
+    assert pool.stats()['misses'] == 1 and pool.stats()['hits'] == 1
+
+
+def test_pragmas_and_wal(pool):
+    conn = pool.acquire()
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == tp.DB_PRAGMAS['busy_timeout']
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+    conn.close()
+
+
+def test_exhausted_pool_times_out_then_recovers(pool):
+    held = [pool.acquire(), pool.acquire()]
+    with pytest.raises(sqlite3.OperationalError, match='Timed out'):
+        pool.acquire()
+    stats = pool.stats()
+    assert (stats['open'], stats['in_use'], stats['timeouts']) == (2, 2, 1)
+    # A connection released while another thread waits is handed straight over
+    threading.Timer(0.02, held.pop().close).start()
+    waiter = pool.acquire()
+    assert pool.stats()['waits'] == 2
+    waiter.close()
+    held[0].close()
+
+
+def test_uncommitted_work_is_rolled_back_on_release(pool):
+    conn = pool.acquire()
+    conn.execute("INSERT INTO users (id, email, name, password_hash, created_at) VALUES ('u', 'e', 'n', 'h', 'c')")
+    conn.close()
+    conn = pool.acquire()
+    assert conn.execute('SELECT count(*) FROM users').fetchone()[0] == 0
+    conn.close()
+
+
+def test_released_connection_cannot_be_used(pool):
+    conn = pool.acquire()
+    conn.close()
+    assert conn.closed
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute('SELECT 1')
+
+
+def test_readonly_pool_refuses_writes(app):
+    pool = tp.ConnectionPool(app.config['DATABASE'], size=1, timeout=0.1, readonly=True)
+    conn = pool.acquire()
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute("DELETE FROM users")
+    conn.close()
+    pool.close_all()
+
+
+def test_request_connections_are_returned_at_teardown(client, register):
+    headers = register()
+    client.get('/api/travel-plans', headers=headers)
+    for pool in tp.db_pools.values():
+        assert pool.stats()['in_use'] == 0
+
+
+class BrokenConnection:
+    """A connection whose rollback fails, so the pool must drop it rather than reuse it"""
+    in_transaction = True
+
+    def rollback(self):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    def close(self):
+        pass
+
+
+def test_dropping_a_broken_connection_wakes_a_waiter(app):
+    pool = tp.ConnectionPool(app.config['DATABASE'], size=1, timeout=5)
+    held = pool.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    while pool.stats()['waits'] == 0:
+        pass
+    started = time.monotonic()
+    held._conn.close()
+    pool.release(BrokenConnection())
+    waiter.join()
+    # The waiter opened a replacement in the freed slot instead of sitting out its timeout
+    assert time.monotonic() - started < 1
+    assert acquired[0].execute('SELECT 1').fetchone()[0] == 1
+    assert pool.stats()['open'] == 1 and pool.stats()['timeouts'] == 0
+    acquired[0].close()
+    pool.close_all()
@@ -0,0 +1,85 @@
+import pytest
+
+
+@pytest.mark.parametrize('start, end', [
+    ([2.35, 48.85], 'north'),
+    ([2.35], [2.29, 48.86]),
+    ([2.35, 48.85, 0], [2.29, 48.86]),
+    (['x', 48.85], [2.29, 48.86]),
+    ([None, 48.85], [2.29, 48.86]),
+    ([True, 48.85], [2.29, 48.86]),
+    ({'lng': 2.35, 'lat': 48.85}, [2.29, 48.86]),
+    ([2.35, 95], [2.29, 48.86]),
+    ([2.35, 'nan'], [2.29, 48.86]),
+])
+def test_directions_rejects_malformed_coordinates(client, ors, upstream, start, end):
+    response = client.post('/api/directions', json={'start': start, 'end': end})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+    assert upstream.requests == []
+
+
+def test_directions_requires_a_json_body(client, ors):
+    response = client.post('/api/directions', data='not json', content_type='text/plain')
+    assert response.status_code == 400
+
+
+def test_directions_accepts_numeric_strings(client, ors, upstream):
+    upstream.script = [(200, {}, {'routes': [{'summary': {'distance': 1200, 'duration': 300}}]})]
+    response = client.post('/api/directions', json={'start': ['2.35', '48.85'], 'end': [2.29, 48.86]})
+    assert response.status_code == 200
+    assert response.get_json()['routes'][0]['summary']['distance'] == 1200
+    assert upstream.requests[0][2]['coordinates'] == [[2.35, 48.85], [2.29, 48.86]]
+
+
+@pytest.mark.parametrize('day', ['two', [1], {'day': 1}])
+def test_plan_directions_rejects_non_integer_day(client, ors, register, make_plan, day):
+    headers = register()
+    plan = make_plan(headers)
+    response = client.post('/api/directions/batch', json={'plan_id': plan['id'], 'day': day}, headers=headers)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'day must be an integer'}
+
+
+def test_plan_directions_filters_by_day(client, ors, register, make_plan):
+    headers = register()
+    plan = make_plan(headers)
+    response = client.post('/api/directions/batch', json={'plan_id': plan['id'], 'day': '1'}, headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['legs'] == []
+
+
+@pytest.mark.parametrize('route', ['/api/directions', '/api/directions/batch'])
+@pytest.mark.parametrize('profile', ['driving-rocket', '../matrix', ['driving-car']])
+def test_unknown_profiles_are_rejected(client, ors, upstream, register, make_plan, route, profile):
+    headers = register()
+    plan = make_plan(headers)
+    body = {'start': [2.35, 48.85], 'end': [2.29, 48.86], 'plan_id': plan['id'], 'profile': profile}
+    response = client.post(route, json=body, headers=headers)
+    assert response.status_code == 400
+    assert 'foot-walking' in response.get_json()['error']
+    assert upstream.requests == []
+
+
+@pytest.mark.parametrize('matrix', [
+    {'distances': [[0]], 'durations': [[0]]},
+    {'error': {'code': 2003, 'message': 'Parameter profile is incorrect'}},
+    {'distances': None, 'durations': None},
+], ids=['short', 'error-body', 'null'])
+def test_malformed_matrix_falls_back_to_directions(client, ors, upstream, register, make_plan, matrix):
+    headers = register()
+    plan = make_plan(headers)
+    client.post('/api/activities/bulk', json={'plan_id': plan['id'], 'activities': [
+        {'name': name, 'day': 1, 'location': {'lng': 2.3 + i / 100, 'lat': 48.85}}
+        for i, name in enumerate(['Louvre', 'Orsay', 'Invalides'])]}, headers=headers)
+    route = {'routes': [{'summary': {'distance': 1200, 'duration': 300}}]}
+    upstream.script = [(200, {}, matrix), (200, {}, route), (200, {}, route)]
+    response = client.post('/api/directions/batch', json={'plan_id': plan['id']}, headers=headers)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['upstream_calls'] == 3
+    assert [leg['result'] for leg in body['legs']] == [{'distance': 1200, 'duration': 300, 'cached': False}] * 2
+    paths = [path for _, path, _ in upstream.requests]
+    assert paths == ['/v2/matrix/driving-car'] + ['/v2/directions/driving-car'] * 2
+    cached = client.post('/api/directions/batch', json={'plan_id': plan['id']}, headers=headers).get_json()
+    assert cached['upstream_calls'] == 0 and all(leg['result']['cached'] for leg in cached['legs'])
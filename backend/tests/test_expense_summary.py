@@ -0,0 +1,106 @@
+import random
+from collections import defaultdict
+
+import pytest
+
+import tp
+
+CATEGORIES = ['food', 'transport', 'activities', 'shopping']
+DATES = ['2026-05-01', '2026-05-02', '2026-05-03']
+
+
+@pytest.fixture
+def trip(client, register, make_plan):
+    """A plan with a generated budget breakdown and a spread of expenses"""
+    headers = register()
+    plan = make_plan(headers, budget=1000)
+    client.put(f"/api/travel-plans/{plan['id']}", headers=headers, json={'itinerary': {
+        'days': [], 'budget_breakdown': {'food': 300, 'activities': 200, 'accommodation': 400}}})
+    rng = random.Random(3)
+    rows = [{'category': rng.choice(CATEGORIES), 'date': rng.choice(DATES),
+             'amount': round(rng.uniform(1, 60), 2), 'description': f'Item {n}'} for n in range(40)]
+    response = client.post('/api/expenses/bulk', json={'plan_id': plan['id'], 'expenses': rows}, headers=headers)
+    assert response.status_code == 201, response.get_json()
+    return headers, plan
+
+
+def summary(client, headers, plan_id):
+    response = client.get('/api/expenses/summary', query_string={'plan_id': plan_id}, headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def brute_force(plan_id):
+    by_category, by_day = defaultdict(lambda: [0.0, 0]), defaultdict(lambda: [0.0, 0])
+    with tp.db_connection() as conn:
+        for row in conn.execute('SELECT category, date, amount FROM expenses WHERE plan_id = ?', (plan_id,)):
+            for totals, key in ((by_category, row['category']), (by_day, row['date'])):
+                totals[key][0] += row['amount']
+                totals[key][1] += 1
+    return by_category, by_day
+
+
+def assert_matches_brute_force(body, plan_id):
+    by_category, by_day = brute_force(plan_id)
+    assert {c['category']: (c['total'], c['count']) for c in body['by_category']} == \
+        {k: (pytest.approx(v[0], abs=0.01), v[1]) for k, v in by_category.items()}
+    assert [(d['date'], d['total'], d['count']) for d in body['by_day']] == \
+        [(k, pytest.approx(by_day[k][0], abs=0.01), by_day[k][1]) for k in sorted(by_day)]
+    spent = sum(v[0] for v in by_category.values())
+    assert body['total_spent'] == pytest.approx(spent, abs=0.01)
+    assert body['remaining'] == pytest.approx(body['budget'] - spent, abs=0.01)
+
+
+def test_summary_matches_the_expenses(client, trip):
+    headers, plan = trip
+    body = summary(client, headers, plan['id'])
+    assert body['budget'] == 1000
+    assert_matches_brute_force(body, plan['id'])
+
+
+def test_planned_categories_show_what_remains(client, trip):
+    headers, plan = trip
+    body = summary(client, headers, plan['id'])
+    assert body['budget_breakdown'] == {'food': 300, 'activities': 200, 'accommodation': 400}
+    food = next(c for c in body['by_category'] if c['category'] == 'food')
+    assert food['planned'] == 300 and food['remaining'] == pytest.approx(300 - food['total'], abs=0.01)
+    shopping = next(c for c in body['by_category'] if c['category'] == 'shopping')
+    assert 'planned' not in shopping
+
+
+def test_totals_follow_updates_and_deletes(client, trip):
+    headers, plan = trip
+    with tp.db_connection() as conn:
+        ids = [row['id'] for row in conn.execute('SELECT id FROM expenses WHERE plan_id = ? ORDER BY id',
+                                                 (plan['id'],))]
+        conn.execute("UPDATE expenses SET category = 'lodging', date = '2026-05-09', amount = 99 WHERE id = ?",
+                     (ids[0],))
+        conn.execute('UPDATE expenses SET amount = amount + 1 WHERE id = ?', (ids[1],))
+        conn.executemany('DELETE FROM expenses WHERE id = ?', [(i,) for i in ids[2:12]])
+        conn.commit()
+    assert_matches_brute_force(summary(client, headers, plan['id']), plan['id'])
+
+
+def test_emptied_groups_disappear(client, trip):
+    headers, plan = trip
+    with tp.db_connection() as conn:
+        conn.execute("DELETE FROM expenses WHERE plan_id = ? AND category = 'food'", (plan['id'],))
+        conn.commit()
+        assert conn.execute("SELECT count(*) FROM expense_totals WHERE plan_id = ? AND category = 'food'",
+                            (plan['id'],)).fetchone()[0] == 0
+    assert 'food' not in {c['category'] for c in summary(client, headers, plan['id'])['by_category']}
+
+
+def test_empty_plan_has_zero_spent(client, register, make_plan):
+    headers = register()
+    plan = make_plan(headers)
+    body = summary(client, headers, plan['id'])
+    assert (body['total_spent'], body['remaining'], body['by_category'], body['by_day']) == (0, 1000, [], [])
+
+
+def test_summary_requires_an_owned_plan(client, trip, register):
+    headers, plan = trip
+    assert client.get('/api/expenses/summary', headers=headers).status_code == 400
+    other = register('bob@example.com')
+    response = client.get('/api/expenses/summary', query_string={'plan_id': plan['id']}, headers=other)
+    assert response.status_code == 404
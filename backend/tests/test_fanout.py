@@ -0,0 +1,102 @@
+import json
+import re
+
+import pytest
+
+import tp
+from conftest import FakeModel, FakeResponse, fake_itinerary
+
+
+class FanoutModel(FakeModel):
+    """Answers skeleton and per-day prompts; failing_days raise, and skeleton=None breaks the outline"""
+    def __init__(self, days: int, skeleton='ok', failing_days=()):
+        super().__init__(days=days)
+        self.skeleton = skeleton
+        self.failing_days = set(failing_days)
+
+    def generate_content(self, prompt: str, stream: bool = False, **kwargs):
+        if 'Outline a' in prompt:
+            self.prompts.append(prompt)
+            if self.skeleton is None:
+                return FakeResponse('not json')
+            outline = [{'day': n, 'area': f'Area {n}', 'theme': f'Theme {n}', 'activities_budget': 50}
+                       for n in range(1, self.days + 1)]
+            return FakeResponse(json.dumps({'days': outline, 'budget_breakdown': {
+                'accommodation': 400, 'food': 300, 'activities': 200, 'transportation': 100}}))
+        match = re.search(r'Plan day (\d+) of', prompt)
+        if match:
+            self.prompts.append(prompt)
+            n = int(match.group(1))
+            if n in self.failing_days:
+                raise RuntimeError(f'day {n} failed')
+            return FakeResponse(json.dumps(fake_itinerary(1, n)['days'][0]))
+        return super().generate_content(prompt, stream=stream, **kwargs)
+
+
+@pytest.fixture
+def service(app):
+    service = tp.AIItineraryService(fanout_min_days=5, fanout_workers=3)
+    yield service
+    service.close()
+
+
+def generate(service, model, duration, budget=1000):
+    service.model = model
+    days = []
+    itinerary, complete = service._generate_from_model('Paris', budget, duration, ['art'], on_day=days.append)
+    return itinerary, complete, days
+
+
+def test_short_trips_use_a_single_prompt(service):
+    model = FanoutModel(days=4)
+    itinerary, complete, days = generate(service, model, 4)
+    assert complete and len(model.prompts) == 1
+    assert 'Outline a' not in model.prompts[0]
+    assert [day['day'] for day in itinerary['days']] == [1, 2, 3, 4]
+
+
+def test_long_trips_fan_out_one_call_per_day(service):
+    model = FanoutModel(days=6)
+    itinerary, complete, days = generate(service, model, 6)
+    assert complete
+    assert sum('Outline a' in p for p in model.prompts) == 1
+    day_prompts = [p for p in model.prompts if 'Plan day' in p]
+    assert len(day_prompts) == 6
+    # Each day prompt carries its slice of the skeleton
+    assert all(f'Area {n}' in next(p for p in day_prompts if f'Plan day {n} of' in p) for n in range(1, 7))
+    assert [day['day'] for day in itinerary['days']] == [1, 2, 3, 4, 5, 6]
+    assert sorted(day['day'] for day in days) == [1, 2, 3, 4, 5, 6]
+
+
+def test_budget_is_reconciled_with_activity_costs(service):
+    itinerary, _, _ = generate(service, FanoutModel(days=5), 5, budget=500)
+    breakdown = itinerary['budget_breakdown']
+    assert breakdown['activities'] == 5 * 40
+    assert itinerary['total_estimated_cost'] == pytest.approx(sum(breakdown.values()))
+    assert itinerary['total_estimated_cost'] <= 500
+
+
+def test_failed_day_is_patched_and_marked_incomplete(service):
+    itinerary, complete, _ = generate(service, FanoutModel(days=5, failing_days={3}), 5)
+    assert not complete
+    assert [day['day'] for day in itinerary['days']] == [1, 2, 3, 4, 5]
+    assert 'Museum' not in json.dumps(itinerary['days'][2])
+
+
+def test_broken_skeleton_falls_back_to_a_single_prompt(service):
+    model = FanoutModel(days=5, skeleton=None)
+    itinerary, complete, _ = generate(service, model, 5)
+    assert complete
+    assert not any('Plan day' in p for p in model.prompts)
+    assert len(itinerary['days']) == 5
+
+
+def test_partial_fanout_is_reported_through_the_api(client, register, monkeypatch):
+    model = FanoutModel(days=5, failing_days={2})
+    monkeypatch.setattr(tp.ai_service, 'model', model)
+    monkeypatch.setattr(tp.ai_service, 'fanout_min_days', 5)
+    response = client.post('/api/generate-itinerary', headers=register(),
+                           json={'destination': 'Oslo', 'budget': 1000, 'duration': 5, 'interests': ['art']})
+    assert response.status_code == 200
+    assert response.headers['X-Itinerary-Cache'] == 'PARTIAL'
+    assert len(response.get_json()['days']) == 5
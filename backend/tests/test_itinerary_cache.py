@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+import tp
+from conftest import fake_itinerary
+
+TRIP = {'destination': 'Paris', 'budget': 1000, 'duration': 2, 'interests': ['art', 'food']}
+
+
+def generate(client, headers, **overrides):
+    response = client.post('/api/generate-itinerary', json=dict(TRIP, **overrides), headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return response.headers['X-Itinerary-Cache'], response.get_json()
+
+
+def test_repeat_request_is_served_from_cache(client, register, fake_model):
+    headers = register()
+    status, first = generate(client, headers)
+    assert status == 'MISS'
+    status, second = generate(client, headers)
+    assert (status, second) == ('HIT', first)
+    assert len(fake_model.prompts) == 1
+
+
+@pytest.mark.parametrize('overrides', [
+    {'destination': '  paris '},
+    {'interests': ['Food', 'art', 'art']},
+    {'budget': 1040},
+])
+def test_equivalent_requests_share_an_entry(client, register, fake_model, overrides):
+    headers = register()
+    generate(client, headers)
+    assert generate(client, headers, **overrides)[0] == 'HIT'
+
+
+@pytest.mark.parametrize('overrides', [{'destination': 'Rome'}, {'duration': 3}, {'budget': 2000},
+                                       {'interests': ['art']}])
+def test_different_requests_miss(client, register, fake_model, overrides):
+    headers = register()
+    generate(client, headers)
+    assert generate(client, headers, **overrides)[0] == 'MISS'
+
+
+def test_entries_expire(client, register, fake_model, monkeypatch):
+    headers = register()
+    generate(client, headers)
+    expired = tp.itinerary_cache.stats()['expired']
+    monkeypatch.setattr(tp.itinerary_cache, 'ttl', -1)
+    assert generate(client, headers)[0] == 'MISS'
+    assert tp.itinerary_cache.stats()['expired'] == expired + 1
+
+
+def test_fallback_is_not_cached(client, register, fake_model, monkeypatch):
+    headers = register()
+    monkeypatch.setattr(fake_model, 'generate_content', lambda *args, **kwargs: 1 / 0)
+    assert generate(client, headers)[0] == 'FALLBACK'
+    assert generate(client, headers)[0] == 'FALLBACK'
+    with tp.db_connection() as conn:
+        assert conn.execute('SELECT count(*) FROM itinerary_cache').fetchone()[0] == 0
+
+
+def test_partial_result_is_not_cached(client, register, fake_model):
+    headers = register()
+    # Day 2 is cut off and the follow-up adds nothing, so it is patched with a fallback day
+    full = '```json\n' + json.dumps(fake_itinerary(2))
+    fake_model.truncate = full.index('{"day": 2')
+    fake_model.followup = '{"days": []}'
+    assert generate(client, headers)[0] == 'PARTIAL'
+    fake_model.truncate = fake_model.followup = None
+    assert generate(client, headers)[0] == 'MISS'
+    assert generate(client, headers)[0] == 'HIT'
+
+
+def test_lru_eviction_beyond_capacity(app):
+    cache = tp.ItineraryCache(ttl=60, max_entries=2, budget_band=0.1)
+    keys = [cache.make_key(cache.normalize(city, 1000, 2, [])) for city in ('a', 'b', 'c')]
+    cache.put(keys[0], {}, {'days': []})
+    cache.put(keys[1], {}, {'days': []})
+    assert cache.get(keys[0]) is not None  # now the most recently used
+    cache.put(keys[2], {}, {'days': []})
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    assert cache.stats()['evictions'] == 1
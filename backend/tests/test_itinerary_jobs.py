@@ -0,0 +1,231 @@
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import tp
+
+TRIP = {'destination': 'Paris', 'budget': 1000, 'duration': 2, 'interests': ['art'], 'async': True}
+
+
+@pytest.fixture
+def jobs(app, fake_model, monkeypatch):
+    """A fresh job queue per test, with a fast SSE poll"""
+    monkeypatch.setitem(tp.app.config, 'SSE_POLL_INTERVAL', 0.01)
+    queue = tp.ItineraryJobQueue(tp.ai_service, max_workers=2, max_pending=10)
+    monkeypatch.setattr(tp, 'itinerary_jobs', queue)
+    yield queue
+    queue.shutdown(timeout=5)
+
+
+def submit(client, headers, **overrides):
+    response = client.post('/api/generate-itinerary', json=dict(TRIP, **overrides), headers=headers)
+    assert response.status_code == 202, response.get_json()
+    return response.get_json()
+
+
+def wait_for(client, headers, job_id, status='succeeded'):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        job = client.get(f'/api/generate-itinerary/{job_id}', headers=headers).get_json()
+        if job['status'] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'job stuck in {job["status"]}')
+
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split('\n\n'):
+        if block.startswith(':'):
+            continue
+        event, data = block.split('\n')
+        events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+def test_async_job_runs_and_reports_its_result(client, register, jobs):
+    headers = register()
+    job = submit(client, headers)
+    assert job['poll_url'] == f"/api/generate-itinerary/{job['job_id']}"
+    done = wait_for(client, headers, job['job_id'])
+    assert done['days_ready'] == 2
+    assert [day['day'] for day in done['result']['days']] == [1, 2]
+    assert jobs.stats()['pending'] == 0
+
+
+def test_events_stream_days_then_done(client, register, jobs):
+    headers = register()
+    job = submit(client, headers)
+    response = client.get(job['events_url'], headers=headers)
+    assert response.mimetype == 'text/event-stream'
+    events = parse_events(response.get_data(as_text=True))
+    assert [data['index'] for event, data in events if event == 'day'] == [0, 1]
+    assert events[-1][0] == 'done' and events[-1][1]['status'] == 'succeeded'
+
+
+def test_failed_job_reports_the_error(client, register, jobs, fake_model, monkeypatch):
+    monkeypatch.setattr(jobs.service, 'generate_itinerary_with_status', lambda **kwargs: 1 / 0)
+    headers = register()
+    job = submit(client, headers)
+    assert 'division by zero' in wait_for(client, headers, job['job_id'], 'failed')['error']
+    events = parse_events(client.get(job['events_url'], headers=headers).get_data(as_text=True))
+    assert events[-1][0] == 'error'
+
+
+def test_job_with_plan_id_lands_on_the_plan(client, register, make_plan, jobs):
+    headers = register()
+    plan = make_plan(headers)
+    job = submit(client, headers, plan_id=plan['id'])
+    wait_for(client, headers, job['job_id'])
+    body = client.get(f"/api/travel-plans/{plan['id']}", headers=headers).get_json()
+    assert [day['day'] for day in body['itinerary']['days']] == [1, 2]
+
+
+@pytest.fixture
+def gate(jobs, monkeypatch):
+    """Holds every job inside generation until set"""
+    release = threading.Event()
+    generate = jobs.service.generate_itinerary_with_status
+
+    def gated(**kwargs):
+        release.wait(5)
+        return generate(**kwargs)
+    monkeypatch.setattr(jobs.service, 'generate_itinerary_with_status', gated)
+    yield release
+    release.set()
+
+
+@pytest.mark.parametrize('change', ['edit', 'delete'])
+def test_job_does_not_overwrite_a_plan_changed_while_it_ran(client, register, make_plan, jobs, gate, change):
+    headers = register()
+    plan = make_plan(headers)
+    job = submit(client, headers, plan_id=plan['id'])
+    if change == 'edit':
+        client.put(f"/api/travel-plans/{plan['id']}", json={'destination': 'Lyon'}, headers=headers)
+    else:
+        client.delete(f"/api/travel-plans/{plan['id']}", headers=headers)
+    gate.set()
+    failed = wait_for(client, headers, job['job_id'], 'failed')
+    assert failed['error'] == ('Travel plan has changed' if change == 'edit' else 'Travel plan not found')
+    if change == 'edit':
+        body = client.get(f"/api/travel-plans/{plan['id']}", headers=headers).get_json()
+        assert (body['destination'], body['itinerary'], body['version']) == ('Lyon', {}, plan['version'] + 1)
+
+
+def test_job_for_a_stale_plan_version_is_refused(client, register, make_plan, jobs):
+    headers = register()
+    plan = make_plan(headers)
+    response = client.post('/api/generate-itinerary', json=dict(TRIP, plan_id=plan['id'], version=0),
+                           headers=headers)
+    assert response.status_code == 409 and response.get_json()['version'] == plan['version']
+
+
+def test_attach_finished_job(client, register, make_plan, jobs):
+    headers = register()
+    plan = make_plan(headers)
+    job = submit(client, headers)
+    wait_for(client, headers, job['job_id'])
+    response = client.post(f"/api/generate-itinerary/{job['job_id']}/attach",
+                           json={'plan_id': plan['id'], 'version': plan['version']}, headers=headers)
+    assert response.status_code == 200
+    body = client.get(f"/api/travel-plans/{plan['id']}", headers=headers).get_json()
+    assert len(body['itinerary']['days']) == 2
+
+
+def test_attach_requires_the_current_plan_version(client, register, make_plan, jobs):
+    headers = register()
+    plan = make_plan(headers)
+    job = submit(client, headers)
+    wait_for(client, headers, job['job_id'])
+    attach_url = f"/api/generate-itinerary/{job['job_id']}/attach"
+    assert client.post(attach_url, json={'plan_id': plan['id']}, headers=headers).status_code == 400
+    client.put(f"/api/travel-plans/{plan['id']}", json={'destination': 'Lyon'}, headers=headers)
+    response = client.post(attach_url, json={'plan_id': plan['id'], 'version': plan['version']}, headers=headers)
+    assert response.status_code == 409 and response.get_json()['version'] == plan['version'] + 1
+    body = client.get(f"/api/travel-plans/{plan['id']}", headers=headers).get_json()
+    assert body['itinerary'] == {} and body['total_cost'] == plan['total_cost']
+    response = client.post(attach_url, json={'plan_id': 'missing', 'version': 1}, headers=headers)
+    assert response.status_code == 404
+
+
+def test_async_plan_generation_is_guarded_by_the_plan_version(client, register, make_plan, jobs, gate):
+    headers = register()
+    plan = make_plan(headers)
+    url = f"/api/travel-plans/{plan['id']}/generate-itinerary"
+    stale = client.post(url, json={'async': True, 'version': plan['version'] - 1}, headers=headers)
+    assert stale.status_code == 409 and stale.get_json() == {'error': 'Travel plan has changed',
+                                                             'version': plan['version']}
+    job = client.post(url, json={'async': True}, headers=headers).get_json()
+    client.put(f"/api/travel-plans/{plan['id']}", json={'destination': 'Lyon'}, headers=headers)
+    gate.set()
+    assert wait_for(client, headers, job['job_id'], 'failed')['error'] == 'Travel plan has changed'
+    assert client.get(f"/api/travel-plans/{plan['id']}", headers=headers).get_json()['itinerary'] == {}
+
+
+def test_attach_unfinished_job_conflicts(client, register, make_plan, jobs, monkeypatch):
+    release = threading.Event()
+    generate = jobs.service.generate_itinerary_with_status
+
+    def slow(**kwargs):
+        release.wait(5)
+        return generate(**kwargs)
+    monkeypatch.setattr(jobs.service, 'generate_itinerary_with_status', slow)
+    headers = register()
+    plan = make_plan(headers)
+    job = submit(client, headers)
+    try:
+        response = client.post(f"/api/generate-itinerary/{job['job_id']}/attach",
+                               json={'plan_id': plan['id'], 'version': plan['version']}, headers=headers)
+        assert response.status_code == 409
+    finally:
+        release.set()
+
+
+def test_jobs_are_private_to_their_owner(client, register, jobs):
+    headers = register()
+    job = submit(client, headers)
+    other = register('bob@example.com')
+    assert client.get(job['poll_url'], headers=other).status_code == 404
+    assert client.get(job['events_url'], headers=other).status_code == 404
+    wait_for(client, headers, job['job_id'])
+
+
+def test_full_queue_sheds_load(client, register, jobs, monkeypatch):
+    monkeypatch.setattr(jobs, 'max_pending', 0)
+    response = client.post('/api/generate-itinerary', json=TRIP, headers=register())
+    assert response.status_code == 503
+
+
+def test_orphaned_jobs_are_resumed(app, client, register, jobs):
+    headers = register()
+    user_id = client.get('/api/auth/me', headers=headers).get_json()['id']
+    stale = (datetime.now() - timedelta(hours=1)).isoformat()
+    job_ids = [str(uuid.uuid4()) for _ in range(2)]
+    with tp.db_connection() as conn:
+        for job_id, status in zip(job_ids, ('running', 'queued')):
+            conn.execute('''INSERT INTO itinerary_jobs (id, user_id, status, params, created_at, updated_at)
+                           VALUES (?, ?, ?, ?, ?, ?)''',
+                         (job_id, user_id, status, json.dumps(dict(TRIP, budget=1000.0)), stale, stale))
+        conn.commit()
+    jobs.resume_pending(stale_after=60)
+    for job_id in job_ids:
+        assert wait_for(client, headers, job_id)['days_ready'] == 2
+
+
+@pytest.mark.parametrize('body', [{'budget': 'abc'}, {'duration': 'two'}, {'budget': None}, {'duration': [2]},
+                                  {'budget': True}])
+@pytest.mark.parametrize('run_async', [False, True])
+def test_bad_trip_numbers_are_rejected_before_generating(client, register, make_plan, jobs, body, run_async):
+    headers = register()
+    plan = make_plan(headers)
+    response = client.post(f"/api/travel-plans/{plan['id']}/generate-itinerary",
+                           json=dict(body, **{'async': run_async}), headers=headers)
+    assert response.status_code == 400 and 'must be numbers' in response.get_json()['error']
+    response = client.post('/api/generate-itinerary', json=dict(TRIP, **body, **{'async': run_async}),
+                           headers=headers)
+    assert response.status_code == 400
+    assert jobs.stats()['pending'] == 0
@@ -0,0 +1,101 @@
+import pytest
+
+import tp
+
+
+def scrape(client):
+    """Parse /metrics into {'name{labels}': value}, checking each family is typed once"""
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    samples, typed = {}, []
+    for line in response.get_data(as_text=True).splitlines():
+        if line.startswith('# TYPE '):
+            typed.append(line.split()[2])
+        elif line:
+            series, value = line.rsplit(' ', 1)
+            samples[series] = float(value)
+    assert len(typed) == len(set(typed))
+    return samples
+
+
+def test_render_counters_histograms_and_escaping():
+    metrics = tp.Metrics()
+    metrics.inc('requests_total', {'path': 'a"b\\c\nd'})
+    metrics.inc('requests_total', {'path': 'a"b\\c\nd'}, n=2)
+    metrics.observe('latency_seconds', 0.03, buckets=(0.01, 0.05))
+    metrics.observe('latency_seconds', 1.0, buckets=(0.01, 0.05))
+    lines = metrics.render().splitlines()
+    assert lines[:2] == ['# TYPE requests_total counter', 'requests_total{path="a\\"b\\\\c\\nd"} 3']
+    assert lines[2:] == ['# TYPE latency_seconds histogram',
+                         'latency_seconds_bucket{le="0.01"} 0',
+                         'latency_seconds_bucket{le="0.05"} 1',
+                         'latency_seconds_bucket{le="+Inf"} 2',
+                         'latency_seconds_sum 1.03',
+                         'latency_seconds_count 2']
+
+
+def test_failing_collector_does_not_break_the_scrape(capsys):
+    metrics = tp.Metrics()
+
+    def broken():
+        raise RuntimeError('boom')
+        yield
+    metrics.add_collector(broken)
+    metrics.add_collector(lambda: [('up', {'pool': 'read'}, 1)])
+    assert metrics.render().splitlines() == ['# TYPE up gauge', 'up{pool="read"} 1']
+    assert 'Metrics collector error: boom' in capsys.readouterr().out
+
+
+def test_stats_are_flattened_into_gauges():
+    stats = {'hits': 3, 'open': True, 'breaker': {'state': 'closed', 'opened': 1},
+             'latency': {'buckets': {}, 'sum': 0, 'count': 0}}
+    assert sorted(tp.stats_samples('tp_x', stats, {'pool': 'read'})) == [
+        ('tp_x_breaker_opened', {'pool': 'read'}, 1), ('tp_x_hits', {'pool': 'read'}, 3),
+        ('tp_x_open', {'pool': 'read'}, 1)]
+
+
+def test_requests_are_counted_per_route_template(client, register, make_plan):
+    headers = register()
+    plans = [make_plan(headers) for _ in range(2)]
+    series = 'tp_http_requests_total{endpoint="/api/travel-plans/<plan_id>",method="GET",status="200"}'
+    before = scrape(client).get(series, 0)
+    for plan in plans:
+        client.get(f"/api/travel-plans/{plan['id']}", headers=headers)
+    client.get('/no/such/page')
+    after = scrape(client)
+    assert after[series] == before + 2
+    assert after['tp_http_requests_total{endpoint="<unmatched>",method="GET",status="404"}'] >= 1
+    assert after['tp_http_request_duration_seconds_count{endpoint="/api/travel-plans/<plan_id>",method="GET"}'] >= 2
+    assert not any(plan['id'] in name for name in after for plan in plans)
+
+
+def test_queries_and_service_stats_are_exported(client, register):
+    register()
+    samples = scrape(client)
+    assert samples['tp_db_query_seconds_count{pool="read",statement="SELECT"}'] > 0
+    assert samples['tp_db_query_seconds_count{pool="write",statement="INSERT"}'] > 0
+    assert 'tp_db_pool_open{pool="write"}' in samples
+    assert 'tp_openroute_breaker_state' not in samples  # non-numeric stats are skipped
+    assert {'tp_itinerary_cache_hits', 'tp_rate_limiter_limited', 'tp_auth_tokens_hits'} <= set(samples)
+
+
+def test_slow_requests_log_their_span_breakdown(client, register, monkeypatch, capsys):
+    headers = register()
+    monkeypatch.setitem(tp.app.config, 'METRICS_SLOW_REQUEST_SECONDS', 0)
+    before = scrape(client).get('tp_http_slow_requests_total{endpoint="/api/travel-plans"}', 0)
+    capsys.readouterr()
+    client.get('/api/travel-plans', headers=headers)
+    out = capsys.readouterr().out
+    assert 'Slow request: GET /api/travel-plans 200' in out and ' db ' in out and 'auth ' in out
+    assert scrape(client)['tp_http_slow_requests_total{endpoint="/api/travel-plans"}'] == before + 1
+
+
+@pytest.mark.parametrize('rate', [0.0, 1.0])
+def test_slow_requests_are_profiled_at_the_sample_rate(client, register, monkeypatch, capsys, rate):
+    headers = register()
+    monkeypatch.setitem(tp.app.config, 'METRICS_PROFILE_SAMPLE_RATE', rate)
+    monkeypatch.setitem(tp.app.config, 'METRICS_SLOW_REQUEST_SECONDS', 0)
+    capsys.readouterr()
+    client.get('/api/travel-plans', headers=headers)
+    assert ('cumulative' in capsys.readouterr().out) == bool(rate)
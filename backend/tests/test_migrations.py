@@ -0,0 +1,98 @@
+import json
+import sqlite3
+
+import pytest
+
+import tp
+from conftest import reset_db_pools
+
+LEGACY_ITINERARY = {'days': [{'day': 1, 'activities': [
+    {'name': 'Louvre', 'time': '10:00', 'cost': 20, 'location': {'lat': 48.8606, 'lng': 2.3376}},
+    {'name': 'Seine cruise', 'time': '18:00', 'cost': 15},
+]}], 'total_estimated_cost': 35}
+
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    """A database created by the original schema, before any migration, holding one user's data"""
+    path = str(tmp_path / 'legacy.db')
+    monkeypatch.setitem(tp.app.config, 'DATABASE', path)
+    with monkeypatch.context() as m:
+        m.setattr(tp, 'MIGRATIONS', [])
+        m.setattr(tp, 'HOT_QUERIES', [])
+        reset_db_pools()
+        tp.init_db()
+    reset_db_pools()
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users VALUES ('u-1', 'ada@example.com', 'Ada', 'x', '2025-01-01T00:00:00')")
+    conn.execute('''INSERT INTO travel_plans VALUES ('p-1', 'u-1', 'Paris', 1000, 1, '["art"]', 'a', 'b', ?, 0,
+                    '2025-01-01T00:00:00', '2025-01-01T00:00:00')''', (json.dumps(LEGACY_ITINERARY),))
+    conn.execute('''INSERT INTO activities VALUES ('a-1', 'p-1', 'Seine cruise', 'Saved via the API', NULL, 15, 1,
+                    'sightseeing', 1, '18:00')''')
+    conn.execute("INSERT INTO expenses VALUES ('e-1', 'p-1', 'food', 12.5, 'Crepes', '2025-01-01', 'now')")
+    conn.execute("INSERT INTO expenses VALUES ('e-2', 'p-1', 'food', 7.5, 'Coffee', '2025-01-01', 'now')")
+    conn.commit()
+    conn.close()
+    yield path
+    reset_db_pools()
+
+
+def test_fresh_database_is_at_latest_version(app):
+    conn = sqlite3.connect(app.config['DATABASE'])
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(tp.MIGRATIONS)
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'idx_travel_plans_user_created_id', 'idx_expenses_plan_date', 'idx_activities_plan_day_position',
+            'idx_itinerary_cache_created_at', 'idx_itinerary_jobs_status_created'} <= indexes
+
+
+def test_legacy_database_is_upgraded_and_backfilled(legacy_db):
+    tp.init_db()
+    conn = sqlite3.connect(legacy_db)
+    conn.row_factory = sqlite3.Row
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(tp.MIGRATIONS)
+    # The blob is exploded into rows; the activity already saved through the API is not duplicated
+    names = [row['name'] for row in conn.execute('SELECT name FROM activities ORDER BY time_slot')]
+    assert names == ['Louvre', 'Seine cruise']
+    assert conn.execute("SELECT count(*) FROM itinerary_days WHERE plan_id = 'p-1'").fetchone()[0] == 1
+    totals = conn.execute("SELECT total, count FROM expense_totals WHERE plan_id = 'p-1'").fetchone()
+    assert (totals['total'], totals['count']) == (20.0, 2)
+    assert conn.execute("SELECT count(*) FROM search_index WHERE search_index MATCH 'louvre'").fetchone()[0] == 1
+    assert conn.execute('SELECT count(*) FROM activity_rtree').fetchone()[0] == 1
+    assert conn.execute("SELECT spatial_key FROM users WHERE id = 'u-1'").fetchone()[0] == 1
+
+
+def test_migrations_are_idempotent(legacy_db):
+    tp.init_db()
+    conn = sqlite3.connect(legacy_db)
+    before = conn.execute('SELECT count(*) FROM activities').fetchone()[0]
+    reset_db_pools()
+    tp.init_db()
+    assert conn.execute('SELECT count(*) FROM activities').fetchone()[0] == before
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(tp.MIGRATIONS)
+
+
+def test_failed_migration_rolls_back(legacy_db, monkeypatch):
+    monkeypatch.setattr(tp, 'MIGRATIONS', [tp.MIGRATIONS[0], ['CREATE INDEX idx_broken ON no_such_table(x)']])
+    conn = sqlite3.connect(legacy_db)
+    with pytest.raises(sqlite3.OperationalError):
+        tp.apply_migrations(conn)
+    # The first migration committed on its own; the broken one left nothing behind
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == 1
+    assert not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_broken'").fetchone()
+
+
+@pytest.mark.parametrize('blob', ['{"days": [{"day": 1, "activities": [', '[1, 2]', 'null', ''])
+def test_unreadable_legacy_itinerary_is_rebuilt(legacy_db, blob):
+    conn = sqlite3.connect(legacy_db)
+    conn.execute('''INSERT INTO travel_plans VALUES ('p-2', 'u-1', 'Rome', 500, 1, '[]', 'a', 'b', ?, 0,
+                    '2025-01-01T00:00:00', '2025-01-01T00:00:00')''', (blob,))
+    conn.commit()
+    tp.init_db()
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT * FROM travel_plans WHERE id = 'p-2'").fetchone()
+    assert json.loads(row['itinerary']) == {}
+    with tp.app.app_context():
+        body = json.loads(tp.plan_response(row).get_data())
+    assert body['itinerary'] == {} and body['destination'] == 'Rome'
+    # Readable plans are left alone
+    assert json.loads(conn.execute("SELECT itinerary FROM travel_plans WHERE id = 'p-1'").fetchone()[0])['days']
@@ -0,0 +1,125 @@
+import time
+
+import pytest
+import requests
+
+import tp
+
+
+def fetch(ors):
+    return ors._fetch_places('tower')
+
+
+def test_retries_transient_errors(ors, upstream):
+    upstream.script = [(503, {}, {}), (502, {}, {})]
+    assert fetch(ors)[0]['name'] == 'Eiffel Tower'
+    assert len(upstream.requests) == 3
+    assert ors.stats()['retries'] == 2
+    assert ors.breaker.state == 'closed'
+
+
+def test_gives_up_after_max_retries(ors, upstream):
+    upstream.script = [(503, {}, {})] * 3
+    with pytest.raises(requests.HTTPError):
+        fetch(ors)
+    assert len(upstream.requests) == 3
+    assert ors.stats()['failures'] == 1
+
+
+def test_honours_retry_after(ors, upstream):
+    upstream.script = [(429, {'Retry-After': '0.3'}, {})]
+    started = time.monotonic()
+    fetch(ors)
+    assert time.monotonic() - started >= 0.3
+    assert len(upstream.requests) == 2
+
+
+def test_retry_after_beyond_backoff_max_fails_fast(ors, upstream):
+    upstream.script = [(503, {'Retry-After': '120'}, {})]
+    with pytest.raises(requests.HTTPError):
+        fetch(ors)
+    assert len(upstream.requests) == 1
+
+
+def test_client_errors_do_not_trip_the_breaker(ors, upstream):
+    upstream.script = [(400, {}, {})] * 3
+    for _ in range(3):
+        with pytest.raises(requests.HTTPError):
+            fetch(ors)
+    assert len(upstream.requests) == 3
+    assert ors.breaker.state == 'closed'
+
+
+def test_breaker_opens_then_half_opens_then_closes(ors, upstream, monkeypatch):
+    monkeypatch.setattr(ors, 'max_retries', 0)
+    upstream.script = [(500, {}, {})] * 2
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            fetch(ors)
+    assert ors.breaker.state == 'open'
+    with pytest.raises(tp.CircuitOpenError):
+        fetch(ors)
+    assert len(upstream.requests) == 2
+
+    time.sleep(0.25)
+    assert ors.breaker.state == 'half_open'
+    fetch(ors)
+    assert ors.breaker.state == 'closed'
+    assert ors.breaker.stats()['consecutive_failures'] == 0
+
+
+def test_failed_trial_reopens(ors, upstream, monkeypatch):
+    monkeypatch.setattr(ors, 'max_retries', 0)
+    upstream.script = [(500, {}, {})] * 3
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            fetch(ors)
+    time.sleep(0.25)
+    with pytest.raises(requests.HTTPError):
+        fetch(ors)
+    assert ors.breaker.state == 'open'
+
+
+@pytest.mark.parametrize('error', [requests.TooManyRedirects, requests.exceptions.InvalidURL, RuntimeError])
+def test_non_transport_error_during_trial_does_not_wedge_the_breaker(ors, upstream, monkeypatch, error):
+    monkeypatch.setattr(ors, 'max_retries', 0)
+    upstream.script = [(500, {}, {})] * 2
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            fetch(ors)
+    time.sleep(0.25)
+
+    real_request = ors.session.request
+    monkeypatch.setattr(ors.session, 'request', lambda *args, **kwargs: (_ for _ in ()).throw(error('boom')))
+    with pytest.raises(error):
+        fetch(ors)
+    assert ors.breaker.state == 'open'
+
+    # Once the reset timeout passes again a new trial is let through and can close the circuit
+    monkeypatch.setattr(ors.session, 'request', real_request)
+    time.sleep(0.25)
+    assert fetch(ors)[0]['name'] == 'Eiffel Tower'
+    assert ors.breaker.state == 'closed'
+
+
+def test_chunked_encoding_errors_are_retried(ors, upstream, monkeypatch):
+    real_request = ors.session.request
+    failures = [requests.exceptions.ChunkedEncodingError('cut off')]
+
+    def flaky(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return real_request(*args, **kwargs)
+
+    monkeypatch.setattr(ors.session, 'request', flaky)
+    assert fetch(ors)[0]['name'] == 'Eiffel Tower'
+    assert ors.stats()['retries'] == 1
+
+
+def test_places_endpoint_degrades_to_empty_list_when_open(ors, upstream, client, monkeypatch):
+    monkeypatch.setattr(ors, 'max_retries', 0)
+    upstream.script = [(500, {}, {})] * 2
+    for query in ('a', 'b'):
+        assert client.get('/api/places/search', query_string={'query': query}).get_json() == []
+    assert client.get('/api/places/search', query_string={'query': 'c'}).get_json() == []
+    assert len(upstream.requests) == 2
@@ -0,0 +1,125 @@
+import sqlite3
+
+import pytest
+
+import tp
+from conftest import fake_itinerary
+
+
+@pytest.fixture
+def interleave(app, monkeypatch):
+    """Commit a concurrent edit to a plan just before the request's first write to travel_plans"""
+    pending = []
+    execute = tp.PooledConnection.execute
+
+    def racing_execute(self, sql, parameters=()):
+        if pending and sql.lstrip().startswith('UPDATE travel_plans'):
+            other = sqlite3.connect(app.config['DATABASE'])
+            other.execute('UPDATE travel_plans SET version = version + 1 WHERE id = ?', (pending.pop(),))
+            other.commit()
+            other.close()
+        return execute(self, sql, parameters)
+
+    monkeypatch.setattr(tp.PooledConnection, 'execute', racing_execute)
+    return pending.append
+
+
+def plan_row(app, plan_id):
+    conn = sqlite3.connect(app.config['DATABASE'])
+    conn.row_factory = sqlite3.Row
+    row = conn.execute('SELECT * FROM travel_plans WHERE id = ?', (plan_id,)).fetchone()
+    conn.close()
+    return row
+
+
+def add_activity(client, headers, plan_id):
+    response = client.post('/api/activities', json={'plan_id': plan_id, 'name': 'Louvre', 'day': 1},
+                           headers=headers)
+    assert response.status_code == 201, response.get_json()
+    version = client.get(f'/api/travel-plans/{plan_id}', headers=headers).get_json()['version']
+    return response.get_json(), version
+
+
+def test_plan_update_with_current_version(client, register, make_plan):
+    headers = register()
+    plan = make_plan(headers)
+    response = client.put(f"/api/travel-plans/{plan['id']}", json={'budget': 1500, 'version': plan['version']},
+                          headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['version'] == plan['version'] + 1
+
+
+def test_plan_update_with_stale_version(client, register, make_plan):
+    headers = register()
+    plan = make_plan(headers)
+    client.put(f"/api/travel-plans/{plan['id']}", json={'budget': 1500}, headers=headers)
+    response = client.put(f"/api/travel-plans/{plan['id']}", json={'budget': 900, 'version': plan['version']},
+                          headers=headers)
+    assert response.status_code == 409
+    assert response.get_json()['version'] == plan['version'] + 1
+
+
+@pytest.mark.parametrize('body', [{'budget': 900}, {'itinerary': {'days': []}}])
+def test_plan_update_loses_race_after_version_check(app, client, register, make_plan, interleave, body):
+    headers = register()
+    plan = make_plan(headers)
+    interleave(plan['id'])
+    response = client.put(f"/api/travel-plans/{plan['id']}", json=dict(body, version=plan['version']),
+                          headers=headers)
+    assert response.status_code == 409
+    assert response.get_json()['version'] == plan['version'] + 1
+    # Nothing from the losing request was written
+    row = plan_row(app, plan['id'])
+    assert (row['budget'], row['version']) == (1000, plan['version'] + 1)
+
+
+def test_activity_update_loses_race_after_version_check(app, client, register, make_plan, interleave):
+    headers = register()
+    plan = make_plan(headers)
+    activity, version = add_activity(client, headers, plan['id'])
+    interleave(plan['id'])
+    response = client.put(f"/api/activities/{activity['id']}", json={'name': 'Orsay', 'version': version},
+                          headers=headers)
+    assert response.status_code == 409
+    assert response.get_json()['version'] == version + 1
+    assert 'Orsay' not in plan_row(app, plan['id'])['itinerary']
+
+
+def test_activity_update_with_current_version(client, register, make_plan):
+    headers = register()
+    plan = make_plan(headers)
+    activity, version = add_activity(client, headers, plan['id'])
+    response = client.put(f"/api/activities/{activity['id']}", json={'name': 'Orsay', 'version': version},
+                          headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['name'] == 'Orsay'
+    assert response.get_json()['plan_version'] == version + 1
+
+
+def test_generated_itinerary_is_not_written_over_a_concurrent_edit(app, client, register, make_plan, monkeypatch):
+    headers = register()
+    plan = make_plan(headers)
+
+    def generate_while_user_edits(**params):
+        # The user saves a change while the model is still running
+        client.put(f"/api/travel-plans/{plan['id']}", json={'budget': 1500}, headers=headers)
+        return fake_itinerary(2), 'MISS'
+
+    monkeypatch.setattr(tp.ai_service, 'generate_itinerary_with_status', generate_while_user_edits)
+    response = client.post(f"/api/travel-plans/{plan['id']}/generate-itinerary",
+                           json={'version': plan['version']}, headers=headers)
+    assert response.status_code == 409
+    assert response.get_json()['version'] == plan['version'] + 1
+    row = plan_row(app, plan['id'])
+    assert row['budget'] == 1500
+    assert 'Museum' not in row['itinerary']
+
+
+def test_generated_itinerary_is_written_when_plan_is_unchanged(app, client, register, make_plan, fake_model):
+    headers = register()
+    plan = make_plan(headers)
+    response = client.post(f"/api/travel-plans/{plan['id']}/generate-itinerary",
+                           json={'version': plan['version']}, headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['version'] == plan['version'] + 1
+    assert [day['day'] for day in response.get_json()['itinerary']['days']] == [1, 2]
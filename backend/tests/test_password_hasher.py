@@ -0,0 +1,103 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import tp
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    """Thread pool standing in for the hashing process pool, so work needn't pickle"""
+    def __init__(self):
+        super().__init__(max_workers=2)
+        self.submitted = 0
+
+    def submit(self, fn, *args, **kwargs):
+        self.submitted += 1
+        return super().submit(fn, *args, **kwargs)
+
+
+@pytest.fixture
+def hasher(app, monkeypatch):
+    monkeypatch.setitem(tp.app.config, 'PASSWORD_HASH_WORKERS', 1)
+    monkeypatch.setitem(tp.app.config, 'PASSWORD_HASH_MAX_PENDING', 1)
+    monkeypatch.setitem(tp.app.config, 'PASSWORD_HASH_TIMEOUT', 10)
+    hasher = tp.PasswordHasher()
+    hasher._executor = CountingExecutor()
+    hasher.release = threading.Event()  # blocks work submitted by the tests until set
+    yield hasher
+    hasher.release.set()
+    hasher.shutdown()
+
+
+def test_hash_and_verify_round_trip(hasher):
+    hashed = hasher.hash('secret')
+    assert hashed.startswith('$scrypt$')
+    assert hasher.verify('secret', hashed)
+    assert not hasher.verify('wrong', hashed)
+    assert hasher._executor.submitted == 3
+
+
+def test_saturated_pool_rejects_without_waiting(hasher):
+    holder = threading.Thread(target=hasher._run, args=(hasher.release.wait,))
+    holder.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    with pytest.raises(tp.PasswordHasherBusy):
+        hasher._run(lambda: 'unreachable')
+    assert time.monotonic() - started < 1  # not PASSWORD_HASH_TIMEOUT
+    assert hasher.stats()['rejected'] == 1
+    hasher.release.set()
+    holder.join()
+    assert hasher._run(lambda: 'ok') == 'ok'
+
+
+def test_timed_out_work_keeps_its_slot_until_it_finishes(hasher, monkeypatch):
+    monkeypatch.setitem(tp.app.config, 'PASSWORD_HASH_TIMEOUT', 0.05)
+    finished = threading.Event()
+
+    def slow():
+        hasher.release.wait()
+        finished.set()
+
+    with pytest.raises(tp.PasswordHasherBusy):
+        hasher._run(slow)
+    # The caller gave up, but the hash is still running and still occupies the only slot
+    with pytest.raises(tp.PasswordHasherBusy):
+        hasher._run(lambda: 'unreachable')
+    hasher.release.set()
+    finished.wait(1)
+    time.sleep(0.05)
+    assert hasher._run(lambda: 'ok') == 'ok'
+
+
+def test_failed_submit_gives_the_slot_back(hasher):
+    hasher._executor.shutdown()
+    with pytest.raises(RuntimeError):
+        hasher._run(lambda: 'ok')
+    hasher._executor = CountingExecutor()
+    assert hasher._run(lambda: 'ok') == 'ok'
+
+
+def test_dummy_hash_runs_on_the_pool_once_per_cost(hasher, monkeypatch):
+    dummy = hasher.dummy_hash()
+    assert hasher._executor.submitted == 1
+    assert hasher.dummy_hash() == dummy
+    assert hasher._executor.submitted == 1
+    assert not hasher.verify('secret', dummy)
+    monkeypatch.setitem(tp.app.config, 'PASSWORD_SCRYPT_N', 2 ** 9)
+    assert hasher.dummy_hash() != dummy
+
+
+def test_login_with_saturated_pool_is_shed(client, register, monkeypatch, hasher):
+    register()
+    monkeypatch.setattr(tp, 'password_hasher', hasher)
+    holder = threading.Thread(target=hasher._run, args=(hasher.release.wait,))
+    holder.start()
+    time.sleep(0.05)
+    # The unknown email is shed too: its dummy hash goes through the same pool
+    for email in ('ada@example.com', 'nobody@example.com'):
+        response = client.post('/api/auth/login', json={'email': email, 'password': 'secret'})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
@@ -0,0 +1,82 @@
+import pytest
+
+import tp
+
+
+@pytest.fixture
+def plans(client, register, make_plan):
+    """A user with seven plans, one of them carrying an itinerary, plus another user's plan"""
+    headers = register()
+    created = [make_plan(headers, destination=f'City {n}') for n in range(7)]
+    client.put(f"/api/travel-plans/{created[0]['id']}", headers=headers,
+               json={'itinerary': {'days': [{'day': 1, 'activities': []}]}})
+    make_plan(register('bob@example.com'))
+    return headers, created
+
+
+def list_plans(client, headers, **params):
+    response = client.get('/api/travel-plans', query_string=params, headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return response
+
+
+def test_unpaginated_listing_is_newest_first(client, plans):
+    headers, created = plans
+    body = list_plans(client, headers).get_json()
+    assert [plan['id'] for plan in body] == [plan['id'] for plan in reversed(created)]
+    assert body[-1]['itinerary'] == {'days': [{'day': 1, 'activities': []}]}
+
+
+def test_cursor_walks_every_plan_once(client, plans):
+    headers, created = plans
+    seen, params = [], {'limit': 3}
+    while True:
+        response = list_plans(client, headers, **params)
+        seen += [plan['id'] for plan in response.get_json()]
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+        assert 'rel="next"' in response.headers['Link'] and f'cursor={cursor}' in response.headers['Link']
+        params = {'limit': 3, 'cursor': cursor}
+    assert seen == [plan['id'] for plan in reversed(created)]
+
+
+def test_pages_do_not_shift_when_plans_are_added(client, plans, make_plan):
+    headers, created = plans
+    cursor = list_plans(client, headers, limit=2).headers['X-Next-Cursor']
+    make_plan(headers, destination='Newcomer')
+    page = list_plans(client, headers, limit=2, cursor=cursor).get_json()
+    assert [plan['id'] for plan in page] == [created[4]['id'], created[3]['id']]
+
+
+def test_fields_project_columns(client, plans):
+    headers, _ = plans
+    body = list_plans(client, headers, fields='id,destination').get_json()
+    assert all(set(plan) == {'id', 'destination'} for plan in body)
+
+
+def test_summary_skips_the_itinerary(client, plans):
+    headers, _ = plans
+    body = list_plans(client, headers, summary='true').get_json()
+    assert all('itinerary' not in plan for plan in body)
+    assert 'destination' in body[0]
+
+
+@pytest.mark.parametrize('params', [{'fields': 'id,password_hash'}, {'cursor': 'garbage'}, {'limit': 'ten'}])
+def test_bad_parameters_are_rejected(client, plans, params):
+    headers, _ = plans
+    response = client.get('/api/travel-plans', query_string=params, headers=headers)
+    assert response.status_code == 400
+
+
+def test_limit_is_clamped(client, plans, monkeypatch):
+    headers, _ = plans
+    monkeypatch.setitem(tp.app.config, 'PLAN_LIST_MAX_LIMIT', 2)
+    assert len(list_plans(client, headers, limit=50).get_json()) == 2
+    assert len(list_plans(client, headers, limit=0).get_json()) == 1
+
+
+def test_other_users_plans_are_refused(client, plans):
+    headers, _ = plans
+    response = client.get('/api/travel-plans', query_string={'user_id': 'someone-else'}, headers=headers)
+    assert response.status_code == 403
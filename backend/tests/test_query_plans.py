@@ -0,0 +1,182 @@
+"""EXPLAIN QUERY PLAN every statement in tp.py against a seeded database; full scans fail the build.
+
+The default seed (2k plans, 20k activities/expenses) keeps the suite fast. Production sizes are covered two
+ways: the 'production-stats' variant rewrites sqlite_stat1 as if every table were PRODUCTION_SCALE times
+larger, and TP_QUERY_PLAN_SCALE=1000 seeds that many rows for real (2M plans, 20M activities; minutes, GBs).
+"""
+import ast
+import json
+import os
+import random
+import sqlite3
+import uuid
+
+import pytest
+
+import tp
+from conftest import reset_db_pools
+
+SCALE = int(os.environ.get('TP_QUERY_PLAN_SCALE', '1'))
+PRODUCTION_SCALE = 1000
+USERS = 200 * SCALE
+PLANS_PER_USER = 10
+ACTIVITIES_PER_PLAN = 10
+EXPENSES_PER_PLAN = 10
+
+
+def _module_strings(tree: ast.Module) -> dict:
+    strings = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant) \
+                and isinstance(node.value.value, str):
+            strings.update({target.id: node.value.value for target in node.targets
+                            if isinstance(target, ast.Name)})
+    return strings
+
+
+def code_statements():
+    """(line, sql) for every literal statement passed to execute/executemany in tp.py"""
+    with open(tp.__file__, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    strings = _module_strings(tree)
+    # Migration steps run once against whatever is there; scanning is their job
+    migration_steps = {step.__name__ for steps in tp.MIGRATIONS for step in steps if callable(step)}
+    skipped = [range(node.lineno, node.end_lineno + 1) for node in ast.walk(tree)
+               if isinstance(node, ast.FunctionDef) and node.name in migration_steps]
+    statements = []
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr in ('execute', 'executemany') and node.args):
+            continue
+        if any(node.lineno in lines for lines in skipped):
+            continue
+        arg = node.args[0]
+        if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+            sql = arg.value
+        elif isinstance(arg, ast.Name) and arg.id in strings:
+            sql = strings[arg.id]
+        else:
+            continue  # built at runtime; its shapes are listed in HOT_QUERIES
+        if sql.split(None, 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+            statements.append((node.lineno, sql))
+    return sorted(set(statements))
+
+
+STATEMENTS = code_statements() + [(f'HOT_QUERIES[{i}]', sql) for i, sql in enumerate(tp.HOT_QUERIES)]
+
+
+def _seed_users(conn: sqlite3.Connection, rng: random.Random, start: int, stop: int) -> list:
+    now = '2026-01-01T00:00:00'
+    users, plans, activities, expenses = [], [], [], []
+    for u in range(start, stop):
+        user_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        users.append((user_id, f'user{u}@example.com', 'User', 'x', now))
+        for p in range(PLANS_PER_USER):
+            plan_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            created = f'2026-01-{1 + p % 28:02d}T00:00:{u % 60:02d}'
+            plans.append((plan_id, user_id, f'City {p}', 1000, 3, '[]', now, now, '{}', 0, created, created))
+            for a in range(ACTIVITIES_PER_PLAN):
+                location = json.dumps({'lat': rng.uniform(-60, 60), 'lng': rng.uniform(-180, 180)})
+                activities.append((str(uuid.uuid4()), plan_id, f'Activity {a}', 'desc', location, 10, 1,
+                                   'culture', 1 + a % 3, '09:00', a))
+            for e in range(EXPENSES_PER_PLAN):
+                expenses.append((str(uuid.uuid4()), plan_id, 'food', 12.5, f'Meal {e}',
+                                 f'2026-01-{1 + e % 28:02d}', now))
+    conn.executemany('INSERT INTO users (id, email, name, password_hash, created_at) VALUES (?, ?, ?, ?, ?)', users)
+    conn.executemany('''INSERT INTO travel_plans (id, user_id, destination, budget, duration, interests,
+                        start_date, end_date, itinerary, total_cost, created_at, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', plans)
+    conn.executemany('''INSERT INTO activities (id, plan_id, name, description, location, cost, duration,
+                        category, day, time_slot, position) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                     activities)
+    conn.executemany('''INSERT INTO expenses (id, plan_id, category, amount, description, date, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''', expenses)
+    conn.executemany('INSERT INTO itinerary_days (plan_id, day) VALUES (?, ?)',
+                     [(plan[0], day) for plan in plans for day in (1, 2, 3)])
+    return [user[0] for user in users]
+
+
+def seed(conn: sqlite3.Connection):
+    rng = random.Random(1)
+    now = '2026-01-01T00:00:00'
+    users = []
+    for start in range(0, USERS, 200):  # in batches, so large scales stream rather than build lists of millions
+        users += _seed_users(conn, rng, start, min(start + 200, USERS))
+    conn.executemany('''INSERT INTO itinerary_cache (cache_key, params, itinerary, created_at, last_accessed)
+                        VALUES (?, '{}', '{}', ?, ?)''', ((uuid.uuid4().hex, i, i) for i in range(5000 * SCALE)))
+    conn.executemany('''INSERT INTO itinerary_jobs (id, user_id, status, params, created_at, updated_at)
+                        VALUES (?, ?, ?, '{}', ?, ?)''',
+                     ((str(uuid.uuid4()), users[i % USERS], rng.choice(['queued', 'running', 'succeeded']),
+                       f'2026-01-01T{i % 24:02d}:00:00', now) for i in range(5000 * SCALE)))
+    conn.executemany('''INSERT INTO upstream_cache (namespace, cache_key, value, fresh_until, stale_until,
+                        last_accessed) VALUES (?, ?, '[]', ?, ?, ?)''',
+                     ((rng.choice(['geocoding', 'directions', 'route_legs']), uuid.uuid4().hex, i, i, i)
+                      for i in range(20000 * SCALE)))
+    conn.executemany('INSERT INTO revoked_tokens (jti, user_id, expires_at, revoked_at) VALUES (?, ?, ?, ?)',
+                     ((uuid.uuid4().hex, users[0], i, i) for i in range(2000 * SCALE)))
+    conn.executemany('INSERT INTO rate_limits (key, tokens, updated_at) VALUES (?, 1, ?)',
+                     ((f'places:user:{i}', i) for i in range(2000 * SCALE)))
+    conn.commit()
+
+
+def scale_statistics(conn: sqlite3.Connection, factor: int):
+    """Rewrite sqlite_stat1 as if every table held factor times the rows.
+
+    Keys that identify a row or a parent (ids, user_id, plan_id) gain more distinct values as data grows, so
+    their rows-per-key stays put; low-cardinality columns (status, namespace) keep their handful of values, so
+    their rows-per-key grows with the table.
+    """
+    rows = conn.execute('SELECT tbl, idx, stat FROM sqlite_stat1').fetchall()
+    for tbl, idx, stat in rows:
+        counts = [int(n) for n in stat.split() if n.isdigit()]
+        options = [word for word in stat.split() if not word.isdigit()]
+        total, per_key = counts[0], [n * factor if n * 100 >= counts[0] else n for n in counts[1:]]
+        conn.execute('UPDATE sqlite_stat1 SET stat = ? WHERE tbl = ? AND idx IS ?',
+                     (' '.join([str(total * factor)] + [str(n) for n in per_key] + options), tbl, idx))
+    conn.commit()
+    conn.execute('ANALYZE sqlite_schema')  # makes the planner reload the statistics
+
+
+@pytest.fixture(scope='module')
+def seeded_db(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('plans') / 'seeded.db')
+    database = tp.app.config['DATABASE']
+    tp.app.config['DATABASE'] = path
+    try:
+        reset_db_pools()
+        tp.init_db()
+    finally:
+        reset_db_pools()
+        tp.app.config['DATABASE'] = database
+    conn = sqlite3.connect(path)
+    seed(conn)
+    conn.close()
+    return path
+
+
+@pytest.fixture(scope='module', params=['default-stats', 'analyzed', 'production-stats'])
+def plan_conn(request, seeded_db, tmp_path_factory):
+    """The seeded database as the app sees it, after ANALYZE, and with statistics scaled to production size"""
+    conn = sqlite3.connect(':memory:')
+    source = sqlite3.connect(seeded_db)
+    source.backup(conn)
+    source.close()
+    if request.param != 'default-stats':
+        conn.execute('ANALYZE')
+    if request.param == 'production-stats':
+        scale_statistics(conn, PRODUCTION_SCALE)
+    yield conn
+    conn.close()
+
+
+def test_statements_are_harvested():
+    # Guards against the harvester silently finding nothing after a refactor
+    assert len(code_statements()) > 60
+
+
+@pytest.mark.parametrize('where, sql', STATEMENTS, ids=[str(where) for where, _ in STATEMENTS])
+def test_statement_uses_an_index(plan_conn, where, sql):
+    if tp.check_query_plans(plan_conn, [sql]):
+        plan = plan_conn.execute(f'EXPLAIN QUERY PLAN {sql}', [None] * sql.count('?')).fetchall()
+        pytest.fail(f"tp.py:{where} scans or sorts without an index:\n{' '.join(sql.split())}\n"
+                    + '\n'.join(row[-1] for row in plan))
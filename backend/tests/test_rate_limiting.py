@@ -0,0 +1,146 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import tp
+
+TRIP = {'destination': 'Paris', 'budget': 1000, 'duration': 2, 'interests': ['art']}
+
+
+def test_take_token_refills_at_the_configured_rate():
+    assert tp.take_token(0.0, 0.0, 10, 60) == (False, 0.0)
+    allowed, left = tp.take_token(0.0, 6.0, 10, 60)  # one token per 6s
+    assert allowed and left == pytest.approx(0)
+    assert tp.take_token(3.0, 600, 10, 60) == (True, 9.0)  # refill caps at the limit
+    assert tp.take_token(5.0, -1, 10, 60) == (True, 4.0)  # clock going backwards adds nothing
+
+
+def test_bucket_limits_then_refills():
+    limiter = tp.RateLimiter(max_keys=10)
+    assert [limiter.acquire('k', 2, 0.5)[0] for _ in range(3)] == [True, True, False]
+    allowed, _, retry_after = limiter.acquire('k', 2, 0.5)
+    assert not allowed and 0 < retry_after <= 0.25
+    time.sleep(retry_after + 0.01)
+    assert limiter.acquire('k', 2, 0.5)[0]
+    assert limiter.acquire('other', 2, 0.5)[0]
+    assert (limiter.stats()['allowed'], limiter.stats()['limited']) == (4, 2)
+
+
+def test_least_recent_buckets_are_evicted():
+    limiter = tp.RateLimiter(max_keys=2)
+    for key in ('a', 'b', 'a', 'c'):
+        limiter.acquire(key, 1, 60)
+    assert limiter.stats()['evictions'] == 1 and limiter.stats()['buckets'] == 2
+    assert not limiter.acquire('a', 1, 60)[0]  # still tracked, so still empty
+    assert limiter.acquire('b', 1, 60)[0]  # evicted, so starts full again
+
+
+def test_sqlite_buckets_are_shared_between_workers(app):
+    workers = [tp.SQLiteRateLimiter(), tp.SQLiteRateLimiter()]
+    results = [workers[i % 2].acquire('itinerary:user:u', 3, 60)[0] for i in range(4)]
+    assert results == [True, True, True, False]
+
+
+def test_sqlite_limiter_fails_open(app, monkeypatch, capsys):
+    limiter = tp.SQLiteRateLimiter()
+
+    def locked(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(tp, 'db_connection', locked)
+    assert limiter.acquire('k', 1, 60) == (True, 0.0, 0.0)
+    assert limiter.stats()['errors'] == 1
+    assert 'Rate limiter error' in capsys.readouterr().out
+
+
+@pytest.fixture
+def limits(app, monkeypatch):
+    monkeypatch.setitem(tp.app.config, 'RATE_LIMITS', {'itinerary': [2, 60]})
+
+
+def test_endpoint_returns_429_with_retry_after(client, register, fake_model, limits):
+    headers = register()
+    responses = [client.post('/api/generate-itinerary', json=TRIP, headers=headers) for _ in range(3)]
+    assert [r.status_code for r in responses] == [200, 200, 429]
+    assert [r.headers['X-RateLimit-Remaining'] for r in responses] == ['1', '0', '0']
+    assert responses[0].headers['X-RateLimit-Limit'] == '2'
+    assert 1 <= int(responses[2].headers['Retry-After']) <= 30
+    assert 'Rate limit exceeded' in responses[2].get_json()['error']
+
+
+def test_group_is_shared_across_routes_and_keyed_per_user(client, register, make_plan, fake_model, limits):
+    headers = register()
+    plan = make_plan(headers)
+    client.post('/api/generate-itinerary', json=TRIP, headers=headers)
+    client.post(f"/api/travel-plans/{plan['id']}/generate-itinerary", json={}, headers=headers)
+    assert client.post('/api/generate-itinerary', json=TRIP, headers=headers).status_code == 429
+    other = register('bob@example.com')
+    assert client.post('/api/generate-itinerary', json=TRIP, headers=other).status_code == 200
+
+
+def test_unlimited_groups_send_no_headers(client, register, fake_model):
+    response = client.post('/api/generate-itinerary', json=TRIP, headers=register())
+    assert response.status_code == 200 and 'X-RateLimit-Limit' not in response.headers
+
+
+@pytest.mark.parametrize('hops, forwarded, expected', [
+    (0, '1.1.1.1', 'ip:127.0.0.1'),
+    (1, '1.1.1.1, 2.2.2.2', 'ip:2.2.2.2'),
+    (2, '1.1.1.1, 2.2.2.2', 'ip:1.1.1.1'),
+    (5, '1.1.1.1', 'ip:1.1.1.1'),
+])
+def test_anonymous_callers_are_keyed_by_trusted_address(app, monkeypatch, hops, forwarded, expected):
+    monkeypatch.setitem(tp.app.config, 'RATE_LIMIT_TRUSTED_PROXIES', hops)
+    with app.test_request_context(headers={'X-Forwarded-For': forwarded}, environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+        assert tp.rate_limit_key() == expected
+
+
+def test_authenticated_callers_are_keyed_by_user(app, client, register):
+    headers = register()
+    user_id = client.get('/api/auth/me', headers=headers).get_json()['id']
+    with app.test_request_context(headers=headers):
+        assert tp.rate_limit_key() == f'user:{user_id}'
+    with app.test_request_context(headers={'Authorization': 'Bearer not-a-token'}):
+        assert tp.rate_limit_key().startswith('ip:')
+
+
+def test_gate_queues_then_sheds():
+    gate = tp.AdmissionGate('g', max_concurrent=1, max_queued=1, queue_timeout=5)
+    assert gate.acquire()
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(gate.acquire()))
+    waiter.start()
+    while gate.stats()['waiting'] == 0:
+        time.sleep(0.001)
+    assert not gate.acquire()  # the queue is full
+    gate.release()
+    waiter.join()
+    assert results == [True]
+    gate.release()
+    assert gate.stats() == dict(gate.stats(), admitted=2, queued=1, shed=1, active=0, waiting=0)
+
+
+def test_gate_times_out_queued_requests():
+    gate = tp.AdmissionGate('g', max_concurrent=1, max_queued=1, queue_timeout=0.02)
+    gate.acquire()
+    assert not gate.acquire()
+    assert gate.stats()['timeouts'] == 1
+
+
+def test_overloaded_group_answers_503(client, register, fake_model, monkeypatch):
+    gate = tp.AdmissionGate('itinerary', max_concurrent=0, max_queued=0, queue_timeout=0)
+    monkeypatch.setitem(tp.admission_gates, 'itinerary', gate)
+    response = client.post('/api/generate-itinerary', json=TRIP, headers=register())
+    assert response.status_code == 503 and response.headers['Retry-After'] == '1'
+    assert gate.stats()['shed'] == 1
+
+
+def test_gate_slot_is_released_when_the_view_fails(client, register, fake_model, monkeypatch):
+    gate = tp.AdmissionGate('itinerary', max_concurrent=1, max_queued=0, queue_timeout=0)
+    monkeypatch.setitem(tp.admission_gates, 'itinerary', gate)
+    monkeypatch.setattr(tp, 'submit_itinerary_job', lambda *args: 1 / 0)
+    headers = register()
+    response = client.post('/api/generate-itinerary', json=dict(TRIP, **{'async': True}), headers=headers)
+    assert response.status_code == 500
+    assert gate.stats()['active'] == 0
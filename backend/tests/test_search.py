@@ -0,0 +1,76 @@
+import pytest
+
+
+@pytest.fixture
+def trip(client, register, make_plan):
+    """A user with a Paris plan holding two activities and an expense"""
+    headers = register()
+    plan = make_plan(headers)
+    for name, description in (('Louvre', 'Museum of paintings'), ('Seine cruise', 'Boat trip past the Louvre')):
+        response = client.post('/api/activities', json={'plan_id': plan['id'], 'name': name, 'day': 1,
+                                                        'description': description}, headers=headers)
+        assert response.status_code == 201
+    response = client.post('/api/expenses', json={'plan_id': plan['id'], 'category': 'food', 'amount': 12.5,
+                                                  'description': 'Crepes near the museum', 'date': '2026-05-01'},
+                           headers=headers)
+    assert response.status_code == 201
+    return headers, plan
+
+
+def search(client, headers, **params):
+    response = client.get('/api/search', query_string=params, headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_index_lists_search(client):
+    assert '/api/search (GET)' in client.get('/').get_json()['endpoints']
+
+
+def test_title_matches_rank_first(client, trip):
+    headers, plan = trip
+    results = search(client, headers, q='louvre')['results']
+    assert [(r['type'], r['title']) for r in results] == [('activity', 'Louvre'), ('activity', 'Seine cruise')]
+    assert results[0]['destination'] == 'Paris' and results[0]['plan_id'] == plan['id']
+
+
+def test_every_kind_is_searchable(client, trip):
+    headers, _ = trip
+    assert {r['type'] for r in search(client, headers, q='paris')['results']} == {'plan'}
+    assert [r['type'] for r in search(client, headers, q='crepes')['results']] == ['expense']
+    assert [r['type'] for r in search(client, headers, q='museum', types='expense')['results']] == ['expense']
+
+
+def test_prefix_and_pagination(client, trip):
+    headers, _ = trip
+    assert search(client, headers, q='lou')['results'] == []
+    page = search(client, headers, q='lou', prefix='true', limit=1)
+    assert len(page['results']) == 1 and page['next_offset'] == 1
+    last = search(client, headers, q='lou', prefix='true', limit=1, offset=1)
+    assert last['next_offset'] is None
+    assert page['results'][0]['id'] != last['results'][0]['id']
+
+
+def test_results_are_scoped_to_the_user(client, trip, register):
+    other = register('bob@example.com')
+    assert search(client, other, q='louvre')['results'] == []
+
+
+def test_index_follows_edits_and_deletes(client, trip):
+    headers, _ = trip
+    louvre = search(client, headers, q='louvre', types='activity')['results'][0]
+    client.put(f"/api/activities/{louvre['id']}", json={'name': 'Orsay'}, headers=headers)
+    assert [r['title'] for r in search(client, headers, q='orsay')['results']] == ['Orsay']
+    client.delete(f"/api/activities/{louvre['id']}", headers=headers)
+    assert search(client, headers, q='orsay')['results'] == []
+
+
+@pytest.mark.parametrize('params', [{}, {'q': '  '}, {'q': 'louvre', 'types': 'hotel'}, {'q': 'x', 'limit': 'ten'}])
+def test_bad_queries_are_rejected(client, trip, params):
+    headers, _ = trip
+    assert client.get('/api/search', query_string=params, headers=headers).status_code == 400
+
+
+def test_query_syntax_is_not_interpreted(client, trip):
+    headers, _ = trip
+    assert search(client, headers, q='louvre OR NOT "*')['results'] == []
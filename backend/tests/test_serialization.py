@@ -0,0 +1,110 @@
+import json
+import sqlite3
+
+import pytest
+
+import tp
+
+ITINERARY = {'days': [{'day': 1, 'activities': [{'name': 'Café de Flore', 'cost': 12.5}]}], 'note': 'ünïcode'}
+
+
+@pytest.fixture(params=sorted(tp.JSON_CODECS))
+def codec(request):
+    tp.configure_json(request.param)
+    yield request.param
+    tp.configure_json(tp.app.config['JSON_BACKEND'])
+
+
+@pytest.fixture
+def rows():
+    """Plan rows as sqlite3 returns them: one full, one with empty JSON columns"""
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.execute(f'CREATE TABLE travel_plans ({", ".join(tp.TravelPlan.__slots__)})')
+    full = tp.TravelPlan(id='p1', user_id='u1', destination='Zürich', budget=1000.0, duration=2,
+                         interests=['art', 'food'], start_date='2026-05-01', end_date='2026-05-02',
+                         itinerary=ITINERARY, total_cost=12.5, created_at='c', updated_at='u')
+    conn.execute(f'INSERT INTO travel_plans VALUES ({", ".join("?" * len(tp.TravelPlan.__slots__))})', full.to_row())
+    conn.execute("""INSERT INTO travel_plans (id, user_id, destination, budget, duration, interests, itinerary, version)
+                    VALUES ('p2', 'u1', 'Oslo', 500, 1, NULL, '', 3)""")
+    yield conn.execute('SELECT * FROM travel_plans ORDER BY id').fetchall()
+    conn.close()
+
+
+def test_from_row_decodes_json_columns(codec, rows):
+    plan = tp.TravelPlan.from_row(rows[0])
+    assert plan.itinerary == ITINERARY and plan.interests == ['art', 'food']
+    empty = tp.TravelPlan.from_row(rows[1])
+    assert (empty.itinerary, empty.interests, empty.version) == ({}, [], 3)
+
+
+def test_raw_columns_are_kept_as_stored_text(codec, rows):
+    plan = tp.TravelPlan.from_row(rows[0], raw=('itinerary',))
+    assert isinstance(plan.itinerary, tp.RawJSON) and json.loads(plan.itinerary) == ITINERARY
+    assert plan.to_dict()['itinerary'] == ITINERARY
+    assert json.loads(plan.to_json()) == plan.to_dict()
+
+
+def test_missing_columns_fall_back_to_defaults(codec):
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT 'p1' AS id, 'Oslo' AS destination").fetchone()
+    plan = tp.TravelPlan.from_row(row)
+    assert (plan.id, plan.destination, plan.version, plan.itinerary, plan.budget) == ('p1', 'Oslo', 1, {}, None)
+    conn.close()
+
+
+@pytest.mark.parametrize('fields', [None, ['id', 'itinerary'], ['itinerary'], ['id', 'destination']])
+def test_rows_to_json_with_raw_matches_the_decoded_document(codec, rows, fields):
+    names = fields or list(tp.TravelPlan.FIELDS)
+    expected = [{name: value for name, value in tp.TravelPlan.from_row(row).to_dict().items() if name in names}
+                for row in rows]
+    assert json.loads(tp.TravelPlan.rows_to_json(rows, fields, raw=('itinerary',))) == expected
+    assert json.loads(tp.TravelPlan.rows_to_json(rows, fields)) == expected
+    assert set(json.loads(tp.TravelPlan.rows_to_json(rows, fields, raw=('itinerary',)))[0]) == set(names)
+
+
+def test_empty_result_sets(codec):
+    assert tp.TravelPlan.rows_to_json([], raw=('itinerary',)) == b'[]'
+    assert json.loads(tp.TravelPlan.rows_to_json([])) == []
+
+
+def test_to_row_round_trips(codec, rows):
+    plan = tp.TravelPlan.from_row(rows[0])
+    assert tp.TravelPlan.from_row(rows[0]) == plan
+    assert json.loads(plan.to_row()[tp.TravelPlan.__slots__.index('itinerary')]) == ITINERARY
+
+
+def test_codecs_agree_and_keep_unicode(codec):
+    body = tp.json_dumps_bytes({'city': 'Zürich', 'n': 1.5, 'nested': [None, True]})
+    assert 'Zürich'.encode() in body
+    assert tp.json_loads(body) == {'city': 'Zürich', 'n': 1.5, 'nested': [None, True]}
+
+
+def test_private_fields_are_never_serialized():
+    user = tp.User(id='u', email='e', name='n', password_hash='secret', created_at='c')
+    assert 'password_hash' not in tp.User.FIELDS
+    assert b'secret' not in user.to_json()
+
+
+def test_constructor_checks_fields():
+    with pytest.raises(TypeError, match='missing field'):
+        tp.Expense(id='e')
+    with pytest.raises(TypeError, match='unexpected fields: colour'):
+        tp.Expense(id='e', plan_id='p', category='c', amount=1, description='d', date='x', created_at='c',
+                   colour='red')
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        tp.configure_json('simplejson')
+
+
+def test_api_responses_use_the_configured_codec(codec, client, register, make_plan):
+    headers = register()
+    plan = make_plan(headers, destination='Zürich')
+    client.put(f"/api/travel-plans/{plan['id']}", json={'itinerary': ITINERARY}, headers=headers)
+    for body in (client.get(f"/api/travel-plans/{plan['id']}", headers=headers).get_json(),
+                 client.get('/api/travel-plans', headers=headers).get_json()[0]):
+        assert body['destination'] == 'Zürich'
+        assert body['itinerary']['days'][0]['activities'][0]['name'] == 'Café de Flore'
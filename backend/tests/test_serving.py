@@ -0,0 +1,121 @@
+import os
+import runpy
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import pytest
+
+import tp
+from conftest import FakeModel
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRIP = {'destination': 'Paris', 'budget': 1000.0, 'duration': 2, 'interests': ['art']}
+
+
+def test_gunicorn_settings_come_from_the_environment(monkeypatch):
+    monkeypatch.setenv('WEB_CONCURRENCY', '3')
+    monkeypatch.setenv('GUNICORN_THREADS', '8')
+    monkeypatch.setenv('PORT', '8123')
+    settings = runpy.run_path(os.path.join(BACKEND, 'gunicorn.conf.py'))
+    assert (settings['workers'], settings['threads'], settings['bind']) == (3, 8, '0.0.0.0:8123')
+    assert settings['worker_class'] == 'gthread'
+
+
+def test_config_is_overridable_with_prefixed_environment_variables(tmp_path):
+    env = dict(os.environ, FLASK_DB_POOL_SIZE='16', FLASK_DATABASE=str(tmp_path / 'env.db'))
+    output = subprocess.run([sys.executable, '-c', "import tp; print(tp.app.config['DB_POOL_SIZE'], "
+                             "tp.app.config['DATABASE'])"], cwd=BACKEND, env=env, capture_output=True,
+                            text=True, timeout=60).stdout.split()
+    assert output == ['16', str(tmp_path / 'env.db')]
+
+
+@pytest.fixture
+def services(app, monkeypatch):
+    """Fresh process-wide services, so shutting them down leaves the module's own untouched"""
+    model = FakeModel()
+    model.gate = threading.Event()
+    generate_content = model.generate_content
+
+    def gated(*args, **kwargs):
+        model.gate.wait(5)
+        return generate_content(*args, **kwargs)
+    model.generate_content = gated
+
+    service = tp.AIItineraryService()
+    service.model = model
+    queue = tp.ItineraryJobQueue(service, max_workers=1, max_pending=10)
+    monkeypatch.setattr(tp, 'ai_service', service)
+    monkeypatch.setattr(tp, 'itinerary_jobs', queue)
+    monkeypatch.setattr(tp, 'openroute_service', tp.OpenRouteService())
+    monkeypatch.setattr(tp, 'password_hasher', tp.PasswordHasher())
+    yield model, queue
+    model.gate.set()
+
+
+def job_status(job_id):
+    with tp.db_connection() as conn:
+        return conn.execute('SELECT status FROM itinerary_jobs WHERE id = ?', (job_id,)).fetchone()['status']
+
+
+def test_shutdown_finishes_running_jobs_and_leaves_the_rest_queued(services):
+    model, queue = services
+    running, waiting = queue.submit('user', TRIP), queue.submit('user', TRIP)
+    while job_status(running) != 'running':
+        time.sleep(0.01)
+    threading.Timer(0.1, model.gate.set).start()
+    tp.shutdown_services(timeout=5)
+    assert (job_status(running), job_status(waiting)) == ('succeeded', 'queued')
+    assert queue.submit('user', TRIP) is None
+
+    # The next worker picks the queued job up
+    successor = tp.ItineraryJobQueue(tp.AIItineraryService(), max_workers=1, max_pending=10)
+    successor.service.model = FakeModel()
+    successor.resume_pending(stale_after=60)
+    assert successor.shutdown(timeout=5)
+    assert job_status(waiting) == 'succeeded'
+    successor.service.close()
+
+
+def test_shutdown_gives_up_on_jobs_past_the_timeout(services):
+    model, queue = services
+    job_id = queue.submit('user', TRIP)
+    while job_status(job_id) != 'running':
+        time.sleep(0.01)
+    assert not queue.shutdown(timeout=0.05)
+    model.gate.set()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_gunicorn_serves_and_stops_cleanly_on_sigterm(tmp_path):
+    port = free_port()
+    env = dict(os.environ, BIND=f'127.0.0.1:{port}', WEB_CONCURRENCY='2', GUNICORN_THREADS='4',
+               FLASK_DATABASE=str(tmp_path / 'gunicorn.db'))
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                              cwd=BACKEND, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/api/health', timeout=2) as response:
+                    assert response.status == 200
+                    break
+            except OSError:
+                assert server.poll() is None and time.monotonic() < deadline, 'gunicorn did not come up'
+                time.sleep(0.2)
+        server.send_signal(signal.SIGTERM)
+        assert server.wait(timeout=30) == 0
+    finally:
+        if server.poll() is None:
+            server.kill()
+        server.wait()
+        server.stdout.close()
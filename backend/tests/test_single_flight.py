@@ -0,0 +1,91 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import tp
+
+
+def run_concurrently(n, fn):
+    with ThreadPoolExecutor(max_workers=n) as executor:
+        return [future.result() for future in [executor.submit(fn) for _ in range(n)]]
+
+
+def gated(result):
+    """A call that blocks until released, counting how often it actually runs"""
+    gate, calls = threading.Event(), []
+
+    def fn():
+        calls.append(1)
+        gate.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return fn, gate, calls
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = tp.SingleFlight()
+    fn, gate, calls = gated({'days': [1]})
+    threading.Timer(0.1, gate.set).start()
+    results = run_concurrently(4, lambda: flight.do('k', fn, timeout=5))
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    # Followers get copies, so one caller mutating its result can't affect another
+    values = [value for value, _ in results]
+    assert all(value == {'days': [1]} for value in values)
+    assert len({id(value) for value in values}) == 4
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_leader_error_reaches_followers_and_is_not_remembered():
+    flight = tp.SingleFlight()
+    fn, gate, calls = gated(RuntimeError('model down'))
+    threading.Timer(0.1, gate.set).start()
+
+    def call():
+        with pytest.raises(RuntimeError, match='model down'):
+            flight.do('k', fn, timeout=5)
+    run_concurrently(3, call)
+    assert len(calls) == 1
+    assert flight.do('k', lambda: 'ok') == ('ok', False)
+
+
+def test_follower_times_out():
+    flight = tp.SingleFlight()
+    fn, gate, _ = gated('late')
+    leader = threading.Thread(target=flight.do, args=('k', fn))
+    leader.start()
+    while flight.stats()['in_flight'] == 0:
+        pass
+    with pytest.raises(TimeoutError):
+        flight.do('k', fn, timeout=0.05)
+    gate.set()
+    leader.join()
+    assert flight.stats()['timeouts'] == 1
+
+
+def test_different_keys_run_independently():
+    flight = tp.SingleFlight()
+    assert [flight.do(key, lambda key=key: key) for key in 'ab'] == [('a', False), ('b', False)]
+
+
+def test_identical_generations_reach_the_model_once(app, fake_model, monkeypatch):
+    monkeypatch.setattr(tp.ai_service, 'in_flight', tp.SingleFlight())
+    gate = threading.Event()
+    generate_content = fake_model.generate_content
+
+    def slow_model(*args, **kwargs):
+        gate.wait(5)
+        return generate_content(*args, **kwargs)
+
+    monkeypatch.setattr(fake_model, 'generate_content', slow_model)
+    threading.Timer(0.2, gate.set).start()
+
+    def generate():
+        with app.app_context():
+            return tp.ai_service.generate_itinerary_with_status('Lisbon', 800, 2, ['food'])
+    results = run_concurrently(3, generate)
+    assert sorted(status for _, status in results) == ['COALESCED', 'COALESCED', 'MISS']
+    assert len(fake_model.prompts) == 1
+    assert results[0][0] == results[1][0] == results[2][0]
@@ -0,0 +1,167 @@
+import random
+import sqlite3
+
+import pytest
+
+import tp
+
+# Clusters of activities, including one straddling the antimeridian (Fiji) and one far north
+CENTERS = [(48.8566, 2.3522), (41.9028, 12.4964), (-17.7134, 179.95), (78.2232, 15.6267)]
+
+
+@pytest.fixture
+def places(client, register, make_plan):
+    """A user with two plans of scattered activities (some without a location), and another user's noise"""
+    rng = random.Random(7)
+    headers = register()
+    activities = []
+    for _ in range(2):
+        plan = make_plan(headers)
+        rows = []
+        for i in range(150):
+            lat, lng = rng.choice(CENTERS)
+            lat, lng = lat + rng.uniform(-0.5, 0.5), lng + rng.uniform(-0.5, 0.5)
+            lng = (lng + 180) % 360 - 180
+            location = {} if i % 25 == 0 else {'lat': lat, 'lng': lng}
+            rows.append({'name': f'Spot {i}', 'day': 1 + i % 3, 'location': location})
+        response = client.post('/api/activities/bulk', json={'plan_id': plan['id'], 'activities': rows},
+                               headers=headers)
+        assert response.status_code == 201
+        activities += [dict(row, id=result['id'], plan_id=plan['id'])
+                       for row, result in zip(rows, response.get_json()['results'])]
+    other = register('bob@example.com')
+    noise = make_plan(other)
+    client.post('/api/activities/bulk', json={'plan_id': noise['id'], 'activities': [
+        {'name': 'Not yours', 'location': {'lat': lat, 'lng': lng}} for lat, lng in CENTERS]}, headers=other)
+    return headers, activities
+
+
+def located(activities):
+    return [a for a in activities if a['location']]
+
+
+def in_box(activity, min_lng, min_lat, max_lng, max_lat):
+    lat, lng = activity['location']['lat'], activity['location']['lng']
+    if not min_lat <= lat <= max_lat:
+        return False
+    if min_lng <= max_lng:
+        return min_lng <= lng <= max_lng or min_lng <= lng - 360 <= max_lng or min_lng <= lng + 360 <= max_lng
+    return lng >= min_lng or lng <= max_lng  # crosses the antimeridian
+
+
+def within(client, headers, bbox, **params):
+    response = client.get('/api/activities/within', headers=headers,
+                          query_string=dict(params, bbox=','.join(str(v) for v in bbox), limit=2000))
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def nearby(client, headers, **params):
+    response = client.get('/api/activities/nearby', headers=headers, query_string=dict(params, limit=2000))
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_index_lists_spatial_endpoints(client):
+    endpoints = client.get('/').get_json()['endpoints']
+    assert {'/api/activities/within (GET)', '/api/activities/nearby (GET)'} <= set(endpoints)
+
+
+@pytest.mark.parametrize('bbox', [
+    (2.0, 48.5, 2.6, 49.0),
+    (-180, -90, 180, 90),
+    (179.7, -18.0, -179.7, -17.4),   # min_lng > max_lng: wraps across the antimeridian
+    (179.7, -18.0, 180.3, -17.4),    # the same box written past 180
+    (10, 70, 20, 80),
+    (100, 0, 110, 10),
+])
+def test_bbox_matches_brute_force(client, places, bbox):
+    headers, activities = places
+    expected = {a['id'] for a in located(activities) if in_box(a, *bbox)}
+    body = within(client, headers, bbox)
+    assert {a['id'] for a in body['activities']} == expected
+    assert not body['truncated']
+    assert sum(plan['count'] for plan in body['plans']) == len(expected)
+
+
+@pytest.mark.parametrize('lat, lng, radius', [
+    (48.8566, 2.3522, 5), (48.8566, 2.3522, 50), (-17.7134, 179.99, 30), (78.2232, 15.6267, 25), (0, 0, 10),
+])
+def test_radius_matches_brute_force(client, places, lat, lng, radius):
+    headers, activities = places
+    expected = sorted((tp.distance_km(lat, lng, a['location']['lat'], a['location']['lng']), a['id'])
+                      for a in located(activities))
+    expected = [activity_id for distance, activity_id in expected if distance <= radius]
+    body = nearby(client, headers, lat=lat, lng=lng, radius_km=radius)
+    assert [a['id'] for a in body['activities']] == expected
+    distances = [a['distance_km'] for a in body['activities']]
+    assert distances == sorted(distances)
+
+
+def test_nearby_an_activity_excludes_itself(client, places):
+    headers, activities = places
+    origin = located(activities)[0]
+    body = nearby(client, headers, activity_id=origin['id'], radius_km=20)
+    ids = [a['id'] for a in body['activities']]
+    assert origin['id'] not in ids
+    lat, lng = origin['location']['lat'], origin['location']['lng']
+    assert set(ids) == {a['id'] for a in located(activities) if a['id'] != origin['id']
+                        and tp.distance_km(lat, lng, a['location']['lat'], a['location']['lng']) <= 20}
+
+
+def test_limit_marks_truncation(client, places):
+    headers, _ = places
+    response = client.get('/api/activities/within', headers=headers,
+                          query_string={'bbox': '-180,-90,180,90', 'limit': 5})
+    body = response.get_json()
+    assert len(body['activities']) == 5 and body['truncated']
+
+
+def rtree_ids(app):
+    conn = sqlite3.connect(app.config['DATABASE'])
+    ids = {row[0] for row in conn.execute('''SELECT p.activity_id FROM activity_rtree r
+                                            JOIN activity_points p ON p.id = r.id''')}
+    conn.close()
+    return ids
+
+
+def test_rtree_follows_activity_updates_and_deletes(app, client, places):
+    headers, activities = places
+    paris = (2.0, 48.5, 2.6, 49.0)
+    moving = next(a for a in located(activities) if in_box(a, *paris))
+    assert rtree_ids(app) >= {a['id'] for a in located(activities)}
+
+    # Moved to Rome: leaves the Paris box, shows up in Rome's
+    client.put(f"/api/activities/{moving['id']}", json={'location': {'lat': 41.9, 'lng': 12.5}}, headers=headers)
+    assert moving['id'] not in {a['id'] for a in within(client, headers, paris)['activities']}
+    assert moving['id'] in {a['id'] for a in within(client, headers, (12.4, 41.8, 12.6, 42.0))['activities']}
+
+    # Location cleared: gone from the index entirely
+    client.put(f"/api/activities/{moving['id']}", json={'location': {}}, headers=headers)
+    assert moving['id'] not in rtree_ids(app)
+
+    # Location set on an activity that never had one
+    unplaced = next(a for a in activities if not a['location'])
+    client.put(f"/api/activities/{unplaced['id']}", json={'location': {'lat': 48.8, 'lng': 2.3}}, headers=headers)
+    assert unplaced['id'] in {a['id'] for a in within(client, headers, paris)['activities']}
+
+    # Deleted activity, then a whole deleted plan
+    client.delete(f"/api/activities/{unplaced['id']}", headers=headers)
+    assert unplaced['id'] not in rtree_ids(app)
+    plan_id = activities[0]['plan_id']
+    client.delete(f'/api/travel-plans/{plan_id}', headers=headers)
+    assert not rtree_ids(app) & {a['id'] for a in activities if a['plan_id'] == plan_id}
+    body = within(client, headers, (-180, -90, 180, 90))
+    assert {a['plan_id'] for a in body['activities']} == {activities[-1]['plan_id']}
+
+
+@pytest.mark.parametrize('path, params', [
+    ('/api/activities/within', {'bbox': '1,2,3'}),
+    ('/api/activities/within', {'bbox': '0,10,1,5'}),
+    ('/api/activities/nearby', {'lat': 10}),
+    ('/api/activities/nearby', {'lat': 95, 'lng': 0}),
+    ('/api/activities/nearby', {'lat': 0, 'lng': 0, 'radius_km': 1000}),
+])
+def test_bad_parameters_are_rejected(client, places, path, params):
+    headers, _ = places
+    assert client.get(path, query_string=params, headers=headers).status_code == 400
@@ -0,0 +1,48 @@
+import json
+
+import tp
+from conftest import fake_itinerary
+
+
+def feed_in_chunks(text: str, size: int):
+    parser = tp.StreamingItineraryParser()
+    emitted = []
+    for i in range(0, len(text), size):
+        emitted.extend(parser.feed(text[i:i + size]))
+    return parser, emitted
+
+
+def test_parser_emits_each_day_once_it_closes():
+    text = '```json\n' + json.dumps(fake_itinerary(3)) + '\n```'
+    for size in (1, 7, len(text)):
+        parser, emitted = feed_in_chunks(text, size)
+        assert [day['day'] for day in emitted] == [1, 2, 3]
+        assert parser.result()['total_estimated_cost'] == 120
+
+
+def test_parser_ignores_braces_inside_strings():
+    itinerary = {'days': [{'day': 1, 'activities': [{'name': 'Bar "}{" ]', 'description': 'a\\"}b'}]}]}
+    parser, emitted = feed_in_chunks(json.dumps(itinerary), 3)
+    assert emitted == itinerary['days']
+
+
+def test_parser_keeps_closed_days_of_truncated_output():
+    text = json.dumps(fake_itinerary(3))
+    parser, emitted = feed_in_chunks(text[:text.index('{"day": 3')], 5)
+    assert [day['day'] for day in emitted] == [1, 2]
+    assert parser.result() is None
+
+
+def test_missing_days_follow_up_emits_only_new_days(app, fake_model):
+    full = '```json\n' + json.dumps(fake_itinerary(3))
+    fake_model.days = 3
+    fake_model.truncate = full.index('{"day": 2')
+    # The follow-up answers with every day, including day 1 which was already streamed
+    fake_model.followup = json.dumps({'days': fake_itinerary(3)['days']})
+    emitted = []
+    itinerary, status = tp.ai_service.generate_itinerary_with_status('Paris', 1000, 3, ['art'],
+                                                                     on_day=emitted.append)
+    assert [day['day'] for day in emitted] == [1, 2, 3]
+    assert [day['day'] for day in itinerary['days']] == [1, 2, 3]
+    assert status == 'MISS'
+    assert 'Only produce days 2, 3.' in fake_model.prompts[-1]
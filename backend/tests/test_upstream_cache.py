@@ -0,0 +1,125 @@
+import time
+
+import tp
+
+
+def make_cache(**overrides):
+    options = dict(ttl=60, negative_ttl=5, stale_ttl=30, memory_entries=2, max_entries=3, prune_every=1)
+    options.update(overrides)
+    return tp.UpstreamCache('test', **options)
+
+
+def stored_keys(namespace='test'):
+    with tp.db_connection() as conn:
+        return {row['cache_key'] for row in conn.execute(
+            'SELECT cache_key FROM upstream_cache WHERE namespace = ?', (namespace,))}
+
+
+def test_hit_from_memory_then_database(app):
+    cache = make_cache()
+    cache.put('a', [1])
+    assert cache.get('a') == ([1], 'fresh')
+    # A second worker has only the table to go on
+    assert make_cache().get('a') == ([1], 'fresh')
+    assert cache.stats()['memory_hits'] == 1
+
+
+def test_stale_then_expired(app, monkeypatch):
+    cache = make_cache()
+    now = time.time()
+    cache.put('a', [1])
+    monkeypatch.setattr(tp.time, 'time', lambda: now + 61)
+    assert cache.get('a') == ([1], 'stale')
+    monkeypatch.setattr(tp.time, 'time', lambda: now + 91)
+    assert cache.get('a') == (None, None)
+
+
+def test_negative_entries_have_their_own_ttl(app, monkeypatch):
+    cache = make_cache()
+    now = time.time()
+    cache.put('nothing', [], negative=True)
+    assert cache.get('nothing') == ([], 'fresh')
+    monkeypatch.setattr(tp.time, 'time', lambda: now + 6)
+    assert cache.get('nothing') == (None, None)
+
+
+def test_prune_is_amortized_over_puts(app):
+    cache = make_cache(prune_every=4)
+    for key in 'abcde':
+        cache.put(key, key)
+    # The fourth store swept the table back to max_entries; the fifth waits for the next sweep
+    assert cache.stats()['prunes'] == 1
+    assert len(stored_keys()) == 4
+    for key in 'fgh':
+        cache.put(key, key)
+    assert cache.stats()['prunes'] == 2
+    assert len(stored_keys()) == 3
+
+
+def test_eviction_drops_least_recently_used_in_own_namespace(app):
+    other = tp.UpstreamCache('other', ttl=60, negative_ttl=5, stale_ttl=30, memory_entries=2, max_entries=1)
+    other.put('x', 1)
+    cache = make_cache(memory_entries=0)
+    for key in 'abc':
+        cache.put(key, key)
+    assert make_cache().get('a')[0] == 'a'  # touches 'a', so 'b' is now the oldest
+    cache.put('d', 'd')
+    assert stored_keys() == {'a', 'c', 'd'}
+    assert stored_keys('other') == {'x'}
+    assert cache.stats()['evictions'] == 1
+
+
+def test_prune_removes_expired_entries(app, monkeypatch):
+    cache = make_cache(prune_every=100)
+    now = time.time()
+    cache.put('old', 1)
+    monkeypatch.setattr(tp.time, 'time', lambda: now + 120)
+    cache.put('new', 2)
+    assert stored_keys() == {'old', 'new'}
+    assert cache.prune() == 1
+    assert stored_keys() == {'new'}
+
+
+def test_expiry_sweep_uses_an_index(app):
+    sql = 'DELETE FROM upstream_cache WHERE namespace = ? AND stale_until < ?'
+    with tp.db_connection() as conn:
+        plan = ' '.join(row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', (None, None)))
+    assert 'idx_upstream_cache_namespace_stale' in plan
+
+
+def places_requests(upstream):
+    return [path for _, path, _ in upstream.requests if path.startswith('/geocod')]
+
+
+def test_nearby_searches_share_a_grid_cell(ors, upstream):
+    first = ors.search_places('Eiffel  Tower', location='2.29451,48.85841')
+    assert ors.search_places('eiffel tower', location='2.29449,48.85839') == first
+    assert len(places_requests(upstream)) == 1
+    ors.search_places('eiffel tower', location='2.35,48.86')  # a different cell
+    ors.search_places('eiffel tower', bbox=[2.2, 48.8, 2.4, 48.9])
+    assert len(places_requests(upstream)) == 3
+
+
+def test_empty_results_are_cached_negatively(ors, upstream):
+    upstream.script = [(200, {}, {'features': []})]
+    assert ors.search_places('nowhere') == []
+    assert ors.search_places('nowhere') == []
+    assert len(places_requests(upstream)) == 1
+
+
+def test_upstream_errors_are_not_cached(ors, upstream):
+    upstream.script = [(400, {}, {})]
+    assert ors.search_places('tower') == []
+    assert ors.search_places('tower')[0]['name'] == 'Eiffel Tower'
+    assert len(places_requests(upstream)) == 2
+
+
+def test_stale_places_are_served_while_revalidating(ors, upstream, monkeypatch):
+    monkeypatch.setattr(ors.geocode_cache, 'ttl', 0)
+    first = ors.search_places('tower')
+    assert ors.search_places('tower') == first
+    deadline = time.monotonic() + 5
+    while len(places_requests(upstream)) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(places_requests(upstream)) == 2
+    assert ors.stats()['refreshes'] == 1 and ors.geocode_cache.stats()['stale_hits'] == 1
@@ -1,23 +1,137 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, g, Response, stream_with_context, has_request_context
 from flask_cors import CORS
+from flask.json.provider import DefaultJSONProvider
 from datetime import datetime, timedelta
 import sqlite3
 import json
 import os
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Set, Tuple
 import requests
+from urllib.parse import urlencode
+from email.utils import formatdate
+from requests.adapters import HTTPAdapter
 import google.generativeai as genai
-from dataclasses import dataclass, asdict
 import uuid
 import hashlib
+import base64
+import gzip
+import csv
+import io
 import jwt
+from collections import OrderedDict
+import threading
+import time
+import math
+import re
+import random
+from email.utils import parsedate_to_datetime
+import copy
+import cProfile
+import pstats
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import hmac
+import secrets
+from contextlib import contextmanager
 from functools import wraps
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS  # This is the correct CORS for Flask
 
+try:
+    import brotli  # optional, enables br response compression
+except ImportError:
+    brotli = None
+
+try:
+    import orjson  # optional, faster JSON for responses and JSON columns
+except ImportError:
+    orjson = None
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'a-very-secret-and-secure-key-that-you-should-change'
 app.config['JWT_EXPIRATION_DELTA'] = timedelta(hours=24)
+app.config['DATABASE'] = 'travel_planner.db'
+app.config['DB_POOL_SIZE'] = 8
+app.config['DB_POOL_TIMEOUT'] = 10  # seconds to wait for a free connection
+app.config['PLAN_LIST_MAX_LIMIT'] = 100
+app.config['BULK_MAX_ROWS'] = 5000
+app.config['COMPRESS_MIN_SIZE'] = 1024  # bytes; smaller responses are sent uncompressed
+app.config['COMPRESS_GZIP_LEVEL'] = 6
+app.config['COMPRESS_BROTLI_QUALITY'] = 5
+app.config['ITINERARY_CACHE_TTL'] = 24 * 60 * 60  # seconds
+app.config['ITINERARY_CACHE_MAX_ENTRIES'] = 5000
+app.config['ITINERARY_CACHE_BUDGET_BAND'] = 0.1  # budgets within ~10% share an entry
+app.config['ITINERARY_COALESCE_TIMEOUT'] = 60  # seconds a duplicate request waits for the leader
+app.config['ITINERARY_FANOUT_MIN_DAYS'] = 5  # trips this long are generated one day per call
+app.config['ITINERARY_FANOUT_WORKERS'] = 4
+app.config['ITINERARY_JOB_WORKERS'] = 4
+app.config['ORS_BASE_URL'] = 'https://api.openrouteservice.org'
+app.config['ORS_POOL_SIZE'] = 20
+app.config['ORS_CONNECT_TIMEOUT'] = 3.05  # seconds
+app.config['ORS_READ_TIMEOUT'] = 10  # seconds
+app.config['ORS_MAX_RETRIES'] = 2
+app.config['ORS_BACKOFF_BASE'] = 0.25  # seconds, doubled per retry
+app.config['ORS_BACKOFF_MAX'] = 5  # longest backoff or Retry-After we will sleep for
+app.config['ORS_BREAKER_FAILURES'] = 5  # consecutive failures before failing fast
+app.config['ORS_BREAKER_RESET'] = 30  # seconds before a trial request is let through
+app.config['GEOCODE_CACHE_TTL'] = 7 * 24 * 60 * 60  # seconds
+app.config['GEOCODE_CACHE_NEGATIVE_TTL'] = 60 * 60  # seconds to remember empty results
+app.config['GEOCODE_CACHE_STALE_TTL'] = 24 * 60 * 60  # seconds stale entries may be served while refreshing
+app.config['GEOCODE_CACHE_MEMORY_ENTRIES'] = 2000
+app.config['GEOCODE_CACHE_MAX_ENTRIES'] = 50000
+app.config['GEOCODE_GRID'] = 0.01  # degrees (~1 km); nearby locations and bboxes share entries
+app.config['DIRECTIONS_CACHE_TTL'] = 30 * 24 * 60 * 60  # seconds
+app.config['DIRECTIONS_CACHE_MEMORY_ENTRIES'] = 2000
+app.config['DIRECTIONS_CACHE_MAX_ENTRIES'] = 100000
+app.config['DIRECTIONS_COORD_PRECISION'] = 4  # decimal places (~11 m) used in leg cache keys
+app.config['ORS_MATRIX_MAX_LOCATIONS'] = 50
+app.config['UPSTREAM_CACHE_PRUNE_EVERY'] = 200  # stores between expiry/eviction sweeps of a namespace
+app.config['ORS_DIRECTIONS_WORKERS'] = 4
+app.config['ITINERARY_JOB_MAX_PENDING'] = 100
+app.config['ITINERARY_JOB_STALE_AFTER'] = 10 * 60  # seconds before a running job is presumed orphaned
+app.config['PASSWORD_KDF'] = 'scrypt'  # or 'pbkdf2-sha256'
+app.config['PASSWORD_SCRYPT_N'] = 2 ** 14
+app.config['PASSWORD_SCRYPT_R'] = 8
+app.config['PASSWORD_SCRYPT_P'] = 1
+app.config['PASSWORD_PBKDF2_ITERATIONS'] = 600000
+app.config['PASSWORD_HASH_WORKERS'] = 2  # processes; 0 hashes on the request thread
+app.config['PASSWORD_HASH_MAX_PENDING'] = 32  # hashes queued or running before logins are shed
+app.config['PASSWORD_HASH_TIMEOUT'] = 10  # seconds
+app.config['AUTH_TOKEN_CACHE_ENTRIES'] = 10000
+app.config['AUTH_REVOCATION_REFRESH'] = 5  # seconds between polls for logouts made on other workers
+app.config['AUTH_USER_CACHE_TTL'] = 60  # seconds
+app.config['AUTH_USER_CACHE_ENTRIES'] = 10000
+app.config['SSE_POLL_INTERVAL'] = 0.5  # seconds
+app.config['SSE_HEARTBEAT_INTERVAL'] = 15  # seconds
+app.config['METRICS_SLOW_REQUEST_SECONDS'] = None  # log a span breakdown for slower requests; None disables
+app.config['METRICS_PROFILE_SAMPLE_RATE'] = 0.0  # fraction of requests run under cProfile, reported only if slow
+app.config['GEMINI_API_ENDPOINT'] = None  # e.g. a proxy or the benchmark stub; None uses Google's default
+app.config['JSON_BACKEND'] = 'auto'  # 'json', 'orjson', or 'auto' for orjson when installed
+app.config['RATE_LIMITS'] = {  # group -> [requests, per seconds], per user (or client IP when anonymous)
+    'itinerary': [10, 60],
+    'places': [60, 60],
+    'directions': [60, 60],
+}
+app.config['RATE_LIMIT_STORAGE'] = 'memory'  # 'sqlite' shares buckets between workers through the database
+app.config['RATE_LIMIT_MAX_KEYS'] = 100000  # in-memory buckets kept before the least recent is dropped
+app.config['RATE_LIMIT_TRUSTED_PROXIES'] = 0  # X-Forwarded-For hops to trust when keying by client IP
+app.config['ADMISSION_LIMITS'] = {  # group -> [concurrent requests, queued requests] per worker
+    'itinerary': [8, 16],
+    'places': [16, 32],
+    'directions': [16, 32],
+}
+app.config['ADMISSION_QUEUE_TIMEOUT'] = 5  # seconds a queued request waits for a slot before a 503
+app.config['SEARCH_DEFAULT_LIMIT'] = 20
+app.config['SEARCH_MAX_LIMIT'] = 100
+app.config['SEARCH_MAX_TERMS'] = 8  # words beyond this are ignored
+app.config['SPATIAL_DEFAULT_LIMIT'] = 500
+app.config['SPATIAL_MAX_LIMIT'] = 2000
+app.config['SPATIAL_MAX_RADIUS_KM'] = 100
+# Deployments override any of the above with FLASK_-prefixed environment variables,
+# e.g. FLASK_SECRET_KEY, FLASK_DATABASE or FLASK_DB_POOL_SIZE=16
+app.config.from_prefixed_env()
 # Configure CORS properly for Flask
 CORS(app, 
      origins="*",  # Allow all origins (tighten for production)
@@ -29,69 +143,347 @@ GEMINI_API_KEY =  "GEMINI-API-KEY"
 ORS_KEY =  "ORS_KEY"
 
 # Initialize Gemini AI
-genai.configure(api_key=GEMINI_API_KEY)
+if app.config['GEMINI_API_ENDPOINT']:
+    # REST transport so the endpoint can be a plain HTTP proxy or stub
+    genai.configure(api_key=GEMINI_API_KEY, transport='rest',
+                    client_options={'api_endpoint': app.config['GEMINI_API_ENDPOINT']})
+else:
+    genai.configure(api_key=GEMINI_API_KEY)
 model = genai.GenerativeModel('gemini-1.5-flash')
 
+# JSON Encoding
+# A codec is (dumps -> UTF-8 bytes, loads); responses and JSON columns both go through the selected one
+def _stdlib_json_dumps(obj, default: Optional[Callable] = None) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=default).encode()
+
+def _orjson_dumps(obj, default: Optional[Callable] = None) -> bytes:
+    return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+JSON_CODECS: Dict[str, Tuple[Callable, Callable]] = {'json': (_stdlib_json_dumps, json.loads)}
+if orjson:
+    JSON_CODECS['orjson'] = (_orjson_dumps, orjson.loads)
+
+_json_codec = JSON_CODECS['orjson' if orjson else 'json']
+
+def configure_json(backend: str = 'auto'):
+    global _json_codec
+    if backend == 'auto':
+        backend = 'orjson' if orjson else 'json'
+    if backend not in JSON_CODECS:
+        raise ValueError(f'JSON backend {backend!r} is not available')
+    _json_codec = JSON_CODECS[backend]
+
+def json_dumps_bytes(obj, default: Optional[Callable] = None) -> bytes:
+    return _json_codec[0](obj, default)
+
+def json_dumps(obj) -> str:
+    return _json_codec[0](obj, None).decode()
+
+def json_loads(data):
+    return _json_codec[1](data)
+
+def json_response(body: bytes, status: int = 200) -> Response:
+    return app.response_class(body, status=status, mimetype='application/json')
+
+class RawJSON(str):
+    """Stored column text that is already JSON; spliced into output rather than decoded"""
+    __slots__ = ()
+
+def _encode_with_raw(values: Dict) -> bytes:
+    """Encode a flat object, splicing RawJSON values in as stored"""
+    raw = [b'"' + name.encode() + b'":' + values.pop(name).encode()
+           for name in [name for name, value in values.items() if isinstance(value, RawJSON)]]
+    body = json_dumps_bytes(values)
+    if raw:
+        body = body[:-1] + (b',' if values else b'') + b','.join(raw) + b'}'
+    return body
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Sends jsonify and request.get_json through the configured codec"""
+    @staticmethod
+    def default(o):
+        if isinstance(o, Model):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs) -> str:
+        return json_dumps_bytes(obj, kwargs.get('default', self.default)).decode()
+
+    def loads(self, s, **kwargs):
+        return json_loads(s)
+
+    def response(self, *args, **kwargs) -> Response:
+        return json_response(json_dumps_bytes(self._prepare_response_obj(args, kwargs), self.default))
+
+app.json = FastJSONProvider(app)
+
 # Data Models
-@dataclass
-class User:
-    id: str
-    email: str
-    name: str
-    password_hash: str
-    created_at: str
-
-@dataclass
-class TravelPlan:
-    id: str
-    user_id: str
-    destination: str
-    budget: float
-    duration: int
-    interests: List[str]
-    start_date: str
-    end_date: str
-    itinerary: Dict
-    total_cost: float
-    created_at: str
-    updated_at: str
-
-@dataclass
-class Activity:
-    id: str
-    plan_id: str
-    name: str
-    description: str
-    location: Dict
-    cost: float
-    duration: int
-    category: str
-    day: int
-    time_slot: str
-
-@dataclass
-class Expense:
-    id: str
-    plan_id: str
-    category: str
-    amount: float
-    description: str
-    date: str
-    created_at: str
+class Model:
+    """Slotted record read straight from sqlite3.Row and encoded without a deep copy"""
+    __slots__ = ()
+    DEFAULTS: Dict[str, object] = {}
+    JSON_COLUMNS: Dict[str, Callable] = {}  # column -> factory for its empty value
+    PRIVATE_FIELDS: Tuple[str, ...] = ()
+    FIELDS: Tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.FIELDS = tuple(name for name in cls.__slots__ if name not in cls.PRIVATE_FIELDS)
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            if name in fields:
+                value = fields.pop(name)
+            elif name in self.DEFAULTS:
+                value = self.DEFAULTS[name]
+            else:
+                raise TypeError(f'{type(self).__name__} missing field {name!r}')
+            setattr(self, name, value)
+        if fields:
+            raise TypeError(f'{type(self).__name__} got unexpected fields: {", ".join(fields)}')
+
+    @classmethod
+    def _row_values(cls, row, names, raw: Tuple[str, ...]) -> Dict:
+        values = dict(zip(row.keys(), row))
+        result = {}
+        for name in names:
+            value = values.get(name, cls.DEFAULTS.get(name))
+            if name in cls.JSON_COLUMNS:
+                if not value:
+                    value = cls.JSON_COLUMNS[name]()
+                elif name in raw:
+                    value = RawJSON(value)
+                else:
+                    value = json_loads(value)
+            result[name] = value
+        return result
+
+    @classmethod
+    def from_row(cls, row, raw: Tuple[str, ...] = ()) -> 'Model':
+        """Decode JSON columns except those in raw, which stay as RawJSON; columns not selected get defaults"""
+        model = cls.__new__(cls)
+        for name, value in cls._row_values(row, cls.__slots__, raw).items():
+            setattr(model, name, value)
+        return model
+
+    @classmethod
+    def rows_to_json(cls, rows, fields: Optional[List[str]] = None, raw: Tuple[str, ...] = ()) -> bytes:
+        """Encode rows as a JSON array without building instances"""
+        names = cls.FIELDS if fields is None else fields
+        if raw:
+            return b'[' + b','.join(_encode_with_raw(cls._row_values(row, names, raw)) for row in rows) + b']'
+        return json_dumps_bytes([cls._row_values(row, names, raw) for row in rows])
+
+    def to_dict(self, fields: Optional[List[str]] = None) -> Dict:
+        result = {}
+        for name in self.FIELDS if fields is None else fields:
+            value = getattr(self, name)
+            # orjson only decodes exact str, not subclasses
+            result[name] = json_loads(str(value)) if isinstance(value, RawJSON) else value
+        return result
+
+    def to_json(self, fields: Optional[List[str]] = None) -> bytes:
+        return _encode_with_raw({name: getattr(self, name) for name in (self.FIELDS if fields is None else fields)})
+
+    def to_row(self) -> tuple:
+        """Values in __slots__ order with JSON columns encoded, for INSERTs"""
+        return tuple(json_dumps(getattr(self, name)) if name in self.JSON_COLUMNS else getattr(self, name)
+                     for name in self.__slots__)
+
+    def __eq__(self, other) -> bool:
+        return type(other) is type(self) and all(getattr(self, name) == getattr(other, name)
+                                                  for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+class User(Model):
+    __slots__ = ('id', 'email', 'name', 'password_hash', 'created_at')
+    PRIVATE_FIELDS = ('password_hash',)
+
+class TravelPlan(Model):
+    __slots__ = ('id', 'user_id', 'destination', 'budget', 'duration', 'interests', 'start_date',
+                 'end_date', 'itinerary', 'total_cost', 'created_at', 'updated_at', 'version')
+    DEFAULTS = {'version': 1}
+    JSON_COLUMNS = {'interests': list, 'itinerary': dict}
+
+class Activity(Model):
+    __slots__ = ('id', 'plan_id', 'name', 'description', 'location', 'cost', 'duration', 'category',
+                 'day', 'time_slot', 'position')
+    DEFAULTS = {'position': 0}
+    JSON_COLUMNS = {'location': dict}
+
+class Expense(Model):
+    __slots__ = ('id', 'plan_id', 'category', 'amount', 'description', 'date', 'created_at')
 
 # Utility Functions
+def _derive_scrypt(password: bytes, salt: bytes, params: Dict[str, int]) -> bytes:
+    n, r, p = params['n'], params['r'], params['p']
+    return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * n * r * (p + 1) + (1 << 20), dklen=32)
+
+def _derive_pbkdf2(password: bytes, salt: bytes, params: Dict[str, int]) -> bytes:
+    return hashlib.pbkdf2_hmac('sha256', password, salt, params['i'], dklen=32)
+
+# Hashes are stored as $<kdf>$<k=v,...>$<salt>$<digest> so cost can change without a migration
+PASSWORD_KDFS: Dict[str, Callable[[bytes, bytes, Dict[str, int]], bytes]] = {
+    'scrypt': _derive_scrypt,
+    'pbkdf2-sha256': _derive_pbkdf2,
+}
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip('=')
+
+def _unb64(data: str) -> bytes:
+    return base64.b64decode(data + '=' * (-len(data) % 4))
+
+def _compute_password_hash(password: str, kdf: str, params: Dict[str, int]) -> str:
+    """Derive a new encoded hash; runs inside the hashing process pool"""
+    salt = secrets.token_bytes(16)
+    digest = PASSWORD_KDFS[kdf](password.encode(), salt, params)
+    encoded_params = ','.join(f'{k}={v}' for k, v in sorted(params.items()))
+    return f'${kdf}${encoded_params}${_b64(salt)}${_b64(digest)}'
+
+def _check_password_hash(password: str, hashed: str) -> bool:
+    """Verify against an encoded or legacy unsalted SHA-256 hash; runs inside the hashing process pool"""
+    if not hashed.startswith('$'):
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), hashed)
+    try:
+        _, kdf, encoded_params, salt, digest = hashed.split('$')
+        params = {k: int(v) for k, v in (item.split('=') for item in encoded_params.split(','))}
+        derived = PASSWORD_KDFS[kdf](password.encode(), _unb64(salt), params)
+    except (ValueError, KeyError):
+        return False
+    return hmac.compare_digest(derived, _unb64(digest))
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool has too much queued work to take another request"""
+
+class PasswordHasher:
+    """Runs KDF work on a bounded process pool so hashing cannot starve request threads of CPU"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = None
+        self._dummy = {}
+        self.latency = metrics.histogram('tp_password_hash_seconds')
+        self.hashed = 0
+        self.verified = 0
+        self.rehashed = 0
+        self.rejected = 0
+
+    def current_params(self) -> Tuple[str, Dict[str, int]]:
+        kdf = app.config['PASSWORD_KDF']
+        if kdf == 'scrypt':
+            return kdf, {'n': app.config['PASSWORD_SCRYPT_N'], 'r': app.config['PASSWORD_SCRYPT_R'],
+                         'p': app.config['PASSWORD_SCRYPT_P']}
+        if kdf == 'pbkdf2-sha256':
+            return kdf, {'i': app.config['PASSWORD_PBKDF2_ITERATIONS']}
+        raise ValueError(f'Unknown password KDF: {kdf}')
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        workers = app.config['PASSWORD_HASH_WORKERS']
+        if workers <= 0:
+            return None
+        with self._lock:
+            if self._pending is None:
+                self._pending = threading.BoundedSemaphore(app.config['PASSWORD_HASH_MAX_PENDING'])
+            if self._executor is None:
+                # spawn rather than fork: the parent is multi-threaded
+                self._executor = ProcessPoolExecutor(max_workers=workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _run(self, fn: Callable, *args):
+        started = time.monotonic()
+        executor = self._get_executor()
+        try:
+            if executor is None:
+                return fn(*args)
+            # A full pool sheds the request at once instead of parking a request thread on the semaphore
+            if not self._pending.acquire(blocking=False):
+                with self._lock:
+                    self.rejected += 1
+                raise PasswordHasherBusy()
+            try:
+                try:
+                    future = executor.submit(fn, *args)
+                except BaseException:
+                    self._pending.release()
+                    raise
+                # The slot is freed when the work ends, not when we stop waiting, so timed-out hashes still count
+                future.add_done_callback(lambda _: self._pending.release())
+                return future.result(timeout=app.config['PASSWORD_HASH_TIMEOUT'])
+            except BrokenProcessPool as e:
+                print(f"Password hashing pool error: {e}")
+                with self._lock:
+                    self._executor = None
+                return fn(*args)
+            except FutureTimeoutError:
+                future.cancel()
+                raise PasswordHasherBusy()
+        finally:
+            self.latency.observe(time.monotonic() - started)
+
+    def hash(self, password: str) -> str:
+        kdf, params = self.current_params()
+        result = self._run(_compute_password_hash, password, kdf, params)
+        with self._lock:
+            self.hashed += 1
+        return result
+
+    def verify(self, password: str, hashed: str) -> bool:
+        result = self._run(_check_password_hash, password, hashed)
+        with self._lock:
+            self.verified += 1
+        return result
+
+    def needs_rehash(self, hashed: str) -> bool:
+        kdf, params = self.current_params()
+        encoded_params = ','.join(f'{k}={v}' for k, v in sorted(params.items()))
+        return not hashed.startswith(f'${kdf}${encoded_params}$')
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def dummy_hash(self) -> str:
+        """A hash at the current cost that no password matches, for timing-equalised misses"""
+        kdf, params = self.current_params()
+        key = (kdf, tuple(sorted(params.items())))
+        if key not in self._dummy:
+            self._dummy[key] = self._run(_compute_password_hash, secrets.token_hex(16), kdf, params)
+        return self._dummy[key]
+
+    def record_rehash(self):
+        with self._lock:
+            self.rehashed += 1
+
+    def stats(self) -> Dict:
+        kdf, params = self.current_params()
+        with self._lock:
+            counters = {'hashed': self.hashed, 'verified': self.verified,
+                        'rehashed': self.rehashed, 'rejected': self.rejected}
+        return {'kdf': kdf, 'params': params, 'workers': app.config['PASSWORD_HASH_WORKERS'],
+                **counters, 'latency': self.latency.snapshot()}
+
 def hash_password(password: str) -> str:
-    """Hash a password using SHA-256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash a password with a salted KDF"""
+    return password_hasher.hash(password)
 
 def verify_password(password: str, hashed: str) -> bool:
     """Verify a password against its hash"""
-    return hash_password(password) == hashed
+    return password_hasher.verify(password, hashed)
 
 def generate_token(user_id: str) -> str:
     """Generate JWT token for user"""
     payload = {
         'user_id': user_id,
+        'jti': uuid.uuid4().hex,
+        'iat': time.time(),
         'exp': datetime.utcnow() + app.config['JWT_EXPIRATION_DELTA']
     }
     return jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
@@ -112,20 +504,333 @@ def token_required(f):
         if not token:
             return jsonify({'error': 'Token is missing'}), 401
         
+        started = time.perf_counter()
+        # Logouts on other workers arrive with the revocation poll, at most once per AUTH_REVOCATION_REFRESH;
+        # between polls a cached token and profile cost no database access at all
+        for user_id in token_cache.refresh_revocations():
+            user_cache.invalidate(user_id)
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+            data = token_cache.decode(token)
             current_user_id = data['user_id']
         except jwt.ExpiredSignatureError:
             return jsonify({'error': 'Token has expired'}), 401
-        except jwt.InvalidTokenError:
+        except TokenRevokedError:
+            return jsonify({'error': 'Token has been revoked'}), 401
+        except (jwt.InvalidTokenError, KeyError):
             return jsonify({'error': 'Token is invalid'}), 401
         
+        # Tokens issued before a logout-everywhere are rejected via the cached profile
+        user = user_cache.get(current_user_id)
+        observe_span('auth', time.perf_counter() - started, 'tp_auth_check_seconds', buckets=FAST_BUCKETS)
+        if not user or data.get('iat', 0) < user['tokens_valid_after']:
+            return jsonify({'error': 'Token has been revoked'}), 401
+        
+        g.token_claims = data
         return f(current_user_id, *args, **kwargs)
     return decorated
 
+class TokenRevokedError(jwt.InvalidTokenError):
+    """Raised for a correctly signed token whose jti has been revoked"""
+
+class TokenCache:
+    """LRU of verified tokens, keyed by digest, so repeat requests skip signature checks until expiry"""
+    def __init__(self, max_entries: int, revocation_refresh: float):
+        self.max_entries = max_entries
+        self.revocation_refresh = revocation_refresh
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._revoked: Dict[str, float] = {}  # jti -> token expiry
+        self._revoked_seen = 0.0
+        self._next_refresh = 0.0
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'revoked_rejections': 0}
+
+    def _count(self, stat: str, n: int = 1):
+        with self._lock:
+            self._stats[stat] += n
+
+    def decode(self, token: str) -> Dict:
+        """Return the claims of a valid token, raising like jwt.decode otherwise"""
+        digest = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+        with self._lock:
+            claims = self._entries.get(digest)
+            if claims is not None:
+                if claims.get('exp', math.inf) > now:
+                    self._entries.move_to_end(digest)
+                    self._stats['hits'] += 1
+                else:
+                    del self._entries[digest]
+                    self._stats['expired'] += 1
+                    claims = None
+        if claims is None:
+            self._count('misses')
+            claims = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+            with self._lock:
+                self._entries[digest] = claims
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats['evictions'] += 1
+        if claims.get('jti') in self._revoked:
+            self._count('revoked_rejections')
+            raise TokenRevokedError('Token has been revoked')
+        return claims
+
+    def revoke(self, conn: sqlite3.Connection, claims: Dict):
+        """Persist a revocation so other workers pick it up, and apply it here immediately"""
+        now = time.time()
+        conn.execute('DELETE FROM revoked_tokens WHERE expires_at < ?', (now,))
+        conn.execute('''INSERT OR IGNORE INTO revoked_tokens (jti, user_id, expires_at, revoked_at)
+                       VALUES (?, ?, ?, ?)''',
+                    (claims['jti'], claims['user_id'], claims.get('exp', now), now))
+        with self._lock:
+            self._revoked[claims['jti']] = claims.get('exp', now)
+
+    def revoke_user(self, conn: sqlite3.Connection, user_id: str):
+        """Record a logout-everywhere so other workers drop their cached profile of this user.
+
+        The entry's jti matches no token; tokens_valid_after on the re-read profile does the rejecting.
+        """
+        now = time.time()
+        jti = f'user:{uuid.uuid4().hex}'
+        expires_at = now + app.config['JWT_EXPIRATION_DELTA'].total_seconds()
+        conn.execute('''INSERT INTO revoked_tokens (jti, user_id, expires_at, revoked_at)
+                       VALUES (?, ?, ?, ?)''', (jti, user_id, expires_at, now))
+        with self._lock:
+            self._revoked[jti] = expires_at
+
+    def refresh_revocations(self) -> Set[str]:
+        """Pick up revocations made on other workers, at most once per revocation_refresh; returns their users"""
+        now = time.time()
+        with self._lock:
+            if now < self._next_refresh:
+                return set()
+            self._next_refresh = now + self.revocation_refresh
+            since = self._revoked_seen
+        try:
+            with db_connection(readonly=True) as conn:
+                # Overlap by a second so revocations committed out of order aren't missed
+                rows = conn.execute('''SELECT jti, user_id, expires_at, revoked_at FROM revoked_tokens
+                                       WHERE revoked_at > ?''', (since - 1,)).fetchall()
+        except sqlite3.Error as e:
+            print(f"Token revocation refresh error: {e}")
+            return set()
+        users = set()
+        with self._lock:
+            for row in rows:
+                if row['jti'] not in self._revoked:
+                    users.add(row['user_id'])
+                self._revoked[row['jti']] = row['expires_at']
+                self._revoked_seen = max(self._revoked_seen, row['revoked_at'])
+            for jti in [jti for jti, expires_at in self._revoked.items() if expires_at < now]:
+                del self._revoked[jti]
+        return users
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['revoked'] = len(self._revoked)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+class UserCache:
+    """Short-TTL cache of user profiles for the auth path; invalidated when a user changes"""
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (expires_at, profile)
+        self._invalidations = 0
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self._stats['hits'] += 1
+                return entry[1]
+            self._stats['misses'] += 1
+            invalidations = self._invalidations
+        with db_connection(readonly=True) as conn:
+            row = conn.execute('SELECT id, email, name, tokens_valid_after FROM users WHERE id = ?',
+                               (user_id,)).fetchone()
+        if not row:
+            return None
+        profile = dict(row)
+        with self._lock:
+            # An invalidation while we were reading may postdate this row; don't cache it
+            if invalidations != self._invalidations:
+                return profile
+            self._entries[user_id] = (now + self.ttl, profile)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return profile
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._invalidations += 1
+            self._stats['invalidations'] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        return stats
+
 # Database Functions
+DB_PRAGMAS = {
+    'synchronous': 'NORMAL',      # safe with WAL, avoids an fsync per commit
+    'cache_size': -16000,         # 16 MB page cache per connection
+    'mmap_size': 268435456,       # 256 MB memory-mapped I/O
+    'busy_timeout': 5000,         # wait up to 5s on locks instead of failing
+    'temp_store': 'MEMORY',
+}
+
+class PooledConnection:
+    """Wraps a pooled sqlite3 connection; close() hands it back to the pool"""
+    def __init__(self, pool, conn: sqlite3.Connection):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a released connection')
+        return getattr(self._conn, name)
+
+    @property
+    def closed(self) -> bool:
+        return self._conn is None
+
+    def execute(self, sql: str, parameters=()):
+        execute = self.__getattr__('execute')
+        started = time.perf_counter()
+        try:
+            return execute(sql, parameters)
+        finally:
+            observe_db_query(sql, self._pool.readonly, time.perf_counter() - started)
+
+    def executemany(self, sql: str, seq_of_parameters):
+        executemany = self.__getattr__('executemany')
+        started = time.perf_counter()
+        try:
+            return executemany(sql, seq_of_parameters)
+        finally:
+            observe_db_query(sql, self._pool.readonly, time.perf_counter() - started)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+class ConnectionPool:
+    """Thread-safe pool of SQLite connections with hit/miss/wait metrics"""
+    def __init__(self, database: str, size: int, timeout: float, readonly: bool = False):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.readonly = readonly
+        self._idle: List[sqlite3.Connection] = []  # most recently returned last
+        self._cond = threading.Condition()
+        self._opened = 0
+        self._stats = {'hits': 0, 'misses': 0, 'waits': 0, 'timeouts': 0, 'wait_time': 0.0}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.database, timeout=DB_PRAGMAS['busy_timeout'] / 1000,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma, value in DB_PRAGMAS.items():
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        if self.readonly:
+            conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    def acquire(self) -> PooledConnection:
+        started = None
+        with self._cond:
+            while not self._idle and self._opened >= self.size:
+                # Woken by release(), which either returns a connection or frees a slot
+                if started is None:
+                    started = time.perf_counter()
+                    self._stats['waits'] += 1
+                remaining = started + self.timeout - time.perf_counter()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    self._stats['wait_time'] += time.perf_counter() - started
+                    raise sqlite3.OperationalError('Timed out waiting for a database connection')
+                self._cond.wait(remaining)
+            if started is not None:
+                self._stats['wait_time'] += time.perf_counter() - started
+            if self._idle:
+                if started is None:
+                    self._stats['hits'] += 1
+                return PooledConnection(self, self._idle.pop())
+            self._opened += 1
+            self._stats['misses'] += 1
+
+        try:
+            return PooledConnection(self, self._connect())
+        except Exception:
+            self._discard()
+            raise
+
+    def _discard(self):
+        """Give up a slot whose connection is gone, letting a waiter open a replacement"""
+        with self._cond:
+            self._opened -= 1
+            self._cond.notify()
+
+    def release(self, conn: sqlite3.Connection):
+        try:
+            # Never hand uncommitted work to the next borrower
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            self._discard()
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats['wait_time'] = round(stats['wait_time'], 6)
+            stats['open'] = self._opened
+            stats['idle'] = len(self._idle)
+        stats['in_use'] = stats['open'] - stats['idle']
+        stats['size'] = self.size
+        return stats
+
+    def close_all(self):
+        with self._cond:
+            while self._idle:
+                self._idle.pop().close()
+                self._opened -= 1
+
+db_pools: Dict[str, ConnectionPool] = {}
+_db_pools_lock = threading.Lock()
+
+def configure_db_pools():
+    """Create the read/write connection pools (idempotent)"""
+    with _db_pools_lock:
+        if db_pools:
+            return
+        database = app.config['DATABASE']
+        size = app.config['DB_POOL_SIZE']
+        timeout = app.config['DB_POOL_TIMEOUT']
+        db_pools['write'] = ConnectionPool(database, size, timeout)
+        db_pools['read'] = ConnectionPool(database, size, timeout, readonly=True)
+
 def init_db():
-    conn = sqlite3.connect('travel_planner.db')
+    conn = sqlite3.connect(app.config['DATABASE'])
+    # WAL is persistent in the database file, so it only needs setting once
+    conn.execute('PRAGMA journal_mode = WAL')
     cursor = conn.cursor()
     
     # Users table
@@ -182,19 +887,1201 @@ def init_db():
     )''')
     
     conn.commit()
+
+    apply_migrations(conn)
+    for query in check_query_plans(conn):
+        print(f"Query plan warning: full table scan in {query}")
     conn.close()
 
-def get_db_connection():
-    conn = sqlite3.connect('travel_planner.db')
-    conn.row_factory = sqlite3.Row
+    configure_db_pools()
+
+# Itinerary Storage
+# Days and activities are the source of truth; travel_plans.itinerary is a
+# materialized JSON copy rebuilt whenever they change.
+ITINERARY_ACTIVITY_KEYS = {'id', 'name', 'description', 'time', 'time_slot', 'duration',
+                           'cost', 'category', 'location', 'day', 'position', 'plan_id'}
+
+def _to_float(value, default: float = 0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def _to_int(value, default: int) -> int:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+def activity_row_values(activity_id: str, plan_id: str, day: int, position: int, activity: Dict) -> Tuple:
+    """Column values for an itinerary activity dict; unknown keys are kept in extra"""
+    extra = {k: v for k, v in activity.items() if k not in ITINERARY_ACTIVITY_KEYS}
+    return (activity_id, plan_id, str(activity.get('name') or 'Activity'), activity.get('description', ''),
+            json_dumps(activity.get('location') or {}), _to_float(activity.get('cost')),
+            _to_int(activity.get('duration'), 1), activity.get('category') or 'other', day,
+            activity.get('time') or activity.get('time_slot') or '09:00', position,
+            json_dumps(extra) if extra else None)
+
+def insert_itinerary_days(conn, plan_id: str, days: List[Dict], reusable_ids: set = None,
+                          skip: set = None):
+    """Insert itinerary days and their activities; existing ids of this plan are kept stable"""
+    reusable_ids = set(reusable_ids or ())
+    day_rows, activity_rows = [], []
+    for index, day in enumerate(days):
+        if not isinstance(day, dict):
+            continue
+        number = _to_int(day.get('day'), index + 1)
+        extra = {k: v for k, v in day.items() if k not in ('day', 'activities')}
+        day_rows.append((plan_id, number, json_dumps(extra) if extra else None))
+        for position, activity in enumerate(day.get('activities') or []):
+            if not isinstance(activity, dict):
+                continue
+            if skip and (number, str(activity.get('name', '')).casefold()) in skip:
+                continue
+            activity_id = activity.get('id')
+            if activity_id in reusable_ids:
+                reusable_ids.discard(activity_id)
+            else:
+                activity_id = str(uuid.uuid4())
+            activity_rows.append(activity_row_values(activity_id, plan_id, number, position, activity))
+    conn.executemany('INSERT OR REPLACE INTO itinerary_days (plan_id, day, extra) VALUES (?, ?, ?)', day_rows)
+    conn.executemany('''INSERT INTO activities
+                       (id, plan_id, name, description, location, cost, duration, category, day,
+                        time_slot, position, extra)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', activity_rows)
+
+def store_itinerary(conn, plan_id: str, itinerary: Dict) -> Dict:
+    """Replace a plan's days and activities with the given itinerary and rematerialize it"""
+    if not isinstance(itinerary, dict):
+        itinerary = {}
+    days = itinerary.get('days') if isinstance(itinerary.get('days'), list) else []
+    meta = {k: v for k, v in itinerary.items() if k != 'days'}
+    existing_ids = {row[0] for row in conn.execute('SELECT id FROM activities WHERE plan_id = ?', (plan_id,))}
+    conn.execute('DELETE FROM activities WHERE plan_id = ?', (plan_id,))
+    conn.execute('DELETE FROM itinerary_days WHERE plan_id = ?', (plan_id,))
+    insert_itinerary_days(conn, plan_id, days, reusable_ids=existing_ids)
+    conn.execute('UPDATE travel_plans SET itinerary_meta = ? WHERE id = ?',
+                 (json_dumps(meta) if meta else None, plan_id))
+    return materialize_itinerary(conn, plan_id)
+
+def activity_to_itinerary_dict(row) -> Dict:
+    activity = {
+        'id': row['id'],
+        'name': row['name'],
+        'description': row['description'],
+        'time': row['time_slot'],
+        'duration': row['duration'],
+        'cost': row['cost'],
+        'category': row['category'],
+        'location': json_loads(row['location']) if row['location'] else {}
+    }
+    if row['extra']:
+        activity.update(json_loads(row['extra']))
+    return activity
+
+def materialize_itinerary(conn, plan_id: str, touch: bool = True) -> Dict:
+    """Rebuild travel_plans.itinerary from days/activities; touch bumps version and updated_at"""
+    plan = conn.execute('SELECT itinerary_meta FROM travel_plans WHERE id = ?', (plan_id,)).fetchone()
+    meta = json_loads(plan['itinerary_meta']) if plan and plan['itinerary_meta'] else {}
+    days = {}
+    for row in conn.execute('SELECT day, extra FROM itinerary_days WHERE plan_id = ? ORDER BY day', (plan_id,)):
+        days[row['day']] = dict(json_loads(row['extra']) if row['extra'] else {}, day=row['day'], activities=[])
+    for row in conn.execute('''SELECT * FROM activities WHERE plan_id = ?
+                              ORDER BY day, position, time_slot''', (plan_id,)):
+        day = days.setdefault(row['day'], {'day': row['day'], 'activities': []})
+        day['activities'].append(activity_to_itinerary_dict(row))
+
+    itinerary = {}
+    if days or meta:
+        itinerary = {'days': [days[n] for n in sorted(days)]}
+        itinerary.update(meta)
+    if touch:
+        conn.execute('''UPDATE travel_plans SET itinerary = ?, version = version + 1, updated_at = ?
+                       WHERE id = ?''', (json_dumps(itinerary), datetime.now().isoformat(), plan_id))
+    else:
+        conn.execute('UPDATE travel_plans SET itinerary = ? WHERE id = ?', (json_dumps(itinerary), plan_id))
+    return itinerary
+
+def _normalize_existing_itineraries(conn):
+    """Migration step: explode stored itinerary blobs into days and activities"""
+    plans = conn.execute("SELECT id, itinerary FROM travel_plans WHERE itinerary IS NOT NULL").fetchall()
+    for plan_id, blob in plans:
+        try:
+            itinerary = json_loads(blob)
+        except ValueError:
+            continue
+        if not isinstance(itinerary, dict):
+            continue
+        # Activities already saved through the API win over their copies in the blob
+        existing = {(row[0], str(row[1]).casefold()) for row in
+                    conn.execute('SELECT day, name FROM activities WHERE plan_id = ?', (plan_id,))}
+        days = itinerary.get('days') if isinstance(itinerary.get('days'), list) else []
+        insert_itinerary_days(conn, plan_id, days, skip=existing)
+        meta = {k: v for k, v in itinerary.items() if k != 'days'}
+        conn.execute('UPDATE travel_plans SET itinerary_meta = ? WHERE id = ?',
+                     (json_dumps(meta) if meta else None, plan_id))
+        conn.row_factory = sqlite3.Row
+        try:
+            materialize_itinerary(conn, plan_id, touch=False)
+        finally:
+            conn.row_factory = None
+
+def _repair_unreadable_itineraries(conn):
+    """Migration step: rebuild stored itineraries that are not a JSON object from the plan's rows.
+
+    Responses splice travel_plans.itinerary in unparsed, so this is the one place the text is checked.
+    """
+    plans = conn.execute('SELECT id, itinerary FROM travel_plans WHERE itinerary IS NOT NULL').fetchall()
+    for plan_id, blob in plans:
+        try:
+            if isinstance(json_loads(blob), dict):
+                continue
+        except (TypeError, ValueError):
+            pass
+        print(f"Rebuilding unreadable itinerary of plan {plan_id}")
+        conn.row_factory = sqlite3.Row
+        try:
+            materialize_itinerary(conn, plan_id, touch=False)
+        finally:
+            conn.row_factory = None
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version
+MIGRATIONS = [
+    # 1: secondary indexes for the per-user and per-plan access paths
+    [
+        '''CREATE INDEX IF NOT EXISTS idx_travel_plans_user_created
+           ON travel_plans (user_id, created_at DESC)''',
+        '''CREATE INDEX IF NOT EXISTS idx_activities_plan_day
+           ON activities (plan_id, day, time_slot)''',
+        '''CREATE INDEX IF NOT EXISTS idx_expenses_plan_date
+           ON expenses (plan_id, date DESC)''',
+    ],
+    # 2: persistent cache of generated itineraries
+    [
+        '''CREATE TABLE IF NOT EXISTS itinerary_cache (
+            cache_key TEXT PRIMARY KEY,
+            params TEXT NOT NULL,
+            itinerary TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_accessed REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )''',
+        '''CREATE INDEX IF NOT EXISTS idx_itinerary_cache_last_accessed
+           ON itinerary_cache (last_accessed)''',
+    ],
+    # 3: background itinerary generation jobs
+    [
+        '''CREATE TABLE IF NOT EXISTS itinerary_jobs (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            plan_id TEXT,
+            status TEXT NOT NULL,
+            params TEXT NOT NULL,
+            result TEXT,
+            cache_status TEXT,
+            error TEXT,
+            days_ready INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''',
+        '''CREATE INDEX IF NOT EXISTS idx_itinerary_jobs_status
+           ON itinerary_jobs (status, updated_at)''',
+        '''CREATE TABLE IF NOT EXISTS itinerary_job_days (
+            job_id TEXT NOT NULL,
+            day_index INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            PRIMARY KEY (job_id, day_index),
+            FOREIGN KEY (job_id) REFERENCES itinerary_jobs (id)
+        )''',
+    ],
+    # 4: persistent cache for OpenRouteService responses
+    [
+        '''CREATE TABLE IF NOT EXISTS upstream_cache (
+            namespace TEXT NOT NULL,
+            cache_key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            fresh_until REAL NOT NULL,
+            stale_until REAL NOT NULL,
+            last_accessed REAL NOT NULL,
+            PRIMARY KEY (namespace, cache_key)
+        )''',
+        '''CREATE INDEX IF NOT EXISTS idx_upstream_cache_namespace_accessed
+           ON upstream_cache (namespace, last_accessed)''',
+    ],
+    # 5: normalized itinerary days/activities with a versioned, materialized JSON copy
+    [
+        'ALTER TABLE travel_plans ADD COLUMN version INTEGER NOT NULL DEFAULT 1',
+        'ALTER TABLE travel_plans ADD COLUMN itinerary_meta TEXT',
+        'ALTER TABLE activities ADD COLUMN position INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE activities ADD COLUMN extra TEXT',
+        '''CREATE TABLE IF NOT EXISTS itinerary_days (
+            plan_id TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            extra TEXT,
+            PRIMARY KEY (plan_id, day),
+            FOREIGN KEY (plan_id) REFERENCES travel_plans (id)
+        )''',
+        'DROP INDEX IF EXISTS idx_activities_plan_day',
+        '''CREATE INDEX IF NOT EXISTS idx_activities_plan_day_position
+           ON activities (plan_id, day, position, time_slot)''',
+        _normalize_existing_itineraries,
+    ],
+    # 6: (created_at, id) keyset pagination of a user's plans
+    [
+        'DROP INDEX IF EXISTS idx_travel_plans_user_created',
+        '''CREATE INDEX IF NOT EXISTS idx_travel_plans_user_created_id
+           ON travel_plans (user_id, created_at DESC, id DESC)''',
+    ],
+    # 7: change counters for conditional GETs, maintained by triggers
+    [
+        'ALTER TABLE users ADD COLUMN plans_version INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE users ADD COLUMN plans_updated_at TEXT',
+        'ALTER TABLE travel_plans ADD COLUMN expenses_version INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE travel_plans ADD COLUMN expenses_updated_at TEXT',
+        '''CREATE TRIGGER IF NOT EXISTS trg_travel_plans_insert AFTER INSERT ON travel_plans
+           BEGIN
+               UPDATE users SET plans_version = plans_version + 1, plans_updated_at = NEW.updated_at
+               WHERE id = NEW.user_id;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_travel_plans_update AFTER UPDATE ON travel_plans
+           WHEN NEW.expenses_version = OLD.expenses_version
+           BEGIN
+               UPDATE users SET plans_version = plans_version + 1, plans_updated_at = NEW.updated_at
+               WHERE id = NEW.user_id;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_travel_plans_delete AFTER DELETE ON travel_plans
+           BEGIN
+               UPDATE users SET plans_version = plans_version + 1,
+                   plans_updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')
+               WHERE id = OLD.user_id;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_expenses_insert AFTER INSERT ON expenses
+           BEGIN
+               UPDATE travel_plans SET expenses_version = expenses_version + 1,
+                   expenses_updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')
+               WHERE id = NEW.plan_id;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_expenses_update AFTER UPDATE ON expenses
+           BEGIN
+               UPDATE travel_plans SET expenses_version = expenses_version + 1,
+                   expenses_updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')
+               WHERE id IN (OLD.plan_id, NEW.plan_id);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_expenses_delete AFTER DELETE ON expenses
+           BEGIN
+               UPDATE travel_plans SET expenses_version = expenses_version + 1,
+                   expenses_updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')
+               WHERE id = OLD.plan_id;
+           END''',
+    ],
+    # 8: per-plan expense totals by category and date, maintained by triggers
+    [
+        '''CREATE TABLE IF NOT EXISTS expense_totals (
+            plan_id TEXT NOT NULL,
+            category TEXT NOT NULL,
+            date TEXT NOT NULL,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (plan_id, category, date)
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_expense_totals_plan_date ON expense_totals(plan_id, date)',
+        '''INSERT OR REPLACE INTO expense_totals (plan_id, category, date, total, count)
+           SELECT plan_id, category, date, SUM(amount), COUNT(*) FROM expenses
+           GROUP BY plan_id, category, date''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_expense_totals_insert AFTER INSERT ON expenses
+           BEGIN
+               INSERT INTO expense_totals (plan_id, category, date, total, count)
+               VALUES (NEW.plan_id, NEW.category, NEW.date, NEW.amount, 1)
+               ON CONFLICT (plan_id, category, date)
+               DO UPDATE SET total = total + excluded.total, count = count + 1;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_expense_totals_update
+           AFTER UPDATE OF plan_id, category, date, amount ON expenses
+           BEGIN
+               UPDATE expense_totals SET total = total - OLD.amount, count = count - 1
+               WHERE plan_id = OLD.plan_id AND category = OLD.category AND date = OLD.date;
+               DELETE FROM expense_totals
+               WHERE plan_id = OLD.plan_id AND category = OLD.category AND date = OLD.date AND count <= 0;
+               INSERT INTO expense_totals (plan_id, category, date, total, count)
+               VALUES (NEW.plan_id, NEW.category, NEW.date, NEW.amount, 1)
+               ON CONFLICT (plan_id, category, date)
+               DO UPDATE SET total = total + excluded.total, count = count + 1;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_expense_totals_delete AFTER DELETE ON expenses
+           BEGIN
+               UPDATE expense_totals SET total = total - OLD.amount, count = count - 1
+               WHERE plan_id = OLD.plan_id AND category = OLD.category AND date = OLD.date;
+               DELETE FROM expense_totals
+               WHERE plan_id = OLD.plan_id AND category = OLD.category AND date = OLD.date AND count <= 0;
+           END''',
+    ],
+    # 9: token revocation
+    [
+        '''CREATE TABLE IF NOT EXISTS revoked_tokens (
+            jti TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            revoked_at REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_revoked_tokens_revoked_at ON revoked_tokens(revoked_at)',
+        'CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires_at ON revoked_tokens(expires_at)',
+        'ALTER TABLE users ADD COLUMN tokens_valid_after REAL NOT NULL DEFAULT 0',
+    ],
+    # 10: shared rate limiter buckets
+    [
+        '''CREATE TABLE IF NOT EXISTS rate_limits (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_rate_limits_updated_at ON rate_limits(updated_at)',
+    ],
+    # 11: full-text search over plans, activities and expenses. search_refs gives each document a
+    # rowid that survives VACUUM; owner holds 'u' + the user id without dashes as a single token so
+    # queries are scoped to one user inside the index rather than filtered afterwards.
+    [
+        '''CREATE TABLE IF NOT EXISTS search_refs (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            ref_id TEXT NOT NULL,
+            UNIQUE (kind, ref_id)
+        )''',
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            owner, kind UNINDEXED, ref_id UNINDEXED, plan_id UNINDEXED, title, body, category,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )''',
+        "INSERT OR IGNORE INTO search_refs (kind, ref_id) SELECT 'plan', id FROM travel_plans",
+        "INSERT OR IGNORE INTO search_refs (kind, ref_id) SELECT 'activity', id FROM activities",
+        "INSERT OR IGNORE INTO search_refs (kind, ref_id) SELECT 'expense', id FROM expenses",
+        '''INSERT INTO search_index (rowid, owner, kind, ref_id, plan_id, title, body, category)
+           SELECT r.id, 'u' || replace(p.user_id, '-', ''), 'plan', p.id, p.id, p.destination, '', ''
+           FROM travel_plans p JOIN search_refs r ON r.kind = 'plan' AND r.ref_id = p.id''',
+        '''INSERT INTO search_index (rowid, owner, kind, ref_id, plan_id, title, body, category)
+           SELECT r.id, 'u' || replace(p.user_id, '-', ''), 'activity', a.id, a.plan_id, a.name,
+                  coalesce(a.description, ''), coalesce(a.category, '')
+           FROM activities a JOIN search_refs r ON r.kind = 'activity' AND r.ref_id = a.id
+           LEFT JOIN travel_plans p ON p.id = a.plan_id''',
+        '''INSERT INTO search_index (rowid, owner, kind, ref_id, plan_id, title, body, category)
+           SELECT r.id, 'u' || replace(p.user_id, '-', ''), 'expense', e.id, e.plan_id,
+                  coalesce(e.description, ''), '', e.category
+           FROM expenses e JOIN search_refs r ON r.kind = 'expense' AND r.ref_id = e.id
+           LEFT JOIN travel_plans p ON p.id = e.plan_id''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_search_plans_insert AFTER INSERT ON travel_plans
+           BEGIN
+               INSERT INTO search_refs (kind, ref_id) VALUES ('plan', NEW.id);
+               INSERT INTO search_index (rowid, owner, kind, ref_id, plan_id, title, body, category)
+               VALUES (last_insert_rowid(), 'u' || replace(NEW.user_id, '-', ''), 'plan', NEW.id, NEW.id,
+                       NEW.destination, '', '');
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_search_plans_update AFTER UPDATE OF destination ON travel_plans
+           BEGIN
+               UPDATE search_index SET title = NEW.destination
+               WHERE rowid = (SELECT id FROM search_refs WHERE kind = 'plan' AND ref_id = NEW.id);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_search_plans_delete AFTER DELETE ON travel_plans
+           BEGIN
+               DELETE FROM search_index
+               WHERE rowid = (SELECT id FROM search_refs WHERE kind = 'plan' AND ref_id = OLD.id);
+               DELETE FROM search_refs WHERE kind = 'plan' AND ref_id = OLD.id;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_search_activities_insert AFTER INSERT ON activities
+           BEGIN
+               INSERT INTO search_refs (kind, ref_id) VALUES ('activity', NEW.id);
+               INSERT INTO search_index (rowid, owner, kind, ref_id, plan_id, title, body, category)
+               VALUES (last_insert_rowid(),
+                       (SELECT 'u' || replace(user_id, '-', '') FROM travel_plans WHERE id = NEW.plan_id),
+                       'activity', NEW.id, NEW.plan_id, NEW.name, coalesce(NEW.description, ''),
+                       coalesce(NEW.category, ''));
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_search_activities_update
+           AFTER UPDATE OF name, description, category, plan_id ON activities
+           BEGIN
+               UPDATE search_index SET title = NEW.name, body = coalesce(NEW.description, ''),
+                      category = coalesce(NEW.category, ''), plan_id = NEW.plan_id,
+                      owner = (SELECT 'u' || replace(user_id, '-', '') FROM travel_plans WHERE id = NEW.plan_id)
+               WHERE rowid = (SELECT id FROM search_refs WHERE kind = 'activity' AND ref_id = OLD.id);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_search_activities_delete AFTER DELETE ON activities
+           BEGIN
+               DELETE FROM search_index
+               WHERE rowid = (SELECT id FROM search_refs WHERE kind = 'activity' AND ref_id = OLD.id);
+               DELETE FROM search_refs WHERE kind = 'activity' AND ref_id = OLD.id;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_search_expenses_insert AFTER INSERT ON expenses
+           BEGIN
+               INSERT INTO search_refs (kind, ref_id) VALUES ('expense', NEW.id);
+               INSERT INTO search_index (rowid, owner, kind, ref_id, plan_id, title, body, category)
+               VALUES (last_insert_rowid(),
+                       (SELECT 'u' || replace(user_id, '-', '') FROM travel_plans WHERE id = NEW.plan_id),
+                       'expense', NEW.id, NEW.plan_id, coalesce(NEW.description, ''), '', NEW.category);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_search_expenses_update
+           AFTER UPDATE OF description, category, plan_id ON expenses
+           BEGIN
+               UPDATE search_index SET title = coalesce(NEW.description, ''), category = NEW.category,
+                      plan_id = NEW.plan_id,
+                      owner = (SELECT 'u' || replace(user_id, '-', '') FROM travel_plans WHERE id = NEW.plan_id)
+               WHERE rowid = (SELECT id FROM search_refs WHERE kind = 'expense' AND ref_id = OLD.id);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_search_expenses_delete AFTER DELETE ON expenses
+           BEGIN
+               DELETE FROM search_index
+               WHERE rowid = (SELECT id FROM search_refs WHERE kind = 'expense' AND ref_id = OLD.id);
+               DELETE FROM search_refs WHERE kind = 'expense' AND ref_id = OLD.id;
+            END''',
+    ],
+    # 12: spatial index over activity locations. lat/lng are derived from the location JSON, so every
+    # write path keeps them current. The R*Tree's first dimension is the owner's spatial_key, which
+    # prunes each lookup to one user's points. activity_points gives R*Tree ids that survive VACUUM.
+    [
+        '''ALTER TABLE activities ADD COLUMN lat REAL GENERATED ALWAYS AS (
+            CASE WHEN json_valid(location) THEN
+                CASE WHEN json_type(location, '$.lat') IN ('integer', 'real')
+                          AND json_extract(location, '$.lat') BETWEEN -90 AND 90
+                     THEN json_extract(location, '$.lat') END
+            END) VIRTUAL''',
+        '''ALTER TABLE activities ADD COLUMN lng REAL GENERATED ALWAYS AS (
+            CASE WHEN json_valid(location) THEN
+                CASE WHEN json_type(location, '$.lng') IN ('integer', 'real')
+                          AND json_extract(location, '$.lng') BETWEEN -180 AND 180
+                     THEN json_extract(location, '$.lng') END
+            END) VIRTUAL''',
+        'ALTER TABLE users ADD COLUMN spatial_key INTEGER',
+        'UPDATE users SET spatial_key = rowid',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_users_spatial_key ON users(spatial_key)',
+        '''CREATE TRIGGER IF NOT EXISTS trg_users_spatial_key AFTER INSERT ON users
+           WHEN NEW.spatial_key IS NULL
+           BEGIN
+               UPDATE users SET spatial_key = (SELECT coalesce(max(spatial_key), 0) + 1 FROM users)
+               WHERE id = NEW.id;
+           END''',
+        '''CREATE TABLE IF NOT EXISTS activity_points (
+            id INTEGER PRIMARY KEY,
+            activity_id TEXT NOT NULL UNIQUE
+        )''',
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS activity_rtree USING rtree(
+            id, min_owner, max_owner, min_lat, max_lat, min_lng, max_lng
+        )''',
+        '''INSERT OR IGNORE INTO activity_points (activity_id)
+           SELECT id FROM activities WHERE lat IS NOT NULL AND lng IS NOT NULL''',
+        '''INSERT INTO activity_rtree (id, min_owner, max_owner, min_lat, max_lat, min_lng, max_lng)
+           SELECT ap.id, coalesce(u.spatial_key, 0), coalesce(u.spatial_key, 0), a.lat, a.lat, a.lng, a.lng
+           FROM activity_points ap JOIN activities a ON a.id = ap.activity_id
+           LEFT JOIN travel_plans p ON p.id = a.plan_id
+           LEFT JOIN users u ON u.id = p.user_id''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_activity_points_insert AFTER INSERT ON activities
+           WHEN NEW.lat IS NOT NULL AND NEW.lng IS NOT NULL
+           BEGIN
+               INSERT INTO activity_points (activity_id) VALUES (NEW.id);
+               INSERT INTO activity_rtree (id, min_owner, max_owner, min_lat, max_lat, min_lng, max_lng)
+               SELECT last_insert_rowid(), k, k, NEW.lat, NEW.lat, NEW.lng, NEW.lng
+               FROM (SELECT coalesce(max(u.spatial_key), 0) AS k FROM travel_plans p JOIN users u ON u.id = p.user_id
+                     WHERE p.id = NEW.plan_id);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_activity_points_update AFTER UPDATE OF location, plan_id ON activities
+           BEGIN
+               DELETE FROM activity_rtree WHERE id = (SELECT id FROM activity_points WHERE activity_id = OLD.id);
+               DELETE FROM activity_points WHERE activity_id = OLD.id;
+               INSERT INTO activity_points (activity_id)
+               SELECT NEW.id WHERE NEW.lat IS NOT NULL AND NEW.lng IS NOT NULL;
+               INSERT INTO activity_rtree (id, min_owner, max_owner, min_lat, max_lat, min_lng, max_lng)
+               SELECT last_insert_rowid(), k, k, NEW.lat, NEW.lat, NEW.lng, NEW.lng
+               FROM (SELECT coalesce(max(u.spatial_key), 0) AS k FROM travel_plans p JOIN users u ON u.id = p.user_id
+                     WHERE p.id = NEW.plan_id)
+               WHERE NEW.lat IS NOT NULL AND NEW.lng IS NOT NULL;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_activity_points_delete AFTER DELETE ON activities
+           BEGIN
+               DELETE FROM activity_rtree WHERE id = (SELECT id FROM activity_points WHERE activity_id = OLD.id);
+               DELETE FROM activity_points WHERE activity_id = OLD.id;
+           END''',
+    ],
+    # 13: itinerary cache expiry and the startup requeue of queued jobs
+    [
+        'CREATE INDEX IF NOT EXISTS idx_itinerary_cache_created_at ON itinerary_cache(created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_itinerary_jobs_status_created ON itinerary_jobs(status, created_at)',
+    ],
+    # 14: upstream cache expiry sweeps
+    [
+        'CREATE INDEX IF NOT EXISTS idx_upstream_cache_namespace_stale ON upstream_cache(namespace, stale_until)',
+    ],
+    # 15: one-row counter bumped by every logout; no longer read, logouts reach other workers via revoked_tokens
+    [
+        '''CREATE TABLE IF NOT EXISTS auth_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            value INTEGER NOT NULL
+        )''',
+        'INSERT OR IGNORE INTO auth_generation (id, value) VALUES (1, 0)',
+    ],
+    # 16: legacy itinerary text that never parsed was left in place by migration 5
+    [
+        _repair_unreadable_itineraries,
+    ],
+]
+
+def apply_migrations(conn: sqlite3.Connection):
+    """Bring the schema up to the latest migration version"""
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    for version, statements in enumerate(MIGRATIONS, start=1):
+        if version <= current:
+            continue
+        try:
+            conn.execute('BEGIN')
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+# Activities inside a box for one owner. CROSS JOIN keeps the R*Tree as the driving table,
+# and the lat/lng range re-checks the R*Tree's rounded 32-bit coordinates exactly.
+SPATIAL_QUERY = '''SELECT a.*, p.destination FROM activity_rtree r
+    CROSS JOIN activity_points ap ON ap.id = r.id
+    CROSS JOIN activities a ON a.id = ap.activity_id
+    CROSS JOIN travel_plans p ON p.id = a.plan_id
+    WHERE r.min_owner <= ? AND r.max_owner >= ? AND r.max_lat >= ? AND r.min_lat <= ?
+      AND r.max_lng >= ? AND r.min_lng <= ? AND p.user_id = ?
+      AND a.lat BETWEEN ? AND ? AND a.lng BETWEEN ? AND ?'''
+
+# Queries on the request path that must be served by an index, checked at startup. Statements built
+# at runtime are listed by shape; tests/test_query_plans.py also checks every literal statement in this file.
+HOT_QUERIES = [
+    'SELECT * FROM users WHERE email = ?',
+    'SELECT * FROM users WHERE id = ?',
+    'SELECT * FROM travel_plans WHERE user_id = ? ORDER BY created_at DESC, id DESC',
+    '''SELECT id, created_at FROM travel_plans WHERE user_id = ?
+       AND (created_at < ? OR (created_at = ? AND id < ?))
+       ORDER BY created_at DESC, id DESC LIMIT ?''',
+    'SELECT * FROM travel_plans WHERE id = ? AND user_id = ?',
+    'SELECT id FROM travel_plans WHERE id = ? AND user_id = ?',
+    'DELETE FROM travel_plans WHERE id = ? AND user_id = ?',
+    'DELETE FROM activities WHERE plan_id = ?',
+    'SELECT day, MAX(position) FROM activities WHERE plan_id = ? GROUP BY day',
+    'DELETE FROM itinerary_days WHERE plan_id = ?',
+    'DELETE FROM expenses WHERE plan_id = ?',
+    'SELECT day, extra FROM itinerary_days WHERE plan_id = ? ORDER BY day',
+    'SELECT * FROM activities WHERE plan_id = ? ORDER BY day, position, time_slot',
+    'SELECT * FROM expenses WHERE plan_id = ? ORDER BY date DESC',
+    'SELECT category, SUM(total), SUM(count) FROM expense_totals WHERE plan_id = ? GROUP BY category',
+    'SELECT date, SUM(total), SUM(count) FROM expense_totals WHERE plan_id = ? GROUP BY date ORDER BY date',
+    'SELECT plans_version, plans_updated_at FROM users WHERE id = ?',
+    'SELECT id, email, name, tokens_valid_after FROM users WHERE id = ?',
+    'SELECT jti, user_id, expires_at, revoked_at FROM revoked_tokens WHERE revoked_at > ?',
+    'DELETE FROM revoked_tokens WHERE expires_at < ?',
+    'SELECT version, updated_at FROM travel_plans WHERE id = ? AND user_id = ?',
+    'SELECT expenses_version, expenses_updated_at FROM travel_plans WHERE id = ? AND user_id = ?',
+    'SELECT tokens, updated_at FROM rate_limits WHERE key = ?',
+    'DELETE FROM rate_limits WHERE updated_at < ?',
+    'SELECT spatial_key FROM users WHERE id = ?',
+    SPATIAL_QUERY,
+    'DELETE FROM itinerary_cache WHERE created_at < ?',
+    "SELECT id FROM itinerary_jobs WHERE status = 'queued' ORDER BY created_at",
+]
+
+def check_query_plans(conn: sqlite3.Connection, queries: List[str] = None) -> List[str]:
+    """Return the queries whose EXPLAIN QUERY PLAN falls back to a table scan"""
+    offenders = []
+    for query in queries or HOT_QUERIES:
+        params = [None] * query.count('?')
+        plan = conn.execute(f'EXPLAIN QUERY PLAN {query}', params).fetchall()
+        details = [row[-1] for row in plan]
+        # Virtual tables report constrained lookups as 'VIRTUAL TABLE INDEX n:<constraints>'
+        if any(d.startswith('SCAN ') and ' USING ' not in d and not re.search(r'VIRTUAL TABLE INDEX \d+:\S', d)
+               for d in details) \
+                or any('USE TEMP B-TREE' in d for d in details):
+            offenders.append(query)
+    return offenders
+
+def get_db_connection(readonly: bool = False) -> PooledConnection:
+    """Borrow a pooled connection for the current app context.
+
+    Read-only connections are served from a separate pool with query_only set.
+    Connections are returned to their pool on close() or at teardown.
+    """
+    if not db_pools:
+        configure_db_pools()
+    pool = db_pools['read' if readonly else 'write']
+    conn = pool.acquire()
+    if '_db_conns' not in g:
+        g._db_conns = []
+    g._db_conns.append(conn)
     return conn
 
+@app.teardown_appcontext
+def release_db_connections(exception=None):
+    for conn in g.pop('_db_conns', []):
+        conn.close()
+
+@contextmanager
+def db_connection(readonly: bool = False):
+    """Borrow a pooled connection outside of a request (services, background work)"""
+    if not db_pools:
+        configure_db_pools()
+    conn = db_pools['read' if readonly else 'write'].acquire()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+# Itinerary Cache
+class ItineraryCache:
+    """SQLite-backed TTL/LRU cache of generated itineraries keyed by normalized parameters"""
+    def __init__(self, ttl: float, max_entries: int, budget_band: float):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.budget_band = budget_band
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'expired': 0, 'evictions': 0}
+
+    def _count(self, stat: str, n: int = 1):
+        with self._lock:
+            self._stats[stat] += n
+
+    def normalize(self, destination: str, budget: float, duration: int, interests: List[str]) -> Dict:
+        """Canonical form of the request so near-identical requests share a key"""
+        band = 0
+        if budget > 0:
+            band = math.floor(math.log(budget) / math.log(1 + self.budget_band))
+        return {
+            'destination': ' '.join(destination.split()).casefold(),
+            'budget_band': band,
+            'duration': int(duration),
+            'interests': sorted({' '.join(str(i).split()).casefold() for i in interests}),
+        }
+
+    def make_key(self, params: Dict) -> str:
+        canonical = json.dumps(params, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with db_connection() as conn:
+            row = conn.execute('SELECT itinerary, created_at FROM itinerary_cache WHERE cache_key = ?',
+                               (key,)).fetchone()
+            if row and now - row['created_at'] > self.ttl:
+                conn.execute('DELETE FROM itinerary_cache WHERE cache_key = ?', (key,))
+                conn.commit()
+                self._count('expired')
+                row = None
+            if not row:
+                self._count('misses')
+                return None
+            conn.execute('UPDATE itinerary_cache SET last_accessed = ?, hits = hits + 1 WHERE cache_key = ?',
+                         (now, key))
+            conn.commit()
+        self._count('hits')
+        return json_loads(row['itinerary'])
+
+    def put(self, key: str, params: Dict, itinerary: Dict):
+        now = time.time()
+        with db_connection() as conn:
+            conn.execute('''INSERT OR REPLACE INTO itinerary_cache
+                           (cache_key, params, itinerary, created_at, last_accessed, hits)
+                           VALUES (?, ?, ?, ?, ?, 0)''',
+                        (key, json_dumps(params), json_dumps(itinerary), now, now))
+            # Drop expired entries, then the least recently used beyond capacity
+            conn.execute('DELETE FROM itinerary_cache WHERE created_at < ?', (now - self.ttl,))
+            evicted = conn.execute('''DELETE FROM itinerary_cache WHERE cache_key IN (
+                                        SELECT cache_key FROM itinerary_cache
+                                        ORDER BY last_accessed DESC LIMIT -1 OFFSET ?)''',
+                                   (self.max_entries,)).rowcount
+            conn.commit()
+        self._count('stores')
+        if evicted:
+            self._count('evictions', evicted)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+# Request Coalescing
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _InFlightCall] = {}
+        self._stats = {'executions': 0, 'coalesced': 0, 'timeouts': 0, 'errors': 0}
+
+    def do(self, key: str, fn, timeout: float = None) -> Tuple[object, bool]:
+        """Run fn() once per key; returns (result, shared) and re-raises the leader's error"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _InFlightCall()
+                self._stats['executions'] += 1
+            else:
+                self._stats['coalesced'] += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+                with self._lock:
+                    self._stats['errors'] += 1
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        elif not call.done.wait(timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise TimeoutError(f'Timed out waiting for in-flight call {key[:12]}')
+
+        if call.error is not None:
+            raise call.error
+        return (call.result if leader else copy.deepcopy(call.result)), not leader
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+# Streaming itinerary parsing
+def strip_code_fences(text: str) -> str:
+    text = text.strip()
+    if text.startswith('```json'):
+        text = text[7:]
+    elif text.startswith('```'):
+        text = text[3:]
+    if text.endswith('```'):
+        text = text[:-3]
+    return text.strip()
+
+class StreamingItineraryParser:
+    """Incrementally scans streamed model output and emits each days[i] object once it closes"""
+    def __init__(self):
+        self.buffer = ''
+        self.days: List[Dict] = []
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._last_key = None
+        self._days_depth = None
+        self._day_start = None
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """Consume a chunk of text; returns the day objects completed by it"""
+        self.buffer += chunk
+        completed = []
+        buf = self.buffer
+        for i in range(self._pos, len(buf)):
+            c = buf[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif c == '\\':
+                    self._escaped = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = buf[self._string_start + 1:i]
+                continue
+
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in '{[':
+                if c == '[' and self._depth == 1 and self._last_key == 'days':
+                    self._days_depth = 2
+                elif c == '{' and self._days_depth and self._depth == self._days_depth:
+                    self._day_start = i
+                self._depth += 1
+            elif c in '}]':
+                self._depth -= 1
+                if c == '}' and self._day_start is not None and self._depth == self._days_depth:
+                    try:
+                        day = json.loads(buf[self._day_start:i + 1])
+                        if isinstance(day, dict):
+                            self.days.append(day)
+                            completed.append(day)
+                    except ValueError:
+                        pass
+                    self._day_start = None
+                elif c == ']' and self._days_depth and self._depth == self._days_depth - 1:
+                    self._days_depth = None
+        self._pos = len(buf)
+        return completed
+
+    def result(self) -> Optional[Dict]:
+        """The full document if the output parsed cleanly, otherwise None"""
+        try:
+            itinerary = json.loads(strip_code_fences(self.buffer))
+        except ValueError:
+            return None
+        if not isinstance(itinerary, dict) or not isinstance(itinerary.get('days'), list):
+            return None
+        return itinerary
+
+class _SkeletonError(Exception):
+    """The fan-out skeleton could not be generated"""
+
 # AI Service
 class AIItineraryService:
-    def __init__(self):
+    def __init__(self, cache: Optional[ItineraryCache] = None, coalesce_timeout: float = None,
+                 fanout_min_days: int = None, fanout_workers: int = 4):
         self.model = model
+        self.cache = cache
+        self.coalesce_timeout = coalesce_timeout
+        self.in_flight = SingleFlight()
+        self.fanout_min_days = fanout_min_days
+        self._fanout_executor = ThreadPoolExecutor(max_workers=fanout_workers,
+                                                   thread_name_prefix='itinerary-day')
+
+    def close(self):
+        self._fanout_executor.shutdown(wait=False, cancel_futures=True)
     
     def generate_itinerary(self, destination: str, budget: float, duration: int, interests: List[str]) -> Dict:
+        itinerary, _ = self.generate_itinerary_with_status(destination, budget, duration, interests)
+        return itinerary
+
+    def generate_itinerary_with_status(self, destination: str, budget: float, duration: int,
+                                       interests: List[str],
+                                       on_day: Optional[Callable[[Dict], None]] = None) -> Tuple[Dict, str]:
+        """Generate an itinerary and report where it came from: HIT, MISS, PARTIAL, COALESCED or FALLBACK.
+
+        on_day, if given, is called with each day of the itinerary as it becomes available.
+        Days are streamed as the model produces them; cached and shared results emit all
+        days at the end.
+        """
+        emitted = 0
+
+        def emit(day: Dict):
+            nonlocal emitted
+            emitted += 1
+            on_day(day)
+
+        started = time.perf_counter()
+        itinerary, status = self._generate_with_status(destination, budget, duration, interests,
+                                                       on_day=emit if on_day else None)
+        metrics.observe('tp_itinerary_generation_seconds', time.perf_counter() - started, {'status': status})
+        if on_day and not emitted:
+            for day in itinerary.get('days', []):
+                on_day(day)
+        return itinerary, status
+
+    def _generate_with_status(self, destination: str, budget: float, duration: int,
+                              interests: List[str],
+                              on_day: Optional[Callable[[Dict], None]] = None) -> Tuple[Dict, str]:
+        if self.cache:
+            params = self.cache.normalize(destination, budget, duration, interests)
+            key = self.cache.make_key(params)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached, 'HIT'
+        else:
+            params = {'destination': destination, 'budget': budget,
+                      'duration': duration, 'interests': sorted(interests)}
+            key = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+        def generate():
+            itinerary, complete = self._generate_from_model(destination, budget, duration, interests, on_day)
+            # Itineraries patched with fallback days are not cached as real answers
+            if self.cache and complete:
+                try:
+                    self.cache.put(key, params, itinerary)
+                except sqlite3.Error as e:
+                    print(f"Itinerary cache error: {e}")
+            return itinerary, complete
+
+        try:
+            (itinerary, complete), shared = self.in_flight.do(key, generate, timeout=self.coalesce_timeout)
+        except Exception as e:
+            print(f"AI Generation Error: {e}")
+            # Fallback response; never cached so the next request retries the model
+            return self._generate_fallback_itinerary(destination, duration, budget), 'FALLBACK'
+        if shared:
+            return itinerary, 'COALESCED'
+        return itinerary, 'MISS' if complete else 'PARTIAL'
+
+    def _record_model_call(self, kind: str, started: float, outcome: str, response=None):
+        elapsed = time.perf_counter() - started
+        labels = {'upstream': 'gemini', 'operation': kind}
+        metrics.observe('tp_upstream_request_seconds', elapsed, labels)
+        metrics.inc('tp_upstream_requests_total', {**labels, 'outcome': outcome})
+        observe_span('upstream', elapsed)
+        usage = getattr(response, 'usage_metadata', None)
+        if usage:
+            metrics.inc('tp_gemini_tokens_total', {'operation': kind, 'type': 'prompt'},
+                        getattr(usage, 'prompt_token_count', 0) or 0)
+            metrics.inc('tp_gemini_tokens_total', {'operation': kind, 'type': 'output'},
+                        getattr(usage, 'candidates_token_count', 0) or 0)
+
+    def _call_model(self, kind: str, prompt: str):
+        started = time.perf_counter()
+        try:
+            response = self.model.generate_content(prompt)
+        except Exception:
+            self._record_model_call(kind, started, 'error')
+            raise
+        self._record_model_call(kind, started, 'ok', response)
+        return response
+
+    def _stream_model(self, kind: str, prompt: str):
+        """Yield response chunks; usage is taken from the last chunk, which carries the totals"""
+        started = time.perf_counter()
+        outcome, last = 'error', None
+        try:
+            for chunk in self.model.generate_content(prompt, stream=True):
+                last = chunk
+                yield chunk
+            outcome = 'ok'
+        finally:
+            self._record_model_call(kind, started, outcome, last)
+
+    def _stream_days(self, prompt: str, on_day: Optional[Callable[[Dict], None]],
+                     kind: str = 'itinerary') -> StreamingItineraryParser:
+        """Stream a prompt through the model, emitting days as they close"""
+        parser = StreamingItineraryParser()
+        try:
+            for chunk in self._stream_model(kind, prompt):
+                for day in parser.feed(chunk.text):
+                    if on_day:
+                        on_day(day)
+        except Exception as e:
+            # Keep whatever closed before the stream broke
+            if not parser.days:
+                raise
+            print(f"AI stream interrupted after {len(parser.days)} days: {e}")
+        return parser
+
+    def _generate_from_model(self, destination: str, budget: float, duration: int, interests: List[str],
+                             on_day: Optional[Callable[[Dict], None]] = None) -> Tuple[Dict, bool]:
+        """Returns (itinerary, complete); incomplete output is salvaged and the missing days requested"""
+        if self.fanout_min_days and duration >= self.fanout_min_days:
+            try:
+                return self._generate_fanout(destination, budget, duration, interests, on_day)
+            except _SkeletonError as e:
+                print(f"AI skeleton error, using single prompt: {e}")
+
+        parser = self._stream_days(self._build_prompt(destination, budget, duration, interests), on_day)
+        itinerary = parser.result()
+        if itinerary is not None:
+            return itinerary, True
+        if not parser.days:
+            raise ValueError('Model response contained no complete days')
+
+        days = {day.get('day'): day for day in parser.days}
+        missing = [n for n in range(1, duration + 1) if n not in days]
+        complete = True
+        if missing:
+            wanted = set(missing)
+
+            def take_missing(day: Dict):
+                # The follow-up may repeat days that were already streamed; only new ones are kept and emitted
+                if day.get('day') in wanted:
+                    wanted.discard(day['day'])
+                    days[day['day']] = day
+                    if on_day:
+                        on_day(day)
+
+            try:
+                self._stream_days(self._build_missing_days_prompt(destination, budget, duration, interests, missing),
+                                  take_missing, kind='missing_days')
+            except Exception as e:
+                print(f"AI follow-up error: {e}")
+            fallback_days = self._generate_fallback_itinerary(destination, duration, budget)['days']
+            for day in fallback_days:
+                if day['day'] not in days:
+                    complete = False
+                    days[day['day']] = day
+                    if on_day:
+                        on_day(day)
+
+        ordered = [days[n] for n in sorted(days, key=lambda n: n if isinstance(n, int) else duration + 1)]
+        total = sum(float(a.get('cost', 0) or 0) for day in ordered for a in day.get('activities', []))
+        return {
+            'days': ordered,
+            'total_estimated_cost': round(total, 2),
+            'budget_breakdown': {
+                'accommodation': budget * 0.4,
+                'food': budget * 0.3,
+                'activities': budget * 0.2,
+                'transportation': budget * 0.1
+            }
+        }, complete
+
+    def _generate_fanout(self, destination: str, budget: float, duration: int, interests: List[str],
+                         on_day: Optional[Callable[[Dict], None]] = None) -> Tuple[Dict, bool]:
+        """Plan a trip skeleton, then generate every day concurrently and merge"""
+        try:
+            response = self._call_model('skeleton',
+                                        self._build_skeleton_prompt(destination, budget, duration, interests))
+            skeleton = json.loads(strip_code_fences(response.text))
+            outline = {d['day']: d for d in skeleton['days'] if isinstance(d, dict) and 'day' in d}
+        except Exception as e:
+            raise _SkeletonError(e)
+
+        default_day_budget = budget * 0.2 / duration
+        futures = {}
+        for n in range(1, duration + 1):
+            plan = outline.get(n, {})
+            prompt = self._build_day_prompt(destination, duration, interests, n,
+                                            plan.get('area', destination), plan.get('theme', ''),
+                                            plan.get('activities_budget', default_day_budget))
+            futures[self._fanout_executor.submit(self._generate_day, prompt, n)] = n
+
+        days = {}
+        complete = True
+        fallback_days = None
+        # Days are emitted from this thread, in completion order
+        for future in as_completed(futures):
+            n = futures[future]
+            try:
+                day = future.result()
+            except Exception as e:
+                print(f"AI day {n} error: {e}")
+                if fallback_days is None:
+                    fallback_days = self._generate_fallback_itinerary(destination, duration, budget)['days']
+                day = fallback_days[n - 1]
+                complete = False
+            days[n] = day
+            if on_day:
+                on_day(day)
+
+        ordered = [days[n] for n in range(1, duration + 1)]
+        breakdown, total = self._reconcile_budget(ordered, skeleton.get('budget_breakdown'), budget)
+        return {
+            'days': ordered,
+            'total_estimated_cost': total,
+            'budget_breakdown': breakdown
+        }, complete
+
+    def _generate_day(self, prompt: str, day_number: int) -> Dict:
+        response = self._call_model('day', prompt)
+        data = json.loads(strip_code_fences(response.text))
+        day = data['days'][0] if isinstance(data.get('days'), list) else data
+        if not isinstance(day.get('activities'), list):
+            raise ValueError(f'Day {day_number} is missing its activities')
+        day['day'] = day_number
+        return day
+
+    def _reconcile_budget(self, days: List[Dict], breakdown: Optional[Dict], budget: float) -> Tuple[Dict, float]:
+        """Make the breakdown agree with the generated activity costs and fit the budget"""
+        activities_cost = round(sum(float(a.get('cost', 0) or 0)
+                                    for day in days for a in day.get('activities', [])), 2)
+        if not isinstance(breakdown, dict):
+            breakdown = {}
+        other = {}
+        for category, default_share in (('accommodation', 0.4), ('food', 0.3), ('transportation', 0.1)):
+            try:
+                other[category] = float(breakdown.get(category, budget * default_share))
+            except (TypeError, ValueError):
+                other[category] = budget * default_share
+        # Activities are concrete; shrink the estimated categories to fit what remains
+        remaining = max(budget - activities_cost, 0)
+        other_total = sum(other.values())
+        if other_total > remaining and other_total > 0:
+            scale = remaining / other_total
+            other = {category: amount * scale for category, amount in other.items()}
+        reconciled = {category: round(amount, 2) for category, amount in other.items()}
+        reconciled['activities'] = activities_cost
+        return reconciled, round(sum(reconciled.values()), 2)
+
+    def _build_skeleton_prompt(self, destination: str, budget: float, duration: int, interests: List[str]) -> str:
+        interests_str = ", ".join(interests)
+        return f"""
+        Outline a {duration}-day trip to {destination} with a total budget of ${budget}.
+        Interests: {interests_str}
+        
+        Return only a compact JSON response with the following structure:
+        {{
+            "days": [
+                {{"day": 1, "area": "Neighbourhood or area", "theme": "Short theme", "activities_budget": 60}}
+            ],
+            "budget_breakdown": {{
+                "accommodation": 600,
+                "food": 400,
+                "activities": 300,
+                "transportation": 200
+            }}
+        }}
+        
+        Include one entry per day and keep the breakdown within the budget.
+        """
+
+    def _build_day_prompt(self, destination: str, duration: int, interests: List[str], day_number: int,
+                          area: str, theme: str, day_budget: float) -> str:
+        interests_str = ", ".join(interests)
+        return f"""
+        Plan day {day_number} of a {duration}-day trip to {destination}.
+        Area: {area}
+        Theme: {theme}
+        Activities budget for the day: ${day_budget}
+        Interests: {interests_str}
+        
+        Return a JSON response with the following structure:
+        {{
+            "day": {day_number},
+            "activities": [
+                {{
+                    "name": "Activity Name",
+                    "description": "Activity Description",
+                    "time": "HH:MM",
+                    "duration": 2,
+                    "cost": 50,
+                    "category": "sightseeing/dining/entertainment/shopping/culture",
+                    "location": {{"lat": 0.0, "lng": 0.0}}
+                }}
+            ]
+        }}
+        
+        Include 3-4 activities with appropriate timing and costs.
+        """
+
+    def _build_missing_days_prompt(self, destination: str, budget: float, duration: int,
+                                   interests: List[str], missing: List[int]) -> str:
+        interests_str = ", ".join(interests)
+        missing_str = ", ".join(str(n) for n in missing)
+        return f"""
+        Continue a {duration}-day travel itinerary for:
+        Destination: {destination}
+        Budget: ${budget}
+        Interests: {interests_str}
+        
+        Only produce days {missing_str}. Return a JSON response with the following structure:
+        {{
+            "days": [
+                {{
+                    "day": {missing[0]},
+                    "activities": [
+                        {{
+                            "name": "Activity Name",
+                            "description": "Activity Description",
+                            "time": "HH:MM",
+                            "duration": 2,
+                            "cost": 50,
+                            "category": "sightseeing/dining/entertainment/shopping/culture",
+                            "location": {{"lat": 0.0, "lng": 0.0}}
+                        }}
+                    ]
+                }}
+            ]
+        }}
+        
+        Include 3-4 activities per day with appropriate timing and costs.
+        """
+
+    def _build_prompt(self, destination: str, budget: float, duration: int, interests: List[str]) -> str:
         interests_str = ", ".join(interests)
         prompt = f"""
         Create a detailed travel itinerary for:
@@ -233,24 +2120,11 @@ class AIItineraryService:
         Make sure activities are realistic for the destination and fit within the budget.
         Include 3-4 activities per day with appropriate timing and costs.
         """
-        
-        try:
-            response = self.model.generate_content(prompt)
-            # Parse the JSON response
-            response_text = response.text.strip()
-            if response_text.startswith('```json'):
-                response_text = response_text[7:-3]
-            elif response_text.startswith('```'):
-                response_text = response_text[3:-3]
-            
-            return json.loads(response_text)
-        except Exception as e:
-            print(f"AI Generation Error: {e}")
-            # Fallback response
-            return self._generate_fallback_itinerary(destination, duration, budget)
+        return prompt
     
     def _generate_fallback_itinerary(self, destination: str, duration: int, budget: float) -> Dict:
         """Generate a simple fallback itinerary if AI fails"""
+        metrics.inc('tp_itinerary_fallbacks_total')
         daily_budget = budget / duration
         activities_per_day = 3
         activity_cost = daily_budget * 0.6 / activities_per_day
@@ -299,17 +2173,553 @@ class AIItineraryService:
             }
         }
 
+# Upstream Resilience
+class LatencyHistogram:
+    """Cumulative latency histogram with fixed bucket bounds in seconds"""
+    BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets: Tuple[float, ...] = None):
+        self.buckets = buckets or self.BUCKETS
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, seconds: float):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                index = i
+                break
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += seconds
+            self._count += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative, running = {}, 0
+        for bound, n in zip(list(self.buckets) + ['+Inf'], counts):
+            running += n
+            cumulative[str(bound)] = running
+        return {'buckets': cumulative, 'sum': round(total, 6), 'count': count}
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream that is currently failing"""
+
+class CircuitBreaker:
+    """Opens after consecutive failures; lets one trial call through after reset_timeout"""
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._stats = {'opened': 0, 'rejected': 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._stats['opened'] += 1
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, state=self._state(), consecutive_failures=self._failures)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# Transport failures worth another attempt; other request errors (bad URL, redirect loops) fail at once
+RETRYABLE_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ContentDecodingError)
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given either as seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(retry_at.tzinfo)).total_seconds(), 0.0)
+
+# Metrics
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+class Metrics:
+    """Process-local counters and histograms, rendered in the Prometheus text format"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], LatencyHistogram] = {}
+        self._collectors: List[Callable] = []
+
+    @staticmethod
+    def _key(name: str, labels: Optional[Dict]) -> Tuple[str, Tuple]:
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name: str, labels: Dict = None, n: float = 1):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def histogram(self, name: str, labels: Dict = None, buckets: Tuple[float, ...] = None) -> LatencyHistogram:
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = LatencyHistogram(buckets)
+            return self._histograms[key]
+
+    def observe(self, name: str, seconds: float, labels: Dict = None, buckets: Tuple[float, ...] = None):
+        self.histogram(name, labels, buckets).observe(seconds)
+
+    def add_collector(self, collector: Callable):
+        """Register a callable yielding (name, labels, value) gauge samples at scrape time"""
+        self._collectors.append(collector)
+
+    @staticmethod
+    def _labels(labels, extra: Tuple = ()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        lines, typed = [], set()
+
+        def declare(name: str, kind: str):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in counters:
+            declare(name, 'counter')
+            lines.append(f'{name}{self._labels(labels)} {value}')
+        for (name, labels), histogram in histograms:
+            declare(name, 'histogram')
+            snapshot = histogram.snapshot()
+            for bound, count in snapshot['buckets'].items():
+                lines.append(f'{name}_bucket{self._labels(labels, (("le", bound),))} {count}')
+            lines.append(f'{name}_sum{self._labels(labels)} {snapshot["sum"]}')
+            lines.append(f'{name}_count{self._labels(labels)} {snapshot["count"]}')
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+                continue
+            for name, labels, value in samples:
+                declare(name, 'gauge')
+                lines.append(f'{name}{self._labels(sorted(labels.items()))} {value}')
+        return '\n'.join(lines) + '\n'
+
+def stats_samples(prefix: str, stats: Dict, labels: Dict = None):
+    """Flatten a component's stats() dict into gauge samples, skipping histograms exported elsewhere"""
+    for key, value in stats.items():
+        name = f'{prefix}_{key}'
+        if isinstance(value, bool):
+            yield name, labels or {}, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, labels or {}, value
+        elif isinstance(value, dict) and key != 'latency' and 'buckets' not in value:
+            yield from stats_samples(name, value, labels)
+
+metrics = Metrics()
+
+def observe_span(kind: str, seconds: float, name: str = None, labels: Dict = None,
+                 buckets: Tuple[float, ...] = None):
+    """Record a timing and attribute it to the current request's span breakdown"""
+    if name:
+        metrics.observe(name, seconds, labels, buckets)
+    if has_request_context():
+        spans = g.setdefault('_spans', {})
+        total, count = spans.get(kind, (0.0, 0))
+        spans[kind] = (total + seconds, count + 1)
+
+def observe_db_query(sql: str, readonly: bool, seconds: float):
+    statement = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else 'OTHER'
+    if statement not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+        statement = 'OTHER'
+    observe_span('db', seconds, 'tp_db_query_seconds',
+                 {'statement': statement, 'pool': 'read' if readonly else 'write'}, FAST_BUCKETS)
+
+@app.before_request
+def start_request_timer():
+    g._request_started = time.perf_counter()
+    rate = app.config['METRICS_PROFILE_SAMPLE_RATE']
+    if rate and app.config['METRICS_SLOW_REQUEST_SECONDS'] is not None and random.random() < rate:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this interpreter
+            return
+        g._profiler = profiler
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('_request_started', None)
+    profiler = g.pop('_profiler', None)
+    if profiler:
+        profiler.disable()
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.url_rule.rule if request.url_rule else '<unmatched>'
+    metrics.observe('tp_http_request_duration_seconds', elapsed, {'endpoint': endpoint, 'method': request.method})
+    metrics.inc('tp_http_requests_total', {'endpoint': endpoint, 'method': request.method,
+                                           'status': response.status_code})
+
+    threshold = app.config['METRICS_SLOW_REQUEST_SECONDS']
+    if threshold is not None and elapsed >= threshold:
+        metrics.inc('tp_http_slow_requests_total', {'endpoint': endpoint})
+        spans = ', '.join(f'{kind} {total * 1000:.1f}ms/{count}'
+                          for kind, (total, count) in sorted(g.get('_spans', {}).items()))
+        print(f"Slow request: {request.method} {request.path} {response.status_code} "
+              f"{elapsed * 1000:.1f}ms [{spans or 'no spans'}]")
+        if profiler:
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(20)
+            print(report.getvalue())
+    return response
+
+# Upstream Response Cache
+class UpstreamCache:
+    """In-process LRU in front of a namespaced SQLite table, with negative and stale-while-revalidate entries"""
+    def __init__(self, namespace: str, ttl: float, negative_ttl: float, stale_ttl: float,
+                 memory_entries: int, max_entries: int, prune_every: int = 1):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        # Expiry and eviction run once per prune_every stores, so the table may overshoot max_entries by that much
+        self.prune_every = max(1, prune_every)
+        self._since_prune = 0
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'db_hits': 0, 'stale_hits': 0, 'misses': 0,
+                       'stores': 0, 'evictions': 0, 'prunes': 0}
+
+    def _count(self, stat: str, n: int = 1):
+        with self._lock:
+            self._stats[stat] += n
+
+    def _remember(self, key: str, entry: Tuple):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Tuple[Optional[object], Optional[str]]:
+        """Returns (value, 'fresh' | 'stale') or (None, None) on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry:
+                self._memory.move_to_end(key)
+        source = 'memory_hits'
+        if entry is None:
+            with db_connection() as conn:
+                row = conn.execute('''SELECT value, fresh_until, stale_until FROM upstream_cache
+                                     WHERE namespace = ? AND cache_key = ?''',
+                                  (self.namespace, key)).fetchone()
+                if row and row['stale_until'] > now:
+                    conn.execute('''UPDATE upstream_cache SET last_accessed = ?
+                                   WHERE namespace = ? AND cache_key = ?''', (now, self.namespace, key))
+                    conn.commit()
+            if row:
+                entry = (json_loads(row['value']), row['fresh_until'], row['stale_until'])
+                self._remember(key, entry)
+            source = 'db_hits'
+
+        if entry is None or entry[2] <= now:
+            self._count('misses')
+            return None, None
+        if entry[1] <= now:
+            self._count('stale_hits')
+            return entry[0], 'stale'
+        self._count(source)
+        return entry[0], 'fresh'
+
+    def put(self, key: str, value, negative: bool = False):
+        now = time.time()
+        fresh_until = now + (self.negative_ttl if negative else self.ttl)
+        stale_until = fresh_until + (0 if negative else self.stale_ttl)
+        self._remember(key, (value, fresh_until, stale_until))
+        with db_connection() as conn:
+            conn.execute('''INSERT OR REPLACE INTO upstream_cache
+                           (namespace, cache_key, value, fresh_until, stale_until, last_accessed)
+                           VALUES (?, ?, ?, ?, ?, ?)''',
+                        (self.namespace, key, json_dumps(value), fresh_until, stale_until, now))
+            conn.commit()
+        with self._lock:
+            self._stats['stores'] += 1
+            self._since_prune += 1
+            due = self._since_prune >= self.prune_every
+            if due:
+                self._since_prune = 0
+        if due:
+            self.prune(now)
+
+    def prune(self, now: float = None) -> int:
+        """Drop entries past their stale window, then the least recently used beyond max_entries"""
+        now = now or time.time()
+        with db_connection() as conn:
+            expired = conn.execute('DELETE FROM upstream_cache WHERE namespace = ? AND stale_until < ?',
+                                   (self.namespace, now)).rowcount
+            evicted = conn.execute('''DELETE FROM upstream_cache WHERE namespace = ? AND cache_key IN (
+                                        SELECT cache_key FROM upstream_cache WHERE namespace = ?
+                                        ORDER BY last_accessed DESC LIMIT -1 OFFSET ?)''',
+                                   (self.namespace, self.namespace, self.max_entries)).rowcount
+            conn.commit()
+        self._count('prunes')
+        if evicted:
+            self._count('evictions', evicted)
+        return expired + evicted
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_size'] = len(self._memory)
+        return stats
+
+def quantize(value: float, grid: float) -> float:
+    """Snap a coordinate to the cache grid"""
+    return round(round(value / grid) * grid, 6)
+
 # OpenRoute Service
+# Routing profiles ORS serves; anything else would be sent upstream only to come back as an error
+ORS_PROFILES = ('driving-car', 'driving-hgv', 'cycling-regular', 'cycling-road', 'cycling-mountain',
+                'cycling-electric', 'foot-walking', 'foot-hiking', 'wheelchair')
+
 class OpenRouteService:
-    def __init__(self):
+    def __init__(self, base_url: str = None):
         self.api_key = ORS_KEY
-        self.base_url = "https://api.openrouteservice.org"
+        self.base_url = base_url or app.config['ORS_BASE_URL']
         self.headers = {
             'Authorization': f'Bearer {self.api_key}',
             'Content-Type': 'application/json'
         }
+        # One keep-alive session shared by all request threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=app.config['ORS_POOL_SIZE'],
+                              pool_maxsize=app.config['ORS_POOL_SIZE'])
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(self.headers)
+        self.timeout = (app.config['ORS_CONNECT_TIMEOUT'], app.config['ORS_READ_TIMEOUT'])
+        self.max_retries = app.config['ORS_MAX_RETRIES']
+        self.backoff_base = app.config['ORS_BACKOFF_BASE']
+        self.backoff_max = app.config['ORS_BACKOFF_MAX']
+        self.breaker = CircuitBreaker(app.config['ORS_BREAKER_FAILURES'], app.config['ORS_BREAKER_RESET'])
+        self.latency = {operation: metrics.histogram('tp_upstream_request_seconds',
+                                                     {'upstream': 'openroute', 'operation': operation})
+                        for operation in ('geocoding', 'directions', 'matrix')}
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'retries': 0, 'failures': 0, 'refreshes': 0}
+        self.grid = app.config['GEOCODE_GRID']
+        self.geocode_cache = UpstreamCache(
+            'geocoding',
+            ttl=app.config['GEOCODE_CACHE_TTL'],
+            negative_ttl=app.config['GEOCODE_CACHE_NEGATIVE_TTL'],
+            stale_ttl=app.config['GEOCODE_CACHE_STALE_TTL'],
+            memory_entries=app.config['GEOCODE_CACHE_MEMORY_ENTRIES'],
+            max_entries=app.config['GEOCODE_CACHE_MAX_ENTRIES'],
+            prune_every=app.config['UPSTREAM_CACHE_PRUNE_EVERY']
+        )
+        self._refreshing = set()
+        self._refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='ors-refresh')
+        # Full routes and matrix summaries are cached separately; neither goes stale
+        self.coord_precision = app.config['DIRECTIONS_COORD_PRECISION']
+        self.matrix_max_locations = app.config['ORS_MATRIX_MAX_LOCATIONS']
+        self.directions_cache, self.leg_cache = (
+            UpstreamCache(
+                namespace,
+                ttl=app.config['DIRECTIONS_CACHE_TTL'],
+                negative_ttl=0,
+                stale_ttl=0,
+                memory_entries=app.config['DIRECTIONS_CACHE_MEMORY_ENTRIES'],
+                max_entries=app.config['DIRECTIONS_CACHE_MAX_ENTRIES'],
+                prune_every=app.config['UPSTREAM_CACHE_PRUNE_EVERY']
+            )
+            for namespace in ('directions', 'route_legs')
+        )
+        self._directions_executor = ThreadPoolExecutor(max_workers=app.config['ORS_DIRECTIONS_WORKERS'],
+                                                       thread_name_prefix='ors-directions')
+
+    def close(self):
+        self._refresh_executor.shutdown(wait=False, cancel_futures=True)
+        self._directions_executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def _count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _request(self, operation: str, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request with timeouts, backoff retries and the circuit breaker applied"""
+        if not self.breaker.allow():
+            raise CircuitOpenError(f'OpenRouteService {operation} circuit is open')
+
+        # Every outcome must reach the breaker, or a failed half-open trial would keep it shut for good
+        response = None
+        try:
+            response = self._send(operation, method, url, **kwargs)
+        finally:
+            if response is None:
+                self._count('failures')
+                self.breaker.record_failure()
+            else:
+                # 4xx other than 429 is the caller's problem, not an upstream outage
+                self.breaker.record_success()
+        response.raise_for_status()
+        return response
+
+    def _send(self, operation: str, method: str, url: str, **kwargs) -> requests.Response:
+        """Retry transient failures with backoff; returns the first non-retryable response or raises the last error"""
+        attempt = 0
+        while True:
+            self._count('requests')
+            started = time.perf_counter()
+            response = None
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                error = None if response.status_code not in RETRYABLE_STATUS else \
+                    requests.HTTPError(f'{response.status_code} from OpenRouteService', response=response)
+            except RETRYABLE_ERRORS as e:
+                error = e
+            finally:
+                elapsed = time.perf_counter() - started
+                self.latency[operation].observe(elapsed)
+                observe_span('upstream', elapsed)
+
+            if error is None:
+                return response
+
+            delay = min(self.backoff_base * (2 ** attempt), self.backoff_max) * random.uniform(0.5, 1.0)
+            if response is not None:
+                retry_after = retry_after_seconds(response.headers.get('Retry-After'))
+                if retry_after is not None:
+                    delay = retry_after
+            if attempt >= self.max_retries or delay > self.backoff_max:
+                raise error
+            attempt += 1
+            self._count('retries')
+            time.sleep(delay)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['geocode_cache'] = self.geocode_cache.stats()
+        stats['directions_cache'] = self.directions_cache.stats()
+        stats['leg_cache'] = self.leg_cache.stats()
+        stats['circuit'] = self.breaker.stats()
+        stats['latency'] = {operation: histogram.snapshot() for operation, histogram in self.latency.items()}
+        return stats
     
+    def _geocode_key(self, query: str, location: str = None, bbox: List[float] = None) -> str:
+        parts = [' '.join(query.split()).casefold()]
+        if location:
+            try:
+                parts.append(','.join(str(quantize(float(v), self.grid)) for v in location.split(',')))
+            except ValueError:
+                parts.append(location.strip().casefold())
+        else:
+            parts.append('')
+        parts.append(','.join(str(quantize(v, self.grid)) for v in bbox) if bbox else '')
+        return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
     def search_places(self, query: str, location: str = None, bbox: List[float] = None) -> List[Dict]:
+        """Search for places, answering from the geocoding cache when possible"""
+        key = self._geocode_key(query, location, bbox)
+        try:
+            places, freshness = self.geocode_cache.get(key)
+        except sqlite3.Error as e:
+            print(f"Geocode cache error: {e}")
+            places, freshness = None, None
+        if freshness == 'stale':
+            self._refresh_places(key, query, location, bbox)
+        if freshness:
+            return places
+
+        try:
+            places = self._fetch_places(query, location, bbox)
+        except Exception as e:
+            print(f"Places search error: {e}")
+            return []
+        self._store_places(key, places)
+        return places
+
+    def _store_places(self, key: str, places: List[Dict]):
+        try:
+            self.geocode_cache.put(key, places, negative=not places)
+        except sqlite3.Error as e:
+            print(f"Geocode cache error: {e}")
+
+    def _refresh_places(self, key: str, query: str, location: str, bbox: List[float]):
+        """Revalidate a stale entry in the background, once per key"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self._stats['refreshes'] += 1
+
+        def refresh():
+            try:
+                self._store_places(key, self._fetch_places(query, location, bbox))
+            except Exception as e:
+                print(f"Places refresh error: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._refresh_executor.submit(refresh)
+
+    def _fetch_places(self, query: str, location: str = None, bbox: List[float] = None) -> List[Dict]:
         """Search for places using OpenRoute geocoding service"""
         url = f"{self.base_url}/geocoding"
         params = {'text': query}
@@ -319,30 +2729,58 @@ class OpenRouteService:
         if bbox:
             params['bbox'] = ','.join(map(str, bbox))
         
-        try:
-            response = requests.get(url, params=params, headers=self.headers)
-            response.raise_for_status()
-            data = response.json()
-            
-            places = []
-            for feature in data.get('features', []):
-                place = {
-                    'name': feature['properties']['name'],
-                    'address': feature['properties'].get('formatted', ''),
-                    'coordinates': {
-                        'lat': feature['geometry']['coordinates'][1],
-                        'lng': feature['geometry']['coordinates'][0]
-                    },
-                    'category': feature['properties'].get('category', 'unknown')
-                }
-                places.append(place)
-            
-            return places
-        except Exception as e:
-            print(f"Places search error: {e}")
-            return []
+        response = self._request('geocoding', 'GET', url, params=params)
+        data = response.json()
+        
+        places = []
+        for feature in data.get('features', []):
+            place = {
+                'name': feature['properties']['name'],
+                'address': feature['properties'].get('formatted', ''),
+                'coordinates': {
+                    'lat': feature['geometry']['coordinates'][1],
+                    'lng': feature['geometry']['coordinates'][0]
+                },
+                'category': feature['properties'].get('category', 'unknown')
+            }
+            places.append(place)
+        
+        return places
     
+    def _leg_key(self, start: List[float], end: List[float], profile: str) -> str:
+        rounded = [round(float(v), self.coord_precision) for v in list(start) + list(end)]
+        return f"{profile}|" + ','.join(str(v) for v in rounded)
+
+    def _cached(self, cache: UpstreamCache, key: str):
+        try:
+            value, freshness = cache.get(key)
+        except sqlite3.Error as e:
+            print(f"Directions cache error: {e}")
+            return None
+        return value if freshness else None
+
+    def _store(self, cache: UpstreamCache, key: str, value):
+        try:
+            cache.put(key, value)
+        except sqlite3.Error as e:
+            print(f"Directions cache error: {e}")
+
     def get_directions(self, start: List[float], end: List[float], profile: str = 'driving-car') -> Dict:
+        """Get directions between two points, answering from the leg cache when possible"""
+        key = self._leg_key(start, end, profile)
+        cached = self._cached(self.directions_cache, key)
+        if cached is not None:
+            return cached
+        
+        try:
+            directions = self._fetch_directions(start, end, profile)
+        except Exception as e:
+            print(f"Directions error: {e}")
+            return {}
+        self._store(self.directions_cache, key, directions)
+        return directions
+
+    def _fetch_directions(self, start: List[float], end: List[float], profile: str) -> Dict:
         """Get directions between two points"""
         url = f"{self.base_url}/v2/directions/{profile}"
         data = {
@@ -350,17 +2788,557 @@ class OpenRouteService:
             'format': 'json'
         }
         
+        response = self._request('directions', 'POST', url, json=data)
+        return response.json()
+
+    def _fetch_matrix(self, locations: List[List[float]], profile: str) -> Dict:
+        """Distance/duration matrix between all locations in one request"""
+        url = f"{self.base_url}/v2/matrix/{profile}"
+        data = {
+            'locations': locations,
+            'metrics': ['distance', 'duration']
+        }
+        
+        response = self._request('matrix', 'POST', url, json=data)
+        return response.json()
+
+    def get_legs(self, pairs: List[Tuple[List[float], List[float]]], profile: str = 'driving-car',
+                 detail: str = 'summary') -> Tuple[List[Optional[Dict]], int]:
+        """Resolve many legs at once; returns (per-leg results, upstream calls made).
+
+        Summary legs ({distance, duration}) missing from the cache are filled from the matrix API,
+        full legs from concurrent directions calls. Summary legs whose matrix request failed or came
+        back malformed are retried with directions calls. Legs that could not be resolved are None.
+        """
+        cache = self.leg_cache if detail == 'summary' else self.directions_cache
+        results: List[Optional[Dict]] = [None] * len(pairs)
+        cached = [False] * len(pairs)
+        missing = []
+        for i, (start, end) in enumerate(pairs):
+            value = self._cached(cache, self._leg_key(start, end, profile))
+            if value is not None:
+                results[i] = value
+                cached[i] = True
+            else:
+                missing.append(i)
+        
+        upstream_calls = 0
+        by_directions = [] if detail == 'summary' else missing
+        if detail == 'summary':
+            for chunk in self._matrix_chunks(pairs, missing):
+                locations = []
+                index = {}
+                for i in chunk:
+                    for point in pairs[i]:
+                        point_key = tuple(point)
+                        if point_key not in index:
+                            index[point_key] = len(locations)
+                            locations.append(list(point))
+                upstream_calls += 1
+                try:
+                    matrix = self._fetch_matrix(locations, profile)
+                    legs = {}
+                    for i in chunk:
+                        a, b = index[tuple(pairs[i][0])], index[tuple(pairs[i][1])]
+                        legs[i] = {'distance': matrix['distances'][a][b], 'duration': matrix['durations'][a][b]}
+                except Exception as e:
+                    print(f"Matrix error: {e}")
+                    by_directions += chunk
+                    continue
+                for i, leg in legs.items():
+                    if leg['distance'] is None or leg['duration'] is None:
+                        continue
+                    results[i] = leg
+                    self._store(cache, self._leg_key(*pairs[i], profile), leg)
+        
+        futures = {self._directions_executor.submit(self._fetch_directions, *pairs[i], profile): i
+                   for i in by_directions}
+        upstream_calls += len(futures)
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                leg = future.result()
+                if detail == 'summary':
+                    # ORS leaves zero distance/duration out of the summary
+                    summary = leg['routes'][0]['summary']
+                    leg = {'distance': summary.get('distance', 0), 'duration': summary.get('duration', 0)}
+            except Exception as e:
+                print(f"Directions error: {e}")
+                continue
+            results[i] = leg
+            self._store(cache, self._leg_key(*pairs[i], profile), leg)
+        
+        return [dict(result, cached=was_cached) if result is not None else None
+                for result, was_cached in zip(results, cached)], upstream_calls
+
+    def _matrix_chunks(self, pairs: List[Tuple[List[float], List[float]]], indices: List[int]) -> List[List[int]]:
+        """Group legs so each matrix request stays under the location limit"""
+        chunks, chunk, points = [], [], set()
+        for i in indices:
+            leg_points = {tuple(pairs[i][0]), tuple(pairs[i][1])}
+            if chunk and len(points | leg_points) > self.matrix_max_locations:
+                chunks.append(chunk)
+                chunk, points = [], set()
+            chunk.append(i)
+            points |= leg_points
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+# Itinerary Jobs
+def attach_itinerary_to_plan(conn, plan_id: str, user_id: str, itinerary: Dict) -> bool:
+    """Store an itinerary and its activities on a plan the user owns; returns False if not found"""
+    plan = conn.execute('SELECT id FROM travel_plans WHERE id = ? AND user_id = ?',
+                       (plan_id, user_id)).fetchone()
+    if not plan:
+        return False
+    store_itinerary(conn, plan_id, itinerary)
+    # The plan's cost is what its activities add up to, not the model's estimate
+    conn.execute('''UPDATE travel_plans SET total_cost =
+                       (SELECT COALESCE(SUM(cost), 0) FROM activities WHERE plan_id = ?)
+                   WHERE id = ?''', (plan_id, plan_id))
+    return True
+
+class ItineraryJobQueue:
+    """Runs itinerary generation on a bounded worker pool with state persisted in SQLite"""
+    def __init__(self, service: AIItineraryService, max_workers: int, max_pending: int):
+        self.service = service
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='itinerary-job')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._closed = False
+
+    def submit(self, user_id: str, params: Dict, plan_id: str = None) -> Optional[str]:
+        """Queue a generation job; returns None if the queue is full"""
+        with self._lock:
+            if self._closed or self._pending >= self.max_pending:
+                return None
+            self._pending += 1
+
+        job_id = str(uuid.uuid4())
+        now = datetime.now().isoformat()
+        try:
+            with db_connection() as conn:
+                conn.execute('''INSERT INTO itinerary_jobs
+                               (id, user_id, plan_id, status, params, created_at, updated_at)
+                               VALUES (?, ?, ?, 'queued', ?, ?, ?)''',
+                            (job_id, user_id, plan_id, json_dumps(params), now, now))
+                conn.commit()
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        self._executor.submit(self._run, job_id)
+        return job_id
+
+    def resume_pending(self, stale_after: float):
+        """Re-queue jobs left behind by a previous worker process"""
+        cutoff = (datetime.now() - timedelta(seconds=stale_after)).isoformat()
+        with db_connection() as conn:
+            conn.execute('''UPDATE itinerary_jobs SET status = 'queued'
+                           WHERE status = 'running' AND updated_at < ?''', (cutoff,))
+            conn.commit()
+            job_ids = [row['id'] for row in conn.execute(
+                "SELECT id FROM itinerary_jobs WHERE status = 'queued' ORDER BY created_at")]
+        for job_id in job_ids:
+            with self._lock:
+                self._pending += 1
+            self._executor.submit(self._run, job_id)
+
+    def _update(self, job_id: str, **fields):
+        fields['updated_at'] = datetime.now().isoformat()
+        assignments = ', '.join(f'{field} = ?' for field in fields)
+        with db_connection() as conn:
+            conn.execute(f'UPDATE itinerary_jobs SET {assignments} WHERE id = ?',
+                         list(fields.values()) + [job_id])
+            conn.commit()
+
+    def _run(self, job_id: str):
+        with self._lock:
+            self._running += 1
         try:
-            response = requests.post(url, json=data, headers=self.headers)
-            response.raise_for_status()
-            return response.json()
+            with db_connection() as conn:
+                # Claim the job so only one worker process runs it
+                claimed = conn.execute('''UPDATE itinerary_jobs SET status = 'running', updated_at = ?
+                                         WHERE id = ? AND status = 'queued' ''',
+                                       (datetime.now().isoformat(), job_id)).rowcount
+                conn.commit()
+                if not claimed:
+                    return
+                job = conn.execute('SELECT user_id, plan_id, params FROM itinerary_jobs WHERE id = ?',
+                                   (job_id,)).fetchone()
+                # Days from an interrupted earlier attempt are regenerated
+                conn.execute('DELETE FROM itinerary_job_days WHERE job_id = ?', (job_id,))
+                conn.commit()
+
+            params = json_loads(job['params'])
+            day_index = 0
+
+            def on_day(day: Dict):
+                nonlocal day_index
+                with db_connection() as conn:
+                    conn.execute('INSERT OR REPLACE INTO itinerary_job_days (job_id, day_index, day) VALUES (?, ?, ?)',
+                                 (job_id, day_index, json_dumps(day)))
+                    conn.execute('UPDATE itinerary_jobs SET days_ready = ?, updated_at = ? WHERE id = ?',
+                                 (day_index + 1, datetime.now().isoformat(), job_id))
+                    conn.commit()
+                day_index += 1
+
+            itinerary, cache_status = self.service.generate_itinerary_with_status(
+                destination=params['destination'],
+                budget=float(params['budget']),
+                duration=int(params['duration']),
+                interests=params['interests'],
+                on_day=on_day
+            )
+
+            with db_connection() as conn:
+                # The itinerary only lands if the plan is still at the version the job was queued against;
+                # jobs queued before plan_version was recorded attach unconditionally
+                plan_id, version = job['plan_id'], params.get('plan_version')
+                attached = not plan_id or (
+                    (version is None or claim_plan_version(conn, plan_id, job['user_id'], version))
+                    and attach_itinerary_to_plan(conn, plan_id, job['user_id'], itinerary))
+                if not attached:
+                    conn.rollback()
+                    exists = conn.execute('SELECT id FROM travel_plans WHERE id = ? AND user_id = ?',
+                                          (plan_id, job['user_id'])).fetchone()
+                    conn.execute('''UPDATE itinerary_jobs SET status = 'failed', error = ?, cache_status = ?,
+                                   updated_at = ? WHERE id = ?''',
+                                ('Travel plan has changed' if exists else 'Travel plan not found', cache_status,
+                                 datetime.now().isoformat(), job_id))
+                    conn.commit()
+                    return
+                conn.execute('''UPDATE itinerary_jobs SET status = 'succeeded', result = ?, cache_status = ?,
+                               updated_at = ? WHERE id = ?''',
+                            (json_dumps(itinerary), cache_status, datetime.now().isoformat(), job_id))
+                conn.commit()
         except Exception as e:
-            print(f"Directions error: {e}")
-            return {}
+            print(f"Itinerary job error: {e}")
+            try:
+                self._update(job_id, status='failed', error=str(e))
+            except sqlite3.Error as db_error:
+                print(f"Itinerary job error: {db_error}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._running -= 1
+
+    def shutdown(self, timeout: float) -> bool:
+        """Stop taking jobs and wait for running ones; unstarted jobs stay queued for the next process"""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._running:
+                    return True
+            time.sleep(0.1)
+        # Jobs still running are picked up again once ITINERARY_JOB_STALE_AFTER passes
+        return False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'pending': self._pending, 'running': self._running,
+                    'max_pending': self.max_pending, 'workers': self.max_workers}
+
+def job_to_dict(job) -> Dict:
+    job_dict = {
+        'id': job['id'],
+        'status': job['status'],
+        'plan_id': job['plan_id'],
+        'cache_status': job['cache_status'],
+        'error': job['error'],
+        'days_ready': job['days_ready'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+    }
+    if job['status'] == 'succeeded' and job['result']:
+        job_dict['result'] = json_loads(job['result'])
+    return job_dict
+
+# Admission Control
+# Token buckets bound how fast each caller may hit an endpoint group; gates bound how many
+# of the group's requests a worker runs at once and shed load once their queue is full.
+def take_token(tokens: float, elapsed: float, limit: int, period: float) -> Tuple[bool, float]:
+    """Refill a bucket for the elapsed seconds and take one token; returns (allowed, tokens left)"""
+    tokens = min(float(limit), tokens + max(elapsed, 0.0) * limit / period)
+    if tokens >= 1:
+        return True, tokens - 1
+    return False, tokens
+
+class RateLimiter:
+    """In-process token buckets keyed by '<group>:<caller>', bounded by LRU eviction"""
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._stats = {'allowed': 0, 'limited': 0, 'evictions': 0, 'errors': 0}
+
+    def acquire(self, key: str, limit: int, period: float) -> Tuple[bool, float, float]:
+        """Take a token; returns (allowed, tokens left, seconds until the next token)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (limit, now))
+            allowed, tokens = take_token(tokens, now - updated_at, limit, period)
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self._stats['evictions'] += 1
+            self._stats['allowed' if allowed else 'limited'] += 1
+        return allowed, tokens, 0.0 if allowed else (1 - tokens) * period / limit
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['buckets'] = len(self._buckets)
+        return stats
+
+class SQLiteRateLimiter(RateLimiter):
+    """Token buckets in the rate_limits table, so every worker on the database shares them"""
+    def __init__(self, prune_interval: float = 60):
+        super().__init__(max_keys=0)
+        self.prune_interval = prune_interval
+        self._last_prune = 0.0
+
+    def acquire(self, key: str, limit: int, period: float) -> Tuple[bool, float, float]:
+        now = time.time()
+        try:
+            with db_connection() as conn:
+                try:
+                    # IMMEDIATE takes the write lock up front so concurrent workers serialize per bucket
+                    conn.execute('BEGIN IMMEDIATE')
+                    row = conn.execute('SELECT tokens, updated_at FROM rate_limits WHERE key = ?',
+                                       (key,)).fetchone()
+                    tokens, updated_at = (row['tokens'], row['updated_at']) if row else (limit, now)
+                    allowed, tokens = take_token(tokens, now - updated_at, limit, period)
+                    conn.execute('INSERT OR REPLACE INTO rate_limits (key, tokens, updated_at) VALUES (?, ?, ?)',
+                                 (key, tokens, now))
+                    if now - self._last_prune > self.prune_interval:
+                        # A bucket idle for longer than the longest period is full, the same as no row
+                        self._last_prune = now
+                        longest = max((period for _, period in app.config['RATE_LIMITS'].values()), default=period)
+                        conn.execute('DELETE FROM rate_limits WHERE updated_at < ?', (now - longest,))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        except sqlite3.Error as e:
+            # Fail open: a locked or broken limiter table should not take the endpoints down with it
+            print(f"Rate limiter error: {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+            return True, 0.0, 0.0
+        with self._lock:
+            self._stats['allowed' if allowed else 'limited'] += 1
+        return allowed, tokens, 0.0 if allowed else (1 - tokens) * period / limit
+
+class AdmissionGate:
+    """Caps a group's concurrent requests per worker; a bounded number wait, the rest are shed"""
+    def __init__(self, name: str, max_concurrent: int, max_queued: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._stats = {'admitted': 0, 'queued': 0, 'shed': 0, 'timeouts': 0}
+
+    def acquire(self) -> bool:
+        with self._cond:
+            if self._active >= self.max_concurrent:
+                if self._waiting >= self.max_queued:
+                    self._stats['shed'] += 1
+                    return False
+                self._waiting += 1
+                self._stats['queued'] += 1
+                try:
+                    admitted = self._cond.wait_for(lambda: self._active < self.max_concurrent,
+                                                   self.queue_timeout)
+                finally:
+                    self._waiting -= 1
+                if not admitted:
+                    self._stats['timeouts'] += 1
+                    return False
+            self._active += 1
+            self._stats['admitted'] += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return dict(self._stats, active=self._active, waiting=self._waiting,
+                        max_concurrent=self.max_concurrent, max_queued=self.max_queued)
+
+def rate_limit_key() -> str:
+    """The authenticated user if the request carries a valid token, otherwise the client address"""
+    claims = getattr(g, 'token_claims', None)
+    auth_header = request.headers.get('Authorization', '')
+    if claims is None and auth_header.startswith('Bearer '):
+        try:
+            claims = token_cache.decode(auth_header[7:])
+        except jwt.InvalidTokenError:
+            claims = None
+    if claims and claims.get('user_id'):
+        return f"user:{claims['user_id']}"
+    hops = app.config['RATE_LIMIT_TRUSTED_PROXIES']
+    forwarded = request.headers.get('X-Forwarded-For')
+    if hops and forwarded:
+        # Each trusted proxy appends the address it saw, so the client is that many entries from the end
+        addresses = [address.strip() for address in forwarded.split(',')]
+        return f'ip:{addresses[-min(hops, len(addresses))]}'
+    return f'ip:{request.remote_addr}'
+
+def rate_limited(group: str):
+    """Apply the group's token bucket and concurrency gate; goes below token_required"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            headers = {}
+            limit = app.config['RATE_LIMITS'].get(group)
+            if limit:
+                requests_allowed, period = limit
+                allowed, remaining, retry_after = rate_limiter.acquire(f'{group}:{rate_limit_key()}',
+                                                                       requests_allowed, period)
+                headers = {'X-RateLimit-Limit': str(requests_allowed), 'X-RateLimit-Remaining': str(int(remaining))}
+                if not allowed:
+                    metrics.inc('tp_requests_shed_total', {'group': group, 'reason': 'rate_limit'})
+                    headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                    return jsonify({'error': 'Rate limit exceeded, try again later'}), 429, headers
+            
+            gate = admission_gates.get(group)
+            if gate and not gate.acquire():
+                metrics.inc('tp_requests_shed_total', {'group': group, 'reason': 'overload'})
+                return jsonify({'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
+            try:
+                response = app.make_response(f(*args, **kwargs))
+            finally:
+                if gate:
+                    gate.release()
+            response.headers.update(headers)
+            return response
+        return decorated
+    return decorator
 
 # Initialize services
-ai_service = AIItineraryService()
+itinerary_cache = ItineraryCache(
+    ttl=app.config['ITINERARY_CACHE_TTL'],
+    max_entries=app.config['ITINERARY_CACHE_MAX_ENTRIES'],
+    budget_band=app.config['ITINERARY_CACHE_BUDGET_BAND']
+)
+ai_service = AIItineraryService(
+    cache=itinerary_cache,
+    coalesce_timeout=app.config['ITINERARY_COALESCE_TIMEOUT'],
+    fanout_min_days=app.config['ITINERARY_FANOUT_MIN_DAYS'],
+    fanout_workers=app.config['ITINERARY_FANOUT_WORKERS']
+)
+configure_json(app.config['JSON_BACKEND'])
 openroute_service = OpenRouteService()
+password_hasher = PasswordHasher()
+token_cache = TokenCache(
+    max_entries=app.config['AUTH_TOKEN_CACHE_ENTRIES'],
+    revocation_refresh=app.config['AUTH_REVOCATION_REFRESH']
+)
+user_cache = UserCache(
+    ttl=app.config['AUTH_USER_CACHE_TTL'],
+    max_entries=app.config['AUTH_USER_CACHE_ENTRIES']
+)
+if app.config['RATE_LIMIT_STORAGE'] == 'sqlite':
+    rate_limiter = SQLiteRateLimiter()
+else:
+    rate_limiter = RateLimiter(max_keys=app.config['RATE_LIMIT_MAX_KEYS'])
+admission_gates = {
+    group: AdmissionGate(group, concurrent, queued, app.config['ADMISSION_QUEUE_TIMEOUT'])
+    for group, (concurrent, queued) in app.config['ADMISSION_LIMITS'].items()
+}
+itinerary_jobs = ItineraryJobQueue(
+    ai_service,
+    max_workers=app.config['ITINERARY_JOB_WORKERS'],
+    max_pending=app.config['ITINERARY_JOB_MAX_PENDING']
+)
+
+# HTTP Caching
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/plain', 'text/html'}
+
+def http_date(timestamp: Optional[str]) -> Optional[str]:
+    """Format a stored local ISO timestamp as an HTTP date"""
+    if not timestamp:
+        return None
+    try:
+        return formatdate(datetime.fromisoformat(timestamp).timestamp(), usegmt=True)
+    except ValueError:
+        return None
+
+def _request_etags() -> set:
+    # Compressed variants carry a -gzip/-br suffix; they validate the same representation
+    tags = set()
+    for tag in request.if_none_match.as_set():
+        for suffix in ('-gzip', '-br'):
+            if tag.endswith(suffix):
+                tag = tag[:-len(suffix)]
+        tags.add(tag)
+    return tags
+
+def conditional_response(etag: str, last_modified: Optional[str], build: Callable):
+    """Return 304 when the client's copy is current, otherwise build() the full response"""
+    last_modified_http = http_date(last_modified)
+    not_modified = False
+    if request.if_none_match:
+        not_modified = '*' in request.if_none_match.as_set() or etag in _request_etags()
+    elif request.if_modified_since and last_modified_http:
+        not_modified = int(datetime.fromisoformat(last_modified).timestamp()) <= \
+            request.if_modified_since.timestamp()
+    
+    if not_modified:
+        response = app.response_class(status=304)
+    else:
+        response = build()
+        if isinstance(response, tuple):
+            return response
+    response.set_etag(etag)
+    if last_modified_http:
+        response.headers['Last-Modified'] = last_modified_http
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.after_request
+def compress_response(response):
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    
+    body = response.get_data()
+    if len(body) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    
+    accepted = request.accept_encodings
+    if brotli and accepted['br']:
+        encoding = 'br'
+        compressed = brotli.compress(body, quality=app.config['COMPRESS_BROTLI_QUALITY'])
+    elif accepted['gzip']:
+        encoding = 'gzip'
+        compressed = gzip.compress(body, compresslevel=app.config['COMPRESS_GZIP_LEVEL'])
+    else:
+        return response
+    
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak=weak)
+    return response
 
 # Routes
 @app.route('/')
@@ -373,16 +3351,71 @@ def index():
             '/api/users (POST)',
             '/api/auth/login (POST)',
             '/api/auth/me (GET)',
+            '/api/auth/logout (POST)',
+            '/api/auth/logout-all (POST)',
             '/api/travel-plans (GET, POST)',
             '/api/travel-plans/<id> (GET, PUT, DELETE)',
             '/api/generate-itinerary (POST)',
+            '/api/travel-plans/<id>/generate-itinerary (POST)',
+            '/api/generate-itinerary/<job_id> (GET)',
+            '/api/generate-itinerary/<job_id>/events (GET, SSE)',
+            '/api/generate-itinerary/<job_id>/attach (POST)',
             '/api/places/search (GET)',
             '/api/directions (POST)',
-            '/api/activities (POST, PUT, DELETE)',
-            '/api/expenses (GET, POST, PUT, DELETE)'
+            '/api/directions/batch (POST)',
+            '/api/activities (POST)',
+            '/api/activities/bulk (POST)',
+            '/api/activities/<id> (PUT, DELETE)',
+            '/api/activities/within (GET)',
+            '/api/activities/nearby (GET)',
+            '/api/expenses (GET, POST, PUT, DELETE)',
+            '/api/expenses/bulk (POST; JSON, CSV or NDJSON)',
+            '/api/expenses/summary (GET)',
+            '/api/search (GET)',
+            '/api/health (GET)',
+            '/metrics (GET, Prometheus text format)'
         ]
     })
 
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def collect_service_stats():
+    for name, pool in db_pools.items():
+        yield from stats_samples('tp_db_pool', pool.stats(), {'pool': name})
+    yield from stats_samples('tp_itinerary_cache', itinerary_cache.stats())
+    yield from stats_samples('tp_itinerary_coalescing', ai_service.in_flight.stats())
+    yield from stats_samples('tp_itinerary_jobs', itinerary_jobs.stats())
+    yield from stats_samples('tp_openroute', openroute_service.stats())
+    yield from stats_samples('tp_passwords', password_hasher.stats())
+    yield from stats_samples('tp_auth_tokens', token_cache.stats())
+    yield from stats_samples('tp_auth_users', user_cache.stats())
+    yield from stats_samples('tp_rate_limiter', rate_limiter.stats())
+    for group, gate in admission_gates.items():
+        yield from stats_samples('tp_admission', gate.stats(), {'group': group})
+
+metrics.add_collector(collect_service_stats)
+
+@app.route('/api/health')
+def health():
+    if not db_pools:
+        configure_db_pools()
+    return jsonify({
+        'status': 'ok',
+        'db_pools': {name: pool.stats() for name, pool in db_pools.items()},
+        'itinerary_cache': itinerary_cache.stats(),
+        'itinerary_coalescing': ai_service.in_flight.stats(),
+        'itinerary_jobs': itinerary_jobs.stats(),
+        'openroute': openroute_service.stats(),
+        'passwords': password_hasher.stats(),
+        'auth': {'tokens': token_cache.stats(), 'users': user_cache.stats()},
+        'admission': {
+            'rate_limiter': rate_limiter.stats(),
+            'gates': {group: gate.stats() for group, gate in admission_gates.items()}
+        }
+    })
+
 @app.route('/favicon.ico')
 def favicon():
     return send_from_directory(os.path.join(app.root_path, 'static'),
@@ -399,7 +3432,10 @@ def create_user():
         return jsonify({'error': 'Missing required fields'}), 400
     
     user_id = str(uuid.uuid4())
-    password_hash = hash_password(data['password'])
+    try:
+        password_hash = hash_password(data['password'])
+    except PasswordHasherBusy:
+        return jsonify({'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
     
     user = User(
         id=user_id,
@@ -412,15 +3448,11 @@ def create_user():
     conn = get_db_connection()
     try:
         conn.execute('''INSERT INTO users (id, email, name, password_hash, created_at) 
-                       VALUES (?, ?, ?, ?, ?)''',
-                    (user.id, user.email, user.name, user.password_hash, user.created_at))
+                       VALUES (?, ?, ?, ?, ?)''', user.to_row())
         conn.commit()
         
-        # Don't return password hash
-        user_data = asdict(user)
-        del user_data['password_hash']
-        
-        return jsonify(user_data), 201
+        # to_json leaves out the password hash
+        return json_response(user.to_json(), 201)
     except sqlite3.IntegrityError:
         return jsonify({'error': 'User already exists'}), 400
     finally:
@@ -433,12 +3465,27 @@ def login():
     if not all(field in data for field in ['email', 'password']):
         return jsonify({'error': 'Email and password required'}), 400
     
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     user = conn.execute('SELECT * FROM users WHERE email = ?', (data['email'],)).fetchone()
     conn.close()
     
-    if not user or not verify_password(data['password'], user['password_hash']):
-        return jsonify({'error': 'Invalid credentials'}), 401
+    try:
+        # Unknown emails still pay for a verification so response time doesn't reveal them
+        hashed = user['password_hash'] if user else password_hasher.dummy_hash()
+        if not verify_password(data['password'], hashed) or not user:
+            return jsonify({'error': 'Invalid credentials'}), 401
+        
+        # Upgrade legacy SHA-256 and outdated-cost hashes while we have the plaintext
+        if password_hasher.needs_rehash(hashed):
+            conn = get_db_connection()
+            result = conn.execute('UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                                 (hash_password(data['password']), user['id'], hashed))
+            conn.commit()
+            conn.close()
+            if result.rowcount:
+                password_hasher.record_rehash()
+    except PasswordHasherBusy:
+        return jsonify({'error': 'Server busy, please retry'}), 503, {'Retry-After': '1'}
     
     token = generate_token(user['id'])
     
@@ -454,9 +3501,7 @@ def login():
 @app.route('/api/auth/me', methods=['GET'])
 @token_required
 def get_current_user(current_user_id):
-    conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE id = ?', (current_user_id,)).fetchone()
-    conn.close()
+    user = user_cache.get(current_user_id)
     
     if not user:
         return jsonify({'error': 'User not found'}), 404
@@ -467,7 +3512,47 @@ def get_current_user(current_user_id):
         'name': user['name']
     })
 
+@app.route('/api/auth/logout', methods=['POST'])
+@token_required
+def logout(current_user_id):
+    claims = g.token_claims
+    if 'jti' not in claims:
+        return jsonify({'error': 'Token cannot be revoked; use /api/auth/logout-all'}), 400
+    
+    conn = get_db_connection()
+    token_cache.revoke(conn, claims)
+    conn.commit()
+    conn.close()
+    
+    return jsonify({'message': 'Logged out successfully'})
+
+@app.route('/api/auth/logout-all', methods=['POST'])
+@token_required
+def logout_all(current_user_id):
+    conn = get_db_connection()
+    conn.execute('UPDATE users SET tokens_valid_after = ? WHERE id = ?', (time.time(), current_user_id))
+    token_cache.revoke_user(conn, current_user_id)
+    conn.commit()
+    conn.close()
+    user_cache.invalidate(current_user_id)
+    
+    return jsonify({'message': 'All sessions logged out'})
+
 # Travel Plans Routes
+PLAN_FIELDS = list(TravelPlan.FIELDS)
+
+def plan_response(plan) -> Response:
+    """Serialize a travel_plans row; the stored itinerary JSON is copied through without decoding"""
+    return json_response(TravelPlan.from_row(plan, raw=('itinerary',)).to_json())
+
+def encode_cursor(created_at: str, plan_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, plan_id]).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    padded = cursor + '=' * (-len(cursor) % 4)
+    created_at, plan_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    return str(created_at), str(plan_id)
+
 @app.route('/api/travel-plans', methods=['GET'])
 @token_required
 def get_travel_plans(current_user_id):
@@ -477,20 +3562,71 @@ def get_travel_plans(current_user_id):
     if user_id != current_user_id:
         return jsonify({'error': 'Unauthorized'}), 403
     
-    conn = get_db_connection()
-    plans = conn.execute('''SELECT * FROM travel_plans WHERE user_id = ? 
-                           ORDER BY created_at DESC''', (user_id,)).fetchall()
-    conn.close()
+    # fields= projects columns; summary=true drops the itinerary so it is never read or decoded
+    fields = PLAN_FIELDS
+    if request.args.get('fields'):
+        fields = [field.strip() for field in request.args['fields'].split(',') if field.strip()]
+        unknown = [field for field in fields if field not in PLAN_FIELDS]
+        if unknown:
+            return jsonify({'error': f'Unknown fields: {", ".join(unknown)}'}), 400
+    if request.args.get('summary', '').lower() in ('1', 'true', 'yes'):
+        fields = [field for field in fields if field != 'itinerary']
+    # Keyset columns are always read, and only returned when requested
+    columns = list(dict.fromkeys(fields + ['created_at', 'id']))
+    
+    query = f'SELECT {", ".join(columns)} FROM travel_plans WHERE user_id = ?'
+    params = [user_id]
+    
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Invalid cursor'}), 400
+        query += ' AND (created_at < ? OR (created_at = ? AND id < ?))'
+        params += [cursor_created_at, cursor_created_at, cursor_id]
+    query += ' ORDER BY created_at DESC, id DESC'
+    
+    limit = None
+    if request.args.get('limit') or cursor:
+        try:
+            limit = int(request.args.get('limit', app.config['PLAN_LIST_MAX_LIMIT']))
+        except ValueError:
+            return jsonify({'error': 'Invalid limit'}), 400
+        limit = max(1, min(limit, app.config['PLAN_LIST_MAX_LIMIT']))
+        # Fetch one extra row to know whether another page exists
+        query += ' LIMIT ?'
+        params.append(limit + 1)
     
-    plans_list = []
-    for plan in plans:
-        plan_dict = dict(plan)
-        plan_dict['interests'] = json.loads(plan_dict['interests'])
-        if plan_dict['itinerary']:
-            plan_dict['itinerary'] = json.loads(plan_dict['itinerary'])
-        plans_list.append(plan_dict)
+    conn = get_db_connection(readonly=True)
+    user = conn.execute('SELECT plans_version, plans_updated_at FROM users WHERE id = ?',
+                       (user_id,)).fetchone()
+    if not user:
+        conn.close()
+        return jsonify({'error': 'User not found'}), 404
+    # Any change to the user's plans bumps plans_version; the query string selects the view
+    view = hashlib.sha1(request.query_string).hexdigest()[:12]
+    etag = f'plans-{user_id}-{user["plans_version"]}-{view}'
+    
+    def build():
+        plans = conn.execute(query, params).fetchall()
+        return render_plan_list(plans, fields, limit)
+    
+    response = conditional_response(etag, user['plans_updated_at'], build)
+    conn.close()
+    return response
+
+def render_plan_list(plans, fields: List[str], limit: Optional[int]):
+    next_cursor = None
+    if limit is not None and len(plans) > limit:
+        plans = plans[:limit]
+        next_cursor = encode_cursor(plans[-1]['created_at'], plans[-1]['id'])
     
-    return jsonify(plans_list)
+    response = json_response(TravelPlan.rows_to_json(plans, fields, raw=('itinerary',)))
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(dict(request.args, cursor=next_cursor))}>; rel="next"'
+    return response
 
 @app.route('/api/travel-plans', methods=['POST'])
 @token_required
@@ -523,15 +3659,11 @@ def create_travel_plan(current_user_id):
     try:
         conn.execute('''INSERT INTO travel_plans 
                        (id, user_id, destination, budget, duration, interests, 
-                        start_date, end_date, itinerary, total_cost, created_at, updated_at)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                    (plan.id, plan.user_id, plan.destination, plan.budget, plan.duration,
-                     json.dumps(plan.interests), plan.start_date, plan.end_date,
-                     json.dumps(plan.itinerary), plan.total_cost, plan.created_at, plan.updated_at))
+                        start_date, end_date, itinerary, total_cost, created_at, updated_at, version)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', plan.to_row())
         conn.commit()
         
-        plan_dict = asdict(plan)
-        return jsonify(plan_dict), 201
+        return json_response(plan.to_json(), 201)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
@@ -540,20 +3672,39 @@ def create_travel_plan(current_user_id):
 @app.route('/api/travel-plans/<plan_id>', methods=['GET'])
 @token_required
 def get_travel_plan(current_user_id, plan_id):
-    conn = get_db_connection()
-    plan = conn.execute('SELECT * FROM travel_plans WHERE id = ? AND user_id = ?',
-                       (plan_id, current_user_id)).fetchone()
-    conn.close()
-    
-    if not plan:
+    conn = get_db_connection(readonly=True)
+    current = conn.execute('SELECT version, updated_at FROM travel_plans WHERE id = ? AND user_id = ?',
+                          (plan_id, current_user_id)).fetchone()
+    if not current:
+        conn.close()
         return jsonify({'error': 'Travel plan not found'}), 404
     
-    plan_dict = dict(plan)
-    plan_dict['interests'] = json.loads(plan_dict['interests'])
-    if plan_dict['itinerary']:
-        plan_dict['itinerary'] = json.loads(plan_dict['itinerary'])
+    def build():
+        plan = conn.execute('SELECT * FROM travel_plans WHERE id = ? AND user_id = ?',
+                           (plan_id, current_user_id)).fetchone()
+        return plan_response(plan)
     
-    return jsonify(plan_dict)
+    response = conditional_response(f'plan-{plan_id}-v{current["version"]}', current['updated_at'], build)
+    conn.close()
+    return response
+
+def claim_plan_version(conn, plan_id: str, user_id: str, version) -> bool:
+    """Compare-and-set on the plan's version as the first write of a transaction; False if it has moved on.
+
+    The write lock taken here is held until commit, so no other writer can change the plan in between.
+    """
+    return conn.execute('UPDATE travel_plans SET updated_at = ? WHERE id = ? AND user_id = ? AND version = ?',
+                        (datetime.now().isoformat(), plan_id, user_id, version)).rowcount == 1
+
+def plan_conflict(conn, plan_id: str, user_id: str):
+    """Roll back a write that lost the version race and report the version it lost to"""
+    conn.rollback()
+    current = conn.execute('SELECT version, updated_at FROM travel_plans WHERE id = ? AND user_id = ?',
+                          (plan_id, user_id)).fetchone()
+    conn.close()
+    if not current:
+        return jsonify({'error': 'Travel plan not found'}), 404
+    return jsonify({'error': 'Travel plan has changed', 'version': current['version']}), 409
 
 @app.route('/api/travel-plans/<plan_id>', methods=['PUT'])
 @token_required
@@ -563,47 +3714,57 @@ def update_travel_plan(current_user_id, plan_id):
     conn = get_db_connection()
     
     # Verify ownership
-    existing = conn.execute('SELECT id FROM travel_plans WHERE id = ? AND user_id = ?',
+    existing = conn.execute('SELECT id, version FROM travel_plans WHERE id = ? AND user_id = ?',
                            (plan_id, current_user_id)).fetchone()
     if not existing:
         conn.close()
         return jsonify({'error': 'Travel plan not found'}), 404
     
+    # Optimistic concurrency: reject edits based on a stale version. This is only an early out; the
+    # UPDATE below repeats the check so a concurrent writer cannot slip in between
+    if 'version' in data and data['version'] != existing['version']:
+        conn.close()
+        return jsonify({'error': 'Travel plan has changed', 'version': existing['version']}), 409
+    
     # Update fields
     update_fields = []
     params = []
     
-    allowed_fields = ['destination', 'budget', 'duration', 'interests', 'start_date', 'end_date', 'itinerary', 'total_cost']
+    allowed_fields = ['destination', 'budget', 'duration', 'interests', 'start_date', 'end_date', 'total_cost']
     for field in allowed_fields:
         if field in data:
-            if field in ['interests', 'itinerary']:
+            if field == 'interests':
                 update_fields.append(f'{field} = ?')
-                params.append(json.dumps(data[field]))
+                params.append(json_dumps(data[field]))
             else:
                 update_fields.append(f'{field} = ?')
                 params.append(data[field])
     
-    if update_fields:
+    if update_fields or 'itinerary' in data:
         update_fields.append('updated_at = ?')
         params.append(datetime.now().isoformat())
+        if 'itinerary' not in data:
+            update_fields.append('version = version + 1')
         params.append(plan_id)
         params.append(current_user_id)
         
         query = f'UPDATE travel_plans SET {", ".join(update_fields)} WHERE id = ? AND user_id = ?'
-        conn.execute(query, params)
-        conn.commit()
+        if 'version' in data:
+            query += ' AND version = ?'
+            params.append(data['version'])
+        if conn.execute(query, params).rowcount == 0:
+            return plan_conflict(conn, plan_id, current_user_id)
+    
+    if 'itinerary' in data:
+        store_itinerary(conn, plan_id, data['itinerary'])
+    conn.commit()
     
     # Return updated plan
     plan = conn.execute('SELECT * FROM travel_plans WHERE id = ? AND user_id = ?',
                        (plan_id, current_user_id)).fetchone()
     conn.close()
     
-    plan_dict = dict(plan)
-    plan_dict['interests'] = json.loads(plan_dict['interests'])
-    if plan_dict['itinerary']:
-        plan_dict['itinerary'] = json.loads(plan_dict['itinerary'])
-    
-    return jsonify(plan_dict)
+    return plan_response(plan)
 
 @app.route('/api/travel-plans/<plan_id>', methods=['DELETE'])
 @token_required
@@ -618,7 +3779,8 @@ def delete_travel_plan(current_user_id, plan_id):
         conn.close()
         return jsonify({'error': 'Travel plan not found'}), 404
     
-    # Also delete related activities and expenses
+    # Also delete related days, activities and expenses
+    conn.execute('DELETE FROM itinerary_days WHERE plan_id = ?', (plan_id,))
     conn.execute('DELETE FROM activities WHERE plan_id = ?', (plan_id,))
     conn.execute('DELETE FROM expenses WHERE plan_id = ?', (plan_id,))
     
@@ -628,29 +3790,256 @@ def delete_travel_plan(current_user_id, plan_id):
     return jsonify({'message': 'Travel plan deleted successfully'})
 
 # AI Itinerary Generation
+def trip_numbers(budget, duration) -> Optional[Tuple[float, int]]:
+    """budget and duration as a float and an int, or None if either is not a number"""
+    if isinstance(budget, bool) or isinstance(duration, bool):
+        return None
+    try:
+        return float(budget), int(duration)
+    except (TypeError, ValueError):
+        return None
+
 @app.route('/api/generate-itinerary', methods=['POST'])
 @token_required
+@rate_limited('itinerary')
 def generate_itinerary(current_user_id):
     data = request.get_json()
     
     required_fields = ['destination', 'budget', 'duration', 'interests']
     if not all(field in data for field in required_fields):
         return jsonify({'error': 'Missing required fields'}), 400
+    if not trip_numbers(data['budget'], data['duration']):
+        return jsonify({'error': 'budget and duration must be numbers'}), 400
+    
+    if data.get('async'):
+        return submit_itinerary_job(current_user_id, data)
     
     try:
-        itinerary = ai_service.generate_itinerary(
+        itinerary, cache_status = ai_service.generate_itinerary_with_status(
             destination=data['destination'],
             budget=float(data['budget']),
             duration=int(data['duration']),
             interests=data['interests']
         )
         
-        return jsonify(itinerary)
+        response = jsonify(itinerary)
+        response.headers['X-Itinerary-Cache'] = cache_status
+        return response
+    except Exception as e:
+        return jsonify({'error': f'Failed to generate itinerary: {str(e)}'}), 500
+
+def submit_itinerary_job(current_user_id, data):
+    plan_id = data.get('plan_id')
+    plan = None
+    if plan_id:
+        conn = get_db_connection(readonly=True)
+        plan = conn.execute('SELECT id, version FROM travel_plans WHERE id = ? AND user_id = ?',
+                           (plan_id, current_user_id)).fetchone()
+        conn.close()
+        if not plan:
+            return jsonify({'error': 'Travel plan not found'}), 404
+        if 'version' in data and data['version'] != plan['version']:
+            return jsonify({'error': 'Travel plan has changed', 'version': plan['version']}), 409
+    
+    params = {
+        'destination': data['destination'],
+        'budget': float(data['budget']),
+        'duration': int(data['duration']),
+        'interests': data['interests']
+    }
+    if plan:
+        # The job attaches only if the plan is still at this version when it finishes
+        params['plan_version'] = plan['version']
+    job_id = itinerary_jobs.submit(current_user_id, params, plan_id)
+    if not job_id:
+        return jsonify({'error': 'Itinerary queue is full, try again later'}), 503
+    
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'poll_url': f'/api/generate-itinerary/{job_id}',
+        'events_url': f'/api/generate-itinerary/{job_id}/events'
+    }), 202
+
+@app.route('/api/generate-itinerary/<job_id>', methods=['GET'])
+@token_required
+def get_itinerary_job(current_user_id, job_id):
+    conn = get_db_connection(readonly=True)
+    job = conn.execute('SELECT * FROM itinerary_jobs WHERE id = ? AND user_id = ?',
+                      (job_id, current_user_id)).fetchone()
+    if not job:
+        conn.close()
+        return jsonify({'error': 'Job not found'}), 404
+    
+    job_dict = job_to_dict(job)
+    if job['status'] in ('queued', 'running'):
+        days = conn.execute('SELECT day FROM itinerary_job_days WHERE job_id = ? ORDER BY day_index',
+                           (job_id,)).fetchall()
+        job_dict['days'] = [json_loads(row['day']) for row in days]
+    conn.close()
+    
+    return jsonify(job_dict)
+
+@app.route('/api/generate-itinerary/<job_id>/events', methods=['GET'])
+@token_required
+def stream_itinerary_job(current_user_id, job_id):
+    conn = get_db_connection(readonly=True)
+    job = conn.execute('SELECT id FROM itinerary_jobs WHERE id = ? AND user_id = ?',
+                      (job_id, current_user_id)).fetchone()
+    conn.close()
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    poll_interval = app.config['SSE_POLL_INTERVAL']
+    heartbeat_interval = app.config['SSE_HEARTBEAT_INTERVAL']
+    
+    def sse(event: str, data) -> str:
+        return f"event: {event}\ndata: {json_dumps(data)}\n\n"
+    
+    def events():
+        sent_days = 0
+        last_status = None
+        last_write = time.monotonic()
+        while True:
+            with db_connection(readonly=True) as conn:
+                job = conn.execute('SELECT * FROM itinerary_jobs WHERE id = ?', (job_id,)).fetchone()
+                days = conn.execute('''SELECT day_index, day FROM itinerary_job_days
+                                      WHERE job_id = ? AND day_index >= ? ORDER BY day_index''',
+                                   (job_id, sent_days)).fetchall()
+            
+            for row in days:
+                yield sse('day', {'index': row['day_index'], 'day': json_loads(row['day'])})
+                sent_days = row['day_index'] + 1
+                last_write = time.monotonic()
+            if job['status'] != last_status:
+                last_status = job['status']
+                yield sse('status', {'status': last_status})
+                last_write = time.monotonic()
+            
+            if job['status'] == 'succeeded':
+                yield sse('done', job_to_dict(job))
+                return
+            if job['status'] == 'failed':
+                yield sse('error', {'error': job['error']})
+                return
+            if time.monotonic() - last_write >= heartbeat_interval:
+                yield ': keep-alive\n\n'
+                last_write = time.monotonic()
+            time.sleep(poll_interval)
+    
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/generate-itinerary/<job_id>/attach', methods=['POST'])
+@token_required
+def attach_itinerary_job(current_user_id, job_id):
+    data = request.get_json(silent=True) or {}
+    
+    plan_id = data.get('plan_id')
+    if not plan_id:
+        return jsonify({'error': 'plan_id required'}), 400
+    # Attaching replaces the plan's activities and total_cost, so the caller must say which version it saw
+    if 'version' not in data:
+        return jsonify({'error': 'version required'}), 400
+    
+    conn = get_db_connection()
+    job = conn.execute('SELECT status, result FROM itinerary_jobs WHERE id = ? AND user_id = ?',
+                      (job_id, current_user_id)).fetchone()
+    if not job:
+        conn.close()
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] != 'succeeded':
+        conn.close()
+        return jsonify({'error': f"Job is {job['status']}"}), 409
+    
+    if not claim_plan_version(conn, plan_id, current_user_id, data['version']):
+        return plan_conflict(conn, plan_id, current_user_id)
+    attach_itinerary_to_plan(conn, plan_id, current_user_id, json_loads(job['result']))
+    conn.execute('UPDATE itinerary_jobs SET plan_id = ?, updated_at = ? WHERE id = ?',
+                 (plan_id, datetime.now().isoformat(), job_id))
+    conn.commit()
+    conn.close()
+    
+    return jsonify({'message': 'Itinerary attached to travel plan', 'plan_id': plan_id})
+
+@app.route('/api/travel-plans/<plan_id>/generate-itinerary', methods=['POST'])
+@token_required
+@rate_limited('itinerary')
+def generate_plan_itinerary(current_user_id, plan_id):
+    data = request.get_json(silent=True) or {}
+    
+    conn = get_db_connection(readonly=True)
+    plan = conn.execute('''SELECT destination, budget, duration, interests, version FROM travel_plans
+                          WHERE id = ? AND user_id = ?''', (plan_id, current_user_id)).fetchone()
+    conn.close()
+    if not plan:
+        return jsonify({'error': 'Travel plan not found'}), 404
+    
+    if 'version' in data and data['version'] != plan['version']:
+        return jsonify({'error': 'Travel plan has changed', 'version': plan['version']}), 409
+    
+    # The plan supplies the trip parameters; the body may override them
+    params = {
+        'destination': data.get('destination', plan['destination']),
+        'budget': data.get('budget', plan['budget']),
+        'duration': data.get('duration', plan['duration']),
+        'interests': data.get('interests', json_loads(plan['interests']))
+    }
+    # Overrides are checked here; a bad one would otherwise fail inside generation as a 500
+    numbers = trip_numbers(params['budget'], params['duration'])
+    if not numbers:
+        return jsonify({'error': 'budget and duration must be numbers'}), 400
+    params['budget'], params['duration'] = numbers
+    if data.get('async'):
+        # The job re-checks the version at submit and claims it again when it attaches
+        return submit_itinerary_job(current_user_id, dict(params, plan_id=plan_id, version=plan['version']))
+    
+    try:
+        itinerary, cache_status = ai_service.generate_itinerary_with_status(
+            destination=params['destination'],
+            budget=float(params['budget']),
+            duration=int(params['duration']),
+            interests=params['interests']
+        )
     except Exception as e:
         return jsonify({'error': f'Failed to generate itinerary: {str(e)}'}), 500
+    
+    # Itinerary, days, activities and total_cost are written in one transaction, and only if nobody
+    # edited the plan while the model was running
+    conn = get_db_connection()
+    try:
+        if not claim_plan_version(conn, plan_id, current_user_id, plan['version']):
+            return plan_conflict(conn, plan_id, current_user_id)
+        attach_itinerary_to_plan(conn, plan_id, current_user_id, itinerary)
+        conn.commit()
+        plan = conn.execute('SELECT * FROM travel_plans WHERE id = ? AND user_id = ?',
+                           (plan_id, current_user_id)).fetchone()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+    
+    response = plan_response(plan)
+    response.headers['X-Itinerary-Cache'] = cache_status
+    return response
 
 # Places and Directions
+def parse_point(value) -> Optional[List[float]]:
+    """A [lng, lat] pair as floats, or None if value is not one"""
+    if not isinstance(value, (list, tuple)) or len(value) != 2 or any(isinstance(v, bool) for v in value):
+        return None
+    try:
+        lng, lat = float(value[0]), float(value[1])
+    except (TypeError, ValueError):
+        return None
+    if not (-180 <= lng <= 180 and -90 <= lat <= 90):  # also rejects NaN
+        return None
+    return [lng, lat]
+
 @app.route('/api/places/search', methods=['GET'])
+@rate_limited('places')
 def search_places():
     query = request.args.get('query')
     location = request.args.get('location')
@@ -670,17 +4059,90 @@ def search_places():
     return jsonify(places)
 
 @app.route('/api/directions', methods=['POST'])
+@rate_limited('directions')
 def get_directions():
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     
     if not all(field in data for field in ['start', 'end']):
         return jsonify({'error': 'Start and end coordinates required'}), 400
+    start, end = parse_point(data['start']), parse_point(data['end'])
+    if start is None or end is None:
+        return jsonify({'error': 'start and end must be [lng, lat] pairs'}), 400
     
     profile = data.get('profile', 'driving-car')
-    directions = openroute_service.get_directions(data['start'], data['end'], profile)
+    if profile not in ORS_PROFILES:
+        return jsonify({'error': f"profile must be one of {', '.join(ORS_PROFILES)}"}), 400
+    directions = openroute_service.get_directions(start, end, profile)
     
     return jsonify(directions)
 
+@app.route('/api/directions/batch', methods=['POST'])
+@token_required
+@rate_limited('directions')
+def get_plan_directions(current_user_id):
+    data = request.get_json(silent=True) or {}
+    
+    plan_id = data.get('plan_id')
+    if not plan_id:
+        return jsonify({'error': 'plan_id required'}), 400
+    profile = data.get('profile', 'driving-car')
+    if profile not in ORS_PROFILES:
+        return jsonify({'error': f"profile must be one of {', '.join(ORS_PROFILES)}"}), 400
+    detail = data.get('detail', 'summary')
+    if detail not in ('summary', 'full'):
+        return jsonify({'error': 'detail must be summary or full'}), 400
+    day = data.get('day')
+    if day is not None:
+        try:
+            day = int(day)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'day must be an integer'}), 400
+    
+    conn = get_db_connection(readonly=True)
+    plan = conn.execute('SELECT id FROM travel_plans WHERE id = ? AND user_id = ?',
+                       (plan_id, current_user_id)).fetchone()
+    if not plan:
+        conn.close()
+        return jsonify({'error': 'Travel plan not found'}), 404
+    
+    query = 'SELECT id, name, location, day FROM activities WHERE plan_id = ?'
+    params = [plan_id]
+    if day is not None:
+        query += ' AND day = ?'
+        params.append(day)
+    activities = conn.execute(query + ' ORDER BY day, position, time_slot', params).fetchall()
+    conn.close()
+    
+    # Consecutive activities with a location on the same day form a leg
+    legs = []
+    previous = None
+    for activity in activities:
+        try:
+            location = json_loads(activity['location'] or '{}')
+            point = [float(location['lng']), float(location['lat'])]
+        except (ValueError, KeyError, TypeError):
+            continue
+        if previous and previous[0]['day'] == activity['day']:
+            legs.append((previous[0], activity, previous[1], point))
+        previous = (activity, point)
+    
+    results, upstream_calls = openroute_service.get_legs([(leg[2], leg[3]) for leg in legs], profile, detail)
+    
+    return jsonify({
+        'plan_id': plan_id,
+        'profile': profile,
+        'detail': detail,
+        'upstream_calls': upstream_calls,
+        'legs': [{
+            'day': start['day'],
+            'from_activity_id': start['id'],
+            'to_activity_id': end['id'],
+            'start': start_point,
+            'end': end_point,
+            'result': result
+        } for (start, end, start_point, end_point), result in zip(legs, results)]
+    })
+
 # Activities
 @app.route('/api/activities', methods=['POST'])
 @token_required
@@ -700,6 +4162,13 @@ def create_activity(current_user_id):
         return jsonify({'error': 'Travel plan not found'}), 404
     
     activity_id = str(uuid.uuid4())
+    day = int(data.get('day', 1))
+    position = data.get('position')
+    if position is None:
+        # Append to the end of the day
+        last_position = conn.execute('SELECT MAX(position) FROM activities WHERE plan_id = ? AND day = ?',
+                                     (plan_id, day)).fetchone()[0]
+        position = 0 if last_position is None else last_position + 1
     activity = Activity(
         id=activity_id,
         plan_id=plan_id,
@@ -709,24 +4178,367 @@ def create_activity(current_user_id):
         cost=float(data.get('cost', 0)),
         duration=int(data.get('duration', 1)),
         category=data.get('category', 'other'),
-        day=int(data.get('day', 1)),
-        time_slot=data.get('time_slot', '09:00')
+        day=day,
+        time_slot=data.get('time_slot', '09:00'),
+        position=int(position)
     )
     
     try:
         conn.execute('''INSERT INTO activities 
-                       (id, plan_id, name, description, location, cost, duration, category, day, time_slot)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                    (activity.id, activity.plan_id, activity.name, activity.description,
-                     json.dumps(activity.location), activity.cost, activity.duration,
-                     activity.category, activity.day, activity.time_slot))
+                       (id, plan_id, name, description, location, cost, duration, category, day, time_slot, position)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', activity.to_row())
+        conn.execute('INSERT OR IGNORE INTO itinerary_days (plan_id, day) VALUES (?, ?)', (plan_id, day))
+        materialize_itinerary(conn, plan_id)
         conn.commit()
         
-        return jsonify(asdict(activity)), 201
+        return json_response(activity.to_json(), 201)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+def get_owned_activity(conn, activity_id: str, user_id: str):
+    return conn.execute('''SELECT a.*, p.version AS plan_version FROM activities a
+                          JOIN travel_plans p ON p.id = a.plan_id
+                          WHERE a.id = ? AND p.user_id = ?''', (activity_id, user_id)).fetchone()
+
+@app.route('/api/activities/<activity_id>', methods=['PUT'])
+@token_required
+def update_activity(current_user_id, activity_id):
+    data = request.get_json()
+    
+    conn = get_db_connection()
+    activity = get_owned_activity(conn, activity_id, current_user_id)
+    if not activity:
+        conn.close()
+        return jsonify({'error': 'Activity not found'}), 404
+    
+    # Early out on a stale version; claim_plan_version below is what makes the check atomic
+    if 'version' in data and data['version'] != activity['plan_version']:
+        conn.close()
+        return jsonify({'error': 'Travel plan has changed', 'version': activity['plan_version']}), 409
+    
+    update_fields = []
+    params = []
+    converters = {'name': str, 'description': str, 'location': json_dumps, 'cost': float,
+                  'duration': int, 'category': str, 'day': int, 'time_slot': str, 'position': int}
+    try:
+        for field, convert in converters.items():
+            if field in data:
+                update_fields.append(f'{field} = ?')
+                params.append(convert(data[field]))
+    except (TypeError, ValueError):
+        conn.close()
+        return jsonify({'error': 'Invalid activity fields'}), 400
+    
+    if update_fields:
+        if 'version' in data and not claim_plan_version(conn, activity['plan_id'], current_user_id,
+                                                          data['version']):
+            return plan_conflict(conn, activity['plan_id'], current_user_id)
+        params.append(activity_id)
+        conn.execute(f'UPDATE activities SET {", ".join(update_fields)} WHERE id = ?', params)
+        if 'day' in data:
+            conn.execute('INSERT OR IGNORE INTO itinerary_days (plan_id, day) VALUES (?, ?)',
+                         (activity['plan_id'], int(data['day'])))
+        materialize_itinerary(conn, activity['plan_id'])
+        conn.commit()
+    
+    activity = get_owned_activity(conn, activity_id, current_user_id)
+    conn.close()
+    
+    return jsonify(dict(Activity.from_row(activity).to_dict(), plan_version=activity['plan_version']))
+
+@app.route('/api/activities/<activity_id>', methods=['DELETE'])
+@token_required
+def delete_activity(current_user_id, activity_id):
+    conn = get_db_connection()
+    activity = get_owned_activity(conn, activity_id, current_user_id)
+    if not activity:
+        conn.close()
+        return jsonify({'error': 'Activity not found'}), 404
+    
+    conn.execute('DELETE FROM activities WHERE id = ?', (activity_id,))
+    materialize_itinerary(conn, activity['plan_id'])
+    conn.commit()
+    conn.close()
+    
+    return jsonify({'message': 'Activity deleted successfully'})
+
+# Spatial queries
+EARTH_RADIUS_KM = 6371.0088
+
+def distance_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle (haversine) distance"""
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def lng_ranges(min_lng: float, max_lng: float) -> List[Tuple[float, float]]:
+    """Split a longitude span that crosses the antimeridian into ranges inside [-180, 180]"""
+    if max_lng - min_lng >= 360:
+        return [(-180.0, 180.0)]
+    if min_lng < -180:
+        return [(min_lng + 360, 180.0), (-180.0, max_lng)]
+    if max_lng > 180:
+        return [(min_lng, 180.0), (-180.0, max_lng - 360)]
+    if min_lng > max_lng:
+        return [(min_lng, 180.0), (-180.0, max_lng)]
+    return [(min_lng, max_lng)]
+
+def find_activities_in_box(conn, user_id: str, min_lat: float, max_lat: float, min_lng: float,
+                           max_lng: float, plan_id: Optional[str], limit: Optional[int]) -> List:
+    """Rows of the user's activities inside the box, through the R*Tree"""
+    owner = conn.execute('SELECT spatial_key FROM users WHERE id = ?', (user_id,)).fetchone()
+    if not owner or owner['spatial_key'] is None:
+        return []
+    query = SPATIAL_QUERY
+    if plan_id:
+        query += ' AND a.plan_id = ?'
+    if limit is not None:
+        query += ' LIMIT ?'
+    rows = []
+    for low, high in lng_ranges(min_lng, max_lng):
+        params = [owner['spatial_key'], owner['spatial_key'], min_lat, max_lat, low, high, user_id,
+                  min_lat, max_lat, low, high]
+        if plan_id:
+            params.append(plan_id)
+        if limit is not None:
+            params.append(limit - len(rows))
+        rows.extend(conn.execute(query, params).fetchall())
+        if limit is not None and len(rows) >= limit:
+            break
+    return rows
+
+def spatial_activity_dict(row, **extra) -> Dict:
+    return dict(Activity.from_row(row).to_dict(), lat=row['lat'], lng=row['lng'],
+                destination=row['destination'], **extra)
+
+def spatial_plan_summary(activities: List[Dict]) -> List[Dict]:
+    """Per-plan counts and bounds of the matched activities"""
+    plans = {}
+    for activity in activities:
+        plan = plans.setdefault(activity['plan_id'], {
+            'plan_id': activity['plan_id'], 'destination': activity['destination'], 'count': 0,
+            'bbox': [activity['lng'], activity['lat'], activity['lng'], activity['lat']]
+        })
+        plan['count'] += 1
+        bbox = plan['bbox']
+        bbox[0], bbox[1] = min(bbox[0], activity['lng']), min(bbox[1], activity['lat'])
+        bbox[2], bbox[3] = max(bbox[2], activity['lng']), max(bbox[3], activity['lat'])
+    return list(plans.values())
+
+def spatial_limit() -> int:
+    limit = int(request.args.get('limit', app.config['SPATIAL_DEFAULT_LIMIT']))
+    return max(1, min(limit, app.config['SPATIAL_MAX_LIMIT']))
+
+@app.route('/api/activities/within', methods=['GET'])
+@token_required
+def get_activities_within(current_user_id):
+    """Activities inside a map viewport given as bbox=min_lng,min_lat,max_lng,max_lat"""
+    try:
+        min_lng, min_lat, max_lng, max_lat = [float(x) for x in request.args.get('bbox', '').split(',')]
+        limit = spatial_limit()
+    except ValueError:
+        return jsonify({'error': 'bbox=min_lng,min_lat,max_lng,max_lat required'}), 400
+    if not (-90 <= min_lat <= max_lat <= 90):
+        return jsonify({'error': 'Invalid bbox latitude range'}), 400
+    
+    conn = get_db_connection(readonly=True)
+    # One extra row tells whether the result was cut off
+    rows = find_activities_in_box(conn, current_user_id, min_lat, max_lat, min_lng, max_lng,
+                                  request.args.get('plan_id'), limit + 1)
+    conn.close()
+    
+    activities = [spatial_activity_dict(row) for row in rows[:limit]]
+    return jsonify({
+        'bbox': [min_lng, min_lat, max_lng, max_lat],
+        'activities': activities,
+        'plans': spatial_plan_summary(activities),
+        'truncated': len(rows) > limit
+    })
+
+@app.route('/api/activities/nearby', methods=['GET'])
+@token_required
+def get_activities_nearby(current_user_id):
+    """Activities within radius_km of lat/lng, or of activity_id, nearest first"""
+    try:
+        radius = float(request.args.get('radius_km', 1))
+        limit = spatial_limit()
+    except ValueError:
+        return jsonify({'error': 'Invalid radius_km or limit'}), 400
+    if not 0 < radius <= app.config['SPATIAL_MAX_RADIUS_KM']:
+        return jsonify({'error': f"radius_km must be between 0 and {app.config['SPATIAL_MAX_RADIUS_KM']}"}), 400
+    
+    conn = get_db_connection(readonly=True)
+    activity_id = request.args.get('activity_id')
+    if activity_id:
+        origin = get_owned_activity(conn, activity_id, current_user_id)
+        if not origin:
+            conn.close()
+            return jsonify({'error': 'Activity not found'}), 404
+        if origin['lat'] is None or origin['lng'] is None:
+            conn.close()
+            return jsonify({'error': 'Activity has no location'}), 400
+        lat, lng = origin['lat'], origin['lng']
+    else:
+        try:
+            lat, lng = float(request.args['lat']), float(request.args['lng'])
+        except (KeyError, ValueError):
+            conn.close()
+            return jsonify({'error': 'lat and lng, or activity_id, required'}), 400
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            conn.close()
+            return jsonify({'error': 'Invalid coordinates'}), 400
+    
+    # Box around the circle; longitude degrees shrink with cos(lat), so near the poles take every longitude
+    dlat = math.degrees(radius / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(lat))
+    dlng = 360.0 if cos_lat < 1e-6 else min(360.0, dlat / cos_lat)
+    rows = find_activities_in_box(conn, current_user_id, max(-90.0, lat - dlat), min(90.0, lat + dlat),
+                                  lng - dlng, lng + dlng, request.args.get('plan_id'), None)
+    conn.close()
+    
+    matches = []
+    for row in rows:
+        if row['id'] == activity_id:
+            continue
+        distance = distance_km(lat, lng, row['lat'], row['lng'])
+        if distance <= radius:
+            matches.append((distance, row))
+    matches.sort(key=lambda match: match[0])
+    
+    activities = [spatial_activity_dict(row, distance_km=round(distance, 3)) for distance, row in matches[:limit]]
+    return jsonify({
+        'center': {'lat': lat, 'lng': lng},
+        'radius_km': radius,
+        'activities': activities,
+        'plans': spatial_plan_summary(activities),
+        'truncated': len(matches) > limit
+    })
+
+# Bulk imports
+def string_errors(values: Dict) -> List[str]:
+    """Errors for any given value that is not a string; nested values would fail the insert for the whole batch"""
+    return [f'{field} must be a string' for field, value in values.items()
+            if value is not None and not isinstance(value, str)]
+
+def validate_activity(data) -> Tuple[Optional[Dict], List[str]]:
+    """Normalize one bulk activity row; returns (values, errors)"""
+    if not isinstance(data, dict):
+        return None, ['Row must be an object']
+    errors = []
+    if not data.get('name'):
+        errors.append('name is required')
+    values = {'name': data.get('name'), 'description': data.get('description', ''),
+              'category': data.get('category', 'other'), 'time_slot': data.get('time_slot', '09:00')}
+    errors += string_errors(values)
+    for field, convert, default in (('cost', float, 0), ('duration', int, 1), ('day', int, 1)):
+        try:
+            values[field] = convert(data.get(field, default))
+        except (TypeError, ValueError):
+            errors.append(f'{field} must be a number')
+    location = data.get('location', {})
+    if not isinstance(location, dict):
+        errors.append('location must be an object')
+    values['location'] = location
+    values['position'] = data.get('position')
+    if values['position'] is not None:
+        try:
+            values['position'] = int(values['position'])
+        except (TypeError, ValueError):
+            errors.append('position must be a number')
+    return (None if errors else values), errors
+
+def validate_expense(data) -> Tuple[Optional[Dict], List[str]]:
+    """Normalize one bulk expense row; returns (values, errors)"""
+    if not isinstance(data, dict):
+        return None, ['Row must be an object']
+    errors = [f'{field} is required' for field in ('category', 'amount', 'description', 'date')
+              if data.get(field) in (None, '')]
+    values = {'category': data.get('category'), 'description': data.get('description'),
+              'date': data.get('date')}
+    errors += string_errors(values)
+    if data.get('amount') not in (None, ''):
+        try:
+            values['amount'] = float(data['amount'])
+        except (TypeError, ValueError):
+            errors.append('amount must be a number')
+    return (None if errors else values), errors
+
+def bulk_results(rows: List, validator: Callable) -> Tuple[List[Dict], List[Tuple[int, Dict]]]:
+    """Validate every row up front; returns (per-row results, valid rows with their index)"""
+    results, valid = [], []
+    for index, row in enumerate(rows):
+        values, errors = validator(row)
+        if errors:
+            results.append({'index': index, 'status': 'invalid', 'errors': errors})
+        else:
+            results.append({'index': index, 'status': 'valid'})
+            valid.append((index, values))
+    return results, valid
+
+def bulk_response(results: List[Dict], created: int, status: int):
+    invalid = sum(1 for result in results if result['status'] == 'invalid')
+    return jsonify({'created': created, 'invalid': invalid, 'results': results}), status
+
+@app.route('/api/activities/bulk', methods=['POST'])
+@token_required
+def create_activities_bulk(current_user_id):
+    data = request.get_json()
+    
+    plan_id = data.get('plan_id')
+    rows = data.get('activities')
+    if not plan_id or not isinstance(rows, list):
+        return jsonify({'error': 'plan_id and an activities list are required'}), 400
+    if len(rows) > app.config['BULK_MAX_ROWS']:
+        return jsonify({'error': f"At most {app.config['BULK_MAX_ROWS']} rows per request"}), 413
+    
+    results, valid = bulk_results(rows, validate_activity)
+    # By default the import is all-or-nothing; partial=true keeps the valid rows
+    if len(valid) < len(rows) and not data.get('partial'):
+        return bulk_response(results, 0, 400)
+    
+    conn = get_db_connection()
+    plan = conn.execute('SELECT id FROM travel_plans WHERE id = ? AND user_id = ?',
+                       (plan_id, current_user_id)).fetchone()
+    if not plan:
+        conn.close()
+        return jsonify({'error': 'Travel plan not found'}), 404
+    
+    next_position = {day: position + 1 for day, position in conn.execute(
+        'SELECT day, MAX(position) FROM activities WHERE plan_id = ? GROUP BY day', (plan_id,))}
+    activity_rows = []
+    for index, values in valid:
+        position = values['position']
+        if position is None:
+            position = next_position.get(values['day'], 0)
+        next_position[values['day']] = max(next_position.get(values['day'], 0), position + 1)
+        activity_id = str(uuid.uuid4())
+        activity_rows.append((activity_id, plan_id, values['name'], values['description'],
+                              json_dumps(values['location']), values['cost'], values['duration'],
+                              values['category'], values['day'], values['time_slot'], position))
+        results[index].update(status='created', id=activity_id)
+    if not activity_rows:
+        # Nothing to write (every row was rejected, or the list was empty): the plan, its version and
+        # its ETag stay as they were
+        conn.close()
+        return bulk_response(results, 0, 201)
+    
+    try:
+        conn.executemany('''INSERT INTO activities
+                           (id, plan_id, name, description, location, cost, duration, category, day, time_slot, position)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', activity_rows)
+        conn.executemany('INSERT OR IGNORE INTO itinerary_days (plan_id, day) VALUES (?, ?)',
+                         {(plan_id, row[8]) for row in activity_rows})
+        materialize_itinerary(conn, plan_id)
+        conn.commit()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
         conn.close()
+    
+    return bulk_response(results, len(activity_rows), 201)
 
 # Expenses
 @app.route('/api/expenses', methods=['GET'])
@@ -736,20 +4548,77 @@ def get_expenses(current_user_id):
     if not plan_id:
         return jsonify({'error': 'plan_id parameter required'}), 400
     
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     
     # Verify plan ownership
-    plan = conn.execute('SELECT id FROM travel_plans WHERE id = ? AND user_id = ?',
-                       (plan_id, current_user_id)).fetchone()
+    plan = conn.execute('''SELECT expenses_version, expenses_updated_at FROM travel_plans
+                          WHERE id = ? AND user_id = ?''', (plan_id, current_user_id)).fetchone()
     if not plan:
         conn.close()
         return jsonify({'error': 'Travel plan not found'}), 404
     
-    expenses = conn.execute('SELECT * FROM expenses WHERE plan_id = ? ORDER BY date DESC',
-                           (plan_id,)).fetchall()
+    def build():
+        expenses = conn.execute('SELECT * FROM expenses WHERE plan_id = ? ORDER BY date DESC',
+                               (plan_id,)).fetchall()
+        return json_response(Expense.rows_to_json(expenses))
+    
+    response = conditional_response(f'expenses-{plan_id}-{plan["expenses_version"]}',
+                                    plan['expenses_updated_at'], build)
     conn.close()
+    return response
+
+@app.route('/api/expenses/summary', methods=['GET'])
+@token_required
+def get_expense_summary(current_user_id):
+    plan_id = request.args.get('plan_id')
+    if not plan_id:
+        return jsonify({'error': 'plan_id parameter required'}), 400
+    
+    conn = get_db_connection(readonly=True)
+    plan = conn.execute('''SELECT budget, itinerary_meta, version, updated_at, expenses_version, expenses_updated_at
+                          FROM travel_plans WHERE id = ? AND user_id = ?''',
+                       (plan_id, current_user_id)).fetchone()
+    if not plan:
+        conn.close()
+        return jsonify({'error': 'Travel plan not found'}), 404
+    
+    def build():
+        # expense_totals is kept current by triggers, so this reads O(categories x days) rows
+        by_category = conn.execute('''SELECT category, SUM(total) AS total, SUM(count) AS count
+                                     FROM expense_totals WHERE plan_id = ? GROUP BY category''',
+                                  (plan_id,)).fetchall()
+        by_day = conn.execute('''SELECT date, SUM(total) AS total, SUM(count) AS count
+                                FROM expense_totals WHERE plan_id = ? GROUP BY date ORDER BY date''',
+                             (plan_id,)).fetchall()
+        
+        meta = json_loads(plan['itinerary_meta']) if plan['itinerary_meta'] else {}
+        planned = meta.get('budget_breakdown') if isinstance(meta.get('budget_breakdown'), dict) else {}
+        spent = round(sum(row['total'] for row in by_category), 2)
+        
+        categories = []
+        for row in by_category:
+            category = {'category': row['category'], 'total': round(row['total'], 2), 'count': row['count']}
+            if row['category'] in planned:
+                category['planned'] = planned[row['category']]
+                category['remaining'] = round(_to_float(planned[row['category']]) - row['total'], 2)
+            categories.append(category)
+        
+        return jsonify({
+            'plan_id': plan_id,
+            'budget': plan['budget'],
+            'total_spent': spent,
+            'remaining': round(plan['budget'] - spent, 2),
+            'budget_breakdown': planned,
+            'by_category': categories,
+            'by_day': [{'date': row['date'], 'total': round(row['total'], 2), 'count': row['count']}
+                       for row in by_day]
+        })
     
-    return jsonify([dict(expense) for expense in expenses])
+    last_modified = max(filter(None, [plan['updated_at'], plan['expenses_updated_at']]), default=None)
+    response = conditional_response(f'summary-{plan_id}-{plan["version"]}-{plan["expenses_version"]}',
+                                    last_modified, build)
+    conn.close()
+    return response
 
 @app.route('/api/expenses', methods=['POST'])
 @token_required
@@ -783,16 +4652,160 @@ def create_expense(current_user_id):
     try:
         conn.execute('''INSERT INTO expenses 
                        (id, plan_id, category, amount, description, date, created_at)
-                       VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                    (expense.id, expense.plan_id, expense.category, expense.amount,
-                     expense.description, expense.date, expense.created_at))
+                       VALUES (?, ?, ?, ?, ?, ?, ?)''', expense.to_row())
         conn.commit()
         
-        return jsonify(asdict(expense)), 201
+        return json_response(expense.to_json(), 201)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+
+def parse_expense_upload() -> Tuple[Optional[str], List, bool]:
+    """Read a bulk expense body as JSON, CSV or NDJSON; returns (plan_id, rows, partial)"""
+    partial = request.args.get('partial', '').lower() in ('1', 'true', 'yes')
+    mimetype = request.mimetype
+    if mimetype == 'text/csv':
+        reader = csv.DictReader(io.StringIO(request.get_data(as_text=True)))
+        rows = [{key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+                for row in reader]
+        return request.args.get('plan_id'), rows, partial
+    if mimetype in ('application/x-ndjson', 'application/jsonlines'):
+        rows = []
+        for line in request.get_data(as_text=True).splitlines():
+            if line.strip():
+                try:
+                    rows.append(json_loads(line))
+                except ValueError:
+                    rows.append(None)
+        return request.args.get('plan_id'), rows, partial
+    
+    data = request.get_json()
+    rows = data.get('expenses')
+    return data.get('plan_id'), rows if isinstance(rows, list) else None, partial or bool(data.get('partial'))
+
+@app.route('/api/expenses/bulk', methods=['POST'])
+@token_required
+def create_expenses_bulk(current_user_id):
+    plan_id, rows, partial = parse_expense_upload()
+    if not plan_id or rows is None:
+        return jsonify({'error': 'plan_id and a list of expenses are required'}), 400
+    if len(rows) > app.config['BULK_MAX_ROWS']:
+        return jsonify({'error': f"At most {app.config['BULK_MAX_ROWS']} rows per request"}), 413
+    
+    results, valid = bulk_results(rows, validate_expense)
+    # By default the import is all-or-nothing; partial=true keeps the valid rows
+    if len(valid) < len(rows) and not partial:
+        return bulk_response(results, 0, 400)
+    
+    conn = get_db_connection()
+    plan = conn.execute('SELECT id FROM travel_plans WHERE id = ? AND user_id = ?',
+                       (plan_id, current_user_id)).fetchone()
+    if not plan:
+        conn.close()
+        return jsonify({'error': 'Travel plan not found'}), 404
+    
+    now = datetime.now().isoformat()
+    expense_rows = []
+    for index, values in valid:
+        expense_id = str(uuid.uuid4())
+        expense_rows.append((expense_id, plan_id, values['category'], values['amount'],
+                             values['description'], values['date'], now))
+        results[index].update(status='created', id=expense_id)
+    if not expense_rows:
+        conn.close()
+        return bulk_response(results, 0, 201)
+    
+    try:
+        conn.executemany('''INSERT INTO expenses 
+                           (id, plan_id, category, amount, description, date, created_at)
+                           VALUES (?, ?, ?, ?, ?, ?, ?)''', expense_rows)
+        conn.commit()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
         conn.close()
+    
+    return bulk_response(results, len(expense_rows), 201)
+
+# Search
+SEARCH_TYPES = ('plan', 'activity', 'expense')
+
+def search_owner(user_id: str) -> str:
+    """The single-token owner value stored in search_index for a user"""
+    return 'u' + user_id.replace('-', '')
+
+def build_search_query(user_id: str, text: str, prefix: bool = False) -> Optional[str]:
+    """Turn free text into an FTS5 query where every word must match; prefix extends the last word"""
+    terms = re.findall(r'\w+', text)[:app.config['SEARCH_MAX_TERMS']]
+    if not terms:
+        return None
+    # Words are quoted so user input is never parsed as FTS5 syntax
+    phrases = ' '.join(f'"{term}"' for term in terms)
+    if prefix:
+        # Prefix terms expand to every matching token across all users, so they cost more than whole words
+        phrases += '*'
+    return f'owner:"{search_owner(user_id)}" AND ({phrases})'
+
+@app.route('/api/search', methods=['GET'])
+@token_required
+def search(current_user_id):
+    text = request.args.get('q', '').strip()
+    prefix = request.args.get('prefix', '').lower() in ('1', 'true', 'yes')
+    query = build_search_query(current_user_id, text, prefix)
+    if not query:
+        return jsonify({'error': 'q parameter required'}), 400
+    
+    types = SEARCH_TYPES
+    if request.args.get('types'):
+        types = tuple(t.strip() for t in request.args['types'].split(',') if t.strip())
+        unknown = [t for t in types if t not in SEARCH_TYPES]
+        if unknown or not types:
+            return jsonify({'error': f'Unknown types: {", ".join(unknown)}'}), 400
+    try:
+        limit = int(request.args.get('limit', app.config['SEARCH_DEFAULT_LIMIT']))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or offset'}), 400
+    limit = max(1, min(limit, app.config['SEARCH_MAX_LIMIT']))
+    offset = max(0, offset)
+    
+    sql = f'''SELECT search_index.kind, search_index.ref_id, search_index.plan_id, search_index.title,
+                     search_index.category, snippet(search_index, 5, '', '', '…', 12) AS snippet,
+                     bm25(search_index, 0, 0, 0, 0, 10.0, 1.0, 2.0) AS score, p.destination
+              FROM search_index JOIN travel_plans p ON p.id = search_index.plan_id
+              WHERE search_index MATCH ? AND p.user_id = ?
+                AND search_index.kind IN ({", ".join("?" * len(types))})
+              ORDER BY score LIMIT ? OFFSET ?'''
+    conn = get_db_connection(readonly=True)
+    try:
+        # One extra row tells whether another page exists
+        rows = conn.execute(sql, [query, current_user_id, *types, limit + 1, offset]).fetchall()
+    except sqlite3.OperationalError as e:
+        return jsonify({'error': f'Invalid search query: {e}'}), 400
+    finally:
+        conn.close()
+    
+    next_offset = offset + limit if len(rows) > limit else None
+    response = jsonify({
+        'query': text,
+        'results': [{
+            'type': row['kind'],
+            'id': row['ref_id'],
+            'plan_id': row['plan_id'],
+            'destination': row['destination'],
+            'title': row['title'],
+            'snippet': row['snippet'],
+            'category': row['category'],
+            'score': round(-row['score'], 4)
+        } for row in rows[:limit]],
+        'limit': limit,
+        'offset': offset,
+        'next_offset': next_offset
+    })
+    if next_offset is not None:
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(dict(request.args, offset=next_offset))}>; rel="next"'
+    return response
 
 # Error Handlers
 @app.errorhandler(404)
@@ -803,7 +4816,23 @@ def not_found(error):
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
+# Process lifecycle, shared by the development server and gunicorn.conf.py
+def start_services():
+    """Per-process startup once the schema exists"""
+    itinerary_jobs.resume_pending(app.config['ITINERARY_JOB_STALE_AFTER'])
+
+def shutdown_services(timeout: float):
+    """Drain background work and release pools before the process exits"""
+    if not itinerary_jobs.shutdown(timeout):
+        print("Shutdown: itinerary jobs still running, they will be resumed by another worker")
+    ai_service.close()
+    openroute_service.close()
+    password_hasher.shutdown()
+    for pool in db_pools.values():
+        pool.close_all()
+
 if __name__ == '__main__':
     init_db()
+    start_services()
 
     app.run(debug=True, host='0.0.0.0', port=5000)
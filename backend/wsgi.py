@@ -0,0 +1,4 @@
+"""WSGI entry point for production servers; see gunicorn.conf.py for the supported setup"""
+from tp import app
+
+application = app